@@ -0,0 +1,380 @@
+#! /usr/bin/env python
+"""
+Measures the generated C parsers of a transposed header: a driver calling every parser with values of its group
+(hits) and values outside of it (misses) is compiled at -O2 and run, and the time per lookup, the code size of each
+parser and the size of the generated files are reported, for comparison between code generation strategies:
+    transpose --style lookup log.h log_parsers.h
+    python -m benchmarks.c_parsers log_parsers.h --output lookup.json
+    python -m benchmarks.c_parsers log_switch_parsers.h --compare lookup.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+from transpose.enums import iter_enum_groups
+from transpose.fast_parser import FRONTENDS
+from transpose.macros import group_defines
+from transpose.macro_creator import LLONG_MAX, ULLONG_MAX
+from transpose.transpose import parse_headers, parse_macro_arguments, default_source, header_group_prefix
+from .run import current_commit
+
+INCLUDE_REGEX = re.compile(r'#include "([^"]+)"')
+PARSER_REGEX = re.compile(r'^#define (\w+)_PARSER\(n, buf\)', re.MULTILINE)
+FROM_STR_REGEX = re.compile(r'^(?:static inline )?int (\w+)_FROM_STR\(const char \*str, ([\w ]+) \*value\)',
+                            re.MULTILINE)
+# a symbol of nm -S output: address, size, type and name (gcc names partial and specialised copies name.part.0 etc.)
+SYMBOL_REGEX = re.compile(r'^[0-9a-fA-F]+ ([0-9a-fA-F]+) [tTwW] ([\w.]+)$', re.MULTILINE)
+RESULT_REGEX = re.compile(r'^(hit|miss) (\w+) ([\d.]+)$', re.MULTILINE)
+# number of values each parser is called with in a loop, hits and misses separately
+SAMPLES = 1024
+DEFAULT_LOOKUPS = 10 ** 6
+DEFAULT_REPEAT = 5
+
+DRIVER_HEADER = '''#define _POSIX_C_SOURCE 199309L
+#include <stdio.h>
+#include <time.h>
+#include "{header}"
+
+static volatile unsigned long long sink;
+
+static double now_ns(void)
+{{
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return now.tv_sec * 1e9 + now.tv_nsec;
+}}
+'''
+
+
+def c_literal(value: int):
+    """
+    :param value: integer value, up to ULLONG_MAX
+    :return: long long C literal of the value, wrapped to a negative value above LLONG_MAX (as it is converted)
+    :rtype: str
+    """
+    if value > LLONG_MAX:
+        value -= ULLONG_MAX + 1
+    if value == -LLONG_MAX - 1:
+        return f'(-{LLONG_MAX}LL - 1)'
+    return f'{value}LL'
+
+
+def parser_groups(header: str, macros: dict, include_dirs: list, recursive=False, frontend='fast', compiler='gcc',
+                  group_prefix=''):
+    """
+    Groups the definitions of the original header as transpose does, to know the values of each parser
+    :param header: path of the original header
+    :param macros: dictionary of macros the header was transposed with
+    :param include_dirs: list of include directories
+    :param recursive: True if the header was transposed with its included headers (-r)
+    :param frontend: front end parsing the headers (see FRONTENDS)
+    :param compiler: compiler of the compiler front end, and whose search path is used with recursive
+    :param group_prefix: prefix of the names of the default groups and the anonymous enums (see header_group_prefix)
+    :return: dictionary where [parser name] = dictionary where [C name] = value, of the groups of integer values
+    :rtype: dict
+    """
+    paths = [header]
+    if recursive:
+        from transpose.recursive_utils import RecursiveUtil
+        paths = RecursiveUtil(header, False, include_dirs, compiler, 10 ** 6).create_header_traversal_list()
+    if frontend == 'compiler':
+        from transpose.compiler_parser import compiler_definitions
+        found_macros, enums = compiler_definitions(paths, macros, include_dirs, compiler)
+    else:
+        parser = parse_headers(paths, macros, frontend=frontend)
+        found_macros, enums = dict(parser.defs['macros']), parser.defs['enums']
+    prefix_creators, default_creators = group_defines(found_macros, group_prefix=group_prefix)
+    groups = {}
+    for creator in list(iter_enum_groups(enums, group_prefix)) + prefix_creators + default_creators:
+        if creator.cdefs and all(isinstance(cdef.value, int) for cdef in creator.cdefs):
+            groups[creator.name.upper()] = {cdef.name: cdef.value for cdef in creator.cdefs}
+    return groups
+
+
+def sample_values(values: list, flags: bool, rng: random.Random):
+    """
+    :param values: list of the values of a group
+    :param flags: True to sample combinations of flags, False to sample single values
+    :param rng: random generator, seeded so runs are comparable
+    :return: list of values of the group (hits) and list of values outside of it (misses), empty if there are none
+    :rtype: tuple(list, list)
+    """
+    if flags:
+        bits = [value for value in values if value != 0]
+        mask = sum(bits)
+        unknown = [1 << bit for bit in range(64) if not mask & (1 << bit)]
+        hits = [sum(rng.sample(bits, rng.randint(1, min(3, len(bits))))) for _ in range(SAMPLES)]
+        misses = [hit | rng.choice(unknown) for hit in hits] if unknown else []
+        return hits, misses
+    known = set(values)
+    low, high = min(values), max(values)
+    span = max(len(values), high - low + 1)
+    candidates = (rng.randint(max(low - span, -LLONG_MAX - 1), min(high + span, ULLONG_MAX))
+                  for _ in range(4 * SAMPLES))
+    misses = [value for value in candidates if value not in known][:SAMPLES]
+    return [rng.choice(values) for _ in range(SAMPLES)], misses
+
+
+def sample_names(names: list, rng: random.Random):
+    """
+    :param names: list of the names of a group
+    :param rng: random generator
+    :return: list of names of the group (hits) and list of names outside of it (misses), half of them differing only
+             in the last character
+    :rtype: tuple(list, list)
+    """
+    known = set(names)
+    hits = [rng.choice(names) for _ in range(SAMPLES)]
+    misses = []
+    for i, hit in enumerate(hits):
+        miss = hit[:-1] + '#' if i % 2 else f'{hit}_{i}'
+        misses.append(miss if miss not in known else f'#{i}')
+    return hits, misses
+
+
+def create_driver(header: str, groups: dict, lookups: int, repeat: int, seed=0):
+    """
+    Creates the C driver of the parsers of a transposed header
+    :param header: content of the transposed header
+    :param groups: groups of the parsers (see parser_groups)
+    :param lookups: number of lookups timed per measurement
+    :param repeat: number of measurements, the fastest is reported
+    :param seed: seed of the sampled values
+    :return: the driver's source, and list of the names of the benchmarked parsers (parsers whose values are not
+             known are skipped)
+    :rtype: tuple(str, list)
+    """
+    rng = random.Random(seed)
+    functions, calls, benchmarked = [], [], []
+    rounds = max(1, lookups // SAMPLES)
+
+    def benchmark(kind: str, name: str, function: str, samples: list, sample_type: str):
+        array = f'{kind}_{name}'
+        functions.append(f'static const {sample_type} {array}[{len(samples)}] = {{\n    ' +
+                         ',\n    '.join(samples) + '\n};')
+        calls.append(f'''    best = 0;
+    for (run = 0; run < {repeat}; run++) {{
+        double start = now_ns();
+        for (pass = 0; pass < {rounds}; pass++)
+            for (i = 0; i < {len(samples)}; i++)
+                sink += {function}({array}[i]);
+        double elapsed = (now_ns() - start) / ({rounds}.0 * {len(samples)});
+        if (run == 0 || elapsed < best)
+            best = elapsed;
+    }}
+    printf("{kind} {name} %.3f\\n", best);''')
+
+    for parser in PARSER_REGEX.findall(header):
+        flags = parser not in groups and parser.endswith('_FLAGS') and parser[:-len('_FLAGS')] in groups
+        values = groups.get(parser[:-len('_FLAGS')] if flags else parser)
+        if values is None:
+            continue
+        benchmarked.append(f'{parser}_PARSER')
+        # the parsers are called through functions which are not inlined, so each of them is measured (and sized)
+        # as a single call site
+        functions.append(f'''__attribute__((noinline)) static int parse_{parser}(long long n)
+{{
+    char buf[{parser}_MAX_LEN];
+    {parser}_PARSER(n, buf);
+    return buf[0];
+}}''')
+        hits, misses = sample_values(list(values.values()), flags, rng)
+        for kind, samples in (('hit', hits), ('miss', misses)):
+            if samples:
+                benchmark(kind, f'{parser}_PARSER', f'parse_{parser}', [c_literal(value) for value in samples],
+                          'long long')
+    for group, value_type in FROM_STR_REGEX.findall(header):
+        if group not in groups:
+            continue
+        benchmarked.append(f'{group}_FROM_STR')
+        functions.append(f'''__attribute__((noinline)) static int from_str_{group}(const char *str)
+{{
+    {value_type} value = 0;
+    return {group}_FROM_STR(str, &value) + (int)value;
+}}''')
+        for kind, samples in zip(('hit', 'miss'), sample_names(list(groups[group]), rng)):
+            benchmark(kind, f'{group}_FROM_STR', f'from_str_{group}', [f'"{name}"' for name in samples],
+                      'char *const')
+    main = ['int main(void)', '{', '    double best;', '    int run;', '    unsigned long pass, i;'] + calls + \
+        ['    return 0;', '}']
+    return '\n\n'.join(functions + ['\n'.join(main)]) + '\n', benchmarked
+
+
+def run_tool(args: list):
+    """
+    :param args: command line of a compiler or binutils tool
+    :return: the tool's output, raises RuntimeError if it fails
+    :rtype: str
+    """
+    try:
+        result = subprocess.run(args, capture_output=True, text=True)
+    except OSError as error:
+        raise RuntimeError(f'could not run {args[0]}: {error}') from None
+    if result.returncode != 0:
+        raise RuntimeError(f'{" ".join(args)} failed:\n{result.stderr.strip()}')
+    return result.stdout
+
+
+def code_sizes(objects: list, parsers: list, nm='nm'):
+    """
+    :param objects: list of paths of the compiled objects of the driver and the generated source file
+    :param parsers: list of the names of the benchmarked parsers
+    :param nm: path/name of nm
+    :return: dictionary where [parser] = bytes of code of the parser's call site and the functions it calls, None if
+             nm could not be run
+    :rtype: dict
+    """
+    try:
+        symbols = [(name.split('.')[0], int(size, 16)) for objects_path in objects
+                   for size, name in SYMBOL_REGEX.findall(run_tool([nm, '-S', '--defined-only', objects_path]))]
+    except RuntimeError:
+        return None
+    sizes = {}
+    for parser in parsers:
+        name = parser[:-len('_PARSER')] if parser.endswith('_PARSER') else parser[:-len('_FROM_STR')]
+        own = {f'parse_{name}', f'{name}_TO_STR'} if parser.endswith('_PARSER') else \
+            {f'from_str_{name}', f'{name}_FROM_STR'}
+        sizes[parser] = sum(size for symbol, size in symbols if symbol in own)
+    return sizes
+
+
+def benchmark_header(path: str, macros=(), include_dirs=(), recursive=False, frontend='fast', compiler='gcc',
+                     lookups=DEFAULT_LOOKUPS, repeat=DEFAULT_REPEAT):
+    """
+    Compiles a driver of the parsers of a transposed header (and its source file, for the functions style) with
+    compiler -O2, and runs it
+    :param path: path of the transposed header, next to the original header it includes
+    :param macros: list of macros the header was transposed with (i.e DEBUG=1)
+    :param include_dirs: list of include directories
+    :param recursive: True if the header was transposed with its included headers (-r)
+    :param frontend: front end used to find the values of the parsers (see FRONTENDS)
+    :param compiler: path/name of the compiler
+    :param lookups: number of lookups timed per measurement
+    :param repeat: number of measurements, the fastest is reported
+    :return: results, in the format written to json
+    :rtype: dict
+    """
+    with open(path, 'r') as reader:
+        header = reader.read()
+    included = INCLUDE_REGEX.search(header)
+    if included is None:
+        raise ValueError(f'{path} does not include the header it was transposed from')
+    directory = os.path.dirname(os.path.abspath(path))
+    macros_dict = parse_macro_arguments(list(macros), list(include_dirs))
+    source_path = default_source(path)
+    source_size = os.path.getsize(source_path) if os.path.exists(source_path) else None
+    style = 'functions' if source_size is not None else 'lookup' if '_TO_STR(' in header else 'switch'
+    groups = parser_groups(os.path.join(directory, included.group(1)), macros_dict, list(include_dirs), recursive,
+                           frontend, compiler, header_group_prefix(path, style, 'c', '_FROM_STR(' in header))
+    driver, parsers = create_driver(header, groups, lookups, repeat)
+    flags = ['-O2', '-I', directory] + [f'-D{macro}' for macro in macros]
+    for include_dir in include_dirs:
+        flags += ['-I', include_dir]
+    with tempfile.TemporaryDirectory() as build:
+        driver_path = os.path.join(build, 'driver.c')
+        with open(driver_path, 'w') as writer:
+            writer.write(f'{DRIVER_HEADER.format(header=os.path.abspath(path))}\n{driver}')
+        objects = [os.path.join(build, 'driver.o')]
+        run_tool([compiler] + flags + ['-c', driver_path, '-o', objects[0]])
+        if source_size is not None:
+            objects.append(os.path.join(build, 'source.o'))
+            run_tool([compiler] + flags + ['-c', source_path, '-o', objects[1]])
+        run_tool([compiler] + objects + ['-o', os.path.join(build, 'driver')])
+        output = run_tool([os.path.join(build, 'driver')])
+        sizes = code_sizes(objects, parsers)
+    results = {parser: {'hit_ns': None, 'miss_ns': None, 'code_size': sizes and sizes[parser]} for parser in parsers}
+    for kind, parser, nanoseconds in RESULT_REGEX.findall(output):
+        results[parser][f'{kind}_ns'] = float(nanoseconds)
+    return {
+        'commit': current_commit(),
+        'header': path,
+        'compiler': compiler,
+        'lookups': lookups,
+        'header_size': len(header.encode()),
+        'source_size': source_size,
+        'skipped': len(PARSER_REGEX.findall(header)) + len(FROM_STR_REGEX.findall(header)) - len(parsers),
+        'parsers': results,
+    }
+
+
+def format_results(results: dict):
+    """
+    :param results: results of benchmark_header
+    :return: table of the time per lookup and the code size of the parsers, and the size of the generated files
+    :rtype: str
+    """
+    def number(value, precision=''):
+        return '-' if value is None else f'{value:{precision}}'
+
+    lines = [f'{"parser":<40} {"hit ns":>8} {"miss ns":>8} {"code bytes":>10}']
+    for parser, result in results['parsers'].items():
+        lines.append(f'{parser:<40} {number(result["hit_ns"], ".2f"):>8} {number(result["miss_ns"], ".2f"):>8} '
+                     f'{number(result["code_size"]):>10}')
+    lines.append(f'header: {results["header_size"]} bytes, source file: {number(results["source_size"])} bytes, '
+                 f'{results["skipped"]} parsers skipped (values not found)')
+    return '\n'.join(lines)
+
+
+def compare(results: dict, baseline: dict):
+    """
+    :param results: results of benchmark_header
+    :param baseline: results of a previous run (i.e of another style)
+    :return: table of the time per lookup and the code size of the parsers in both runs
+    :rtype: str
+    """
+    def ratio(current, previous):
+        return '-' if not current or not previous else f'{current / previous:.2f}'
+
+    lines = [f'{"parser":<40} {"hit ratio":>9} {"miss ratio":>10} {"size ratio":>10}']
+    for parser, result in results['parsers'].items():
+        previous = baseline['parsers'].get(parser)
+        if previous is None:
+            continue
+        lines.append(f'{parser:<40} {ratio(result["hit_ns"], previous["hit_ns"]):>9} '
+                     f'{ratio(result["miss_ns"], previous["miss_ns"]):>10} '
+                     f'{ratio(result["code_size"], previous["code_size"]):>10}')
+    lines.append(f'header size ratio: {ratio(results["header_size"], baseline["header_size"])}')
+    return '\n'.join(lines)
+
+
+def _main():
+    parser = argparse.ArgumentParser(prog='benchmarks.c_parsers', description='Time the generated parsers of a '
+                                                                              'transposed header')
+    parser.add_argument('header', help='transposed header, next to the header it was transposed from')
+    parser.add_argument('-D', action='append', default=[], metavar='macro[=defn]',
+                        help='macros the header was transposed with')
+    parser.add_argument('-I', action='append', default=[], metavar='dir', help='include directories')
+    parser.add_argument('-r', dest='recursive', action='store_true',
+                        help='the header was transposed with its included headers')
+    parser.add_argument('--frontend', choices=FRONTENDS, default='fast',
+                        help='front end finding the values of the parsers (fast by default)')
+    parser.add_argument('--compiler', default='gcc', help='compiler of the driver (gcc by default)')
+    parser.add_argument('--lookups', type=int, default=DEFAULT_LOOKUPS,
+                        help=f'number of lookups timed per measurement ({DEFAULT_LOOKUPS} by default)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help=f'number of measurements, the fastest is reported ({DEFAULT_REPEAT} by default)')
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--compare', metavar='baseline.json', help='compare the results to a previous run')
+    args = parser.parse_args()
+    try:
+        results = benchmark_header(args.header, args.D, args.I, args.recursive, args.frontend, args.compiler,
+                                   args.lookups, args.repeat)
+    except (OSError, ValueError, RuntimeError) as error:
+        print(error, file=sys.stderr)
+        return -1
+    if args.output is not None:
+        with open(args.output, 'w') as writer:
+            json.dump(results, writer, indent=4)
+    print(format_results(results))
+    if args.compare is not None:
+        with open(args.compare, 'r') as reader:
+            print(compare(results, json.load(reader)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
@@ -0,0 +1,88 @@
+import os
+
+
+def write_header(directory: str, name: str, content: str):
+    """
+    :param directory: directory to create the header in
+    :param name: file name of the header
+    :param content: content of the header
+    :return: path of the created header
+    :rtype: str
+    """
+    path = os.path.join(directory, name)
+    with open(path, 'w') as writer:
+        writer.write(content)
+    return path
+
+
+def prefixed_groups(groups: int, size: int):
+    """
+    Defines groups of macros sharing a prefix, half of the groups are bit flags and half are sequential values
+    :param groups: number of prefixes
+    :param size: number of macros with each prefix
+    :return: header content
+    :rtype: str
+    """
+    lines = []
+    for group in range(groups):
+        for i in range(size):
+            value = f'0x{1 << (i % 64):x}ULL' if group % 2 else f'{i}'
+            lines.append(f'#define GROUP{group}_NAME{i} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def forward_chain(length: int):
+    """
+    Defines a chain of macros where each macro refers to the macro defined after it
+    :param length: number of macros in the chain
+    :return: header content
+    :rtype: str
+    """
+    lines = [f'#define CHAIN_{i} (CHAIN_{i + 1} + 1)' for i in range(length - 1)]
+    lines.append(f'#define CHAIN_{length - 1} 0')
+    return '\n'.join(lines) + '\n'
+
+
+def value_collisions(count: int, distinct: int):
+    """
+    Defines macros without a shared prefix, whose values repeat
+    :param count: number of macros
+    :param distinct: number of distinct values
+    :return: header content
+    :rtype: str
+    """
+    return ''.join(f'#define LONE{i} {i % distinct}\n' for i in range(count))
+
+
+def big_enums(enums: int, size: int):
+    """
+    Declares enums with many values, some of them sharing values
+    :param enums: number of enums
+    :param size: number of values in each enum
+    :return: header content
+    :rtype: str
+    """
+    declarations = []
+    for enum in range(enums):
+        values = [f'    ENUM{enum}_VALUE{i} = {i - i % 8 if i % 16 == 0 else i},' for i in range(size)]
+        declarations.append(f'typedef enum enum{enum} {{\n' + '\n'.join(values) + f'\n}} enum{enum}_t;\n')
+    return '\n'.join(declarations)
+
+
+def include_dag(directory: str, width: int, depth: int, defines=4):
+    """
+    Creates headers arranged in levels, where each header includes all the headers of the next level
+    :param directory: directory to create the headers in
+    :param width: number of headers in each level
+    :param depth: number of levels
+    :param defines: number of macros each header defines
+    :return: path of the top header, which includes the first level
+    :rtype: str
+    """
+    for level in reversed(range(depth)):
+        for index in range(width):
+            includes = ''.join(f'#include "level{level + 1}_{i}.h"\n' for i in range(width)) \
+                if level + 1 < depth else ''
+            content = ''.join(f'#define L{level}_{index}_MACRO{i} {i}\n' for i in range(defines))
+            write_header(directory, f'level{level}_{index}.h', includes + content)
+    return write_header(directory, 'top.h', ''.join(f'#include "level0_{i}.h"\n' for i in range(width)))
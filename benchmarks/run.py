@@ -0,0 +1,231 @@
+#! /usr/bin/env python
+"""
+Times the stages of transpose on synthetic headers, and records the results to json for comparison between commits:
+    python -m benchmarks.run --scale medium --output results.json --compare previous.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pyclibrary import CParser
+from transpose.enums import create_enum_macros
+from transpose.fast_parser import FastParser
+from transpose.macros import Define, parse_macros_values, find_prefixes, merge_prefixes, create_define_macros
+from transpose.recursive_utils import RecursiveUtil
+from transpose.transpose import main
+from . import generators
+
+# arguments of the generators, by scale
+SCALES = {
+    'small': dict(groups=(20, 20), chain=200, collisions=(500, 50), enums=(5, 100), dag=(4, 3)),
+    'medium': dict(groups=(100, 50), chain=1000, collisions=(2000, 200), enums=(20, 200), dag=(6, 4)),
+    'large': dict(groups=(400, 50), chain=5000, collisions=(10000, 1000), enums=(50, 500), dag=(10, 5)),
+}
+
+
+def create_cases(directory: str, scale: str):
+    """
+    Generates the synthetic headers of a scale
+    :param directory: directory to create the headers in
+    :param scale: one of SCALES
+    :return: dictionary where [case name] = path of the case's top header
+    :rtype: dict
+    """
+    arguments = SCALES[scale]
+    cases = {
+        'prefixed_groups': generators.write_header(directory, 'groups.h',
+                                                   generators.prefixed_groups(*arguments['groups'])),
+        'forward_chain': generators.write_header(directory, 'chain.h', generators.forward_chain(arguments['chain'])),
+        'value_collisions': generators.write_header(directory, 'collisions.h',
+                                                    generators.value_collisions(*arguments['collisions'])),
+        'big_enums': generators.write_header(directory, 'enums.h', generators.big_enums(*arguments['enums'])),
+    }
+    dag_directory = os.path.join(directory, 'dag')
+    os.makedirs(dag_directory, exist_ok=True)
+    cases['include_dag'] = generators.include_dag(dag_directory, *arguments['dag'])
+    return cases
+
+
+def create_defines(macros: dict):
+    """
+    :param macros: dictionary of resolved macros
+    :return: list of Define's of the integral macros
+    :rtype: list
+    """
+    defines = []
+    for name, value in macros.items():
+        try:
+            defines.append(Define(name, value))
+        except (ValueError, TypeError):
+            pass
+    return defines
+
+
+def parsed_defines(path: str):
+    """
+    :param path: path of a header
+    :return: list of Define's of the resolved macros of the header
+    :rtype: list
+    """
+    return create_defines(parse_macros_values(CParser([path]).defs['macros']))
+
+
+def create_stages(path: str, recursive: bool, out_path: str):
+    """
+    Creates the stages timed for a case. each stage is a pair of a setup function, returning the arguments of the
+    timed function (so inputs the stage modifies are recreated outside of the timing), and the timed function
+    :param path: path of the case's top header
+    :param recursive: True to time the stages of recursion mode, instead of the single header stages
+    :param out_path: path of the output of the end to end stage
+    :return: dictionary where [stage name] = (setup, function)
+    :rtype: dict
+    """
+    def end_to_end():
+        if main(path, out_path, [], recursive, False, 'gcc', [os.path.dirname(path)], 10 ** 6, True) != 0:
+            raise RuntimeError(f'transposing {path} failed')
+
+    if recursive:
+        return {
+            'build_dependencies_graph': (
+                lambda: (RecursiveUtil(path, False, [os.path.dirname(path)], 'gcc', 10 ** 6), ),
+                lambda util: util.build_dependencies_graph()),
+            'main': (tuple, end_to_end),
+        }
+    defs = CParser([path]).defs
+    resolved = parse_macros_values(dict(defs['macros']))
+    defines = create_defines(resolved)
+    return {
+        'parse': (lambda: (path, ), lambda header: CParser([header])),
+        'parse_fast': (lambda: (FastParser([path]), ), lambda parser: parser.process_all()),
+        'parse_macros_values': (lambda: (dict(defs['macros']), ), parse_macros_values),
+        'create_defines': (lambda: (resolved, ), create_defines),
+        'find_prefixes': (lambda: (list(defines), ), lambda subject: merge_prefixes(find_prefixes(subject)[0])),
+        'create_define_macros': (lambda: (dict(defs['macros']), ), create_define_macros),
+        'create_enum_macros': (lambda: (defs['enums'], ), create_enum_macros),
+        'main': (tuple, end_to_end),
+    }
+
+
+def time_stage(setup, function, repeat: int):
+    """
+    :param setup: function returning the arguments of function
+    :param function: the timed function
+    :param repeat: number of runs
+    :return: dictionary of the times of the runs, in seconds, and the peak memory allocated by a run, in bytes
+             (measured by another run, as tracing the allocations slows it)
+    :rtype: dict
+    """
+    runs = []
+    for _ in range(repeat):
+        arguments = setup()
+        start = time.perf_counter()
+        function(*arguments)
+        runs.append(time.perf_counter() - start)
+    arguments = setup()
+    tracemalloc.start()
+    try:
+        result = function(*arguments)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del result
+    return {'min': min(runs), 'median': statistics.median(runs), 'runs': runs, 'peak_memory': peak_memory}
+
+
+def current_commit():
+    """
+    :return: the git commit of the working tree, None if it is not known
+    :rtype: str
+    """
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def run_benchmarks(scale='small', repeat=3, cases=None, stages=None):
+    """
+    Generates the synthetic headers of a scale and times the stages of transpose on them
+    :param scale: one of SCALES
+    :param repeat: number of runs of each stage
+    :param cases: list of case names to run, None to run all of them
+    :param stages: list of stage names to run, None to run all of them
+    :return: results, in the format written to json
+    :rtype: dict
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for case, path in create_cases(directory, scale).items():
+            if cases is not None and case not in cases:
+                continue
+            out_path = os.path.join(directory, f'{case}_out.h')
+            case_stages = create_stages(path, case == 'include_dag', out_path)
+            results[case] = {stage: time_stage(setup, function, repeat)
+                             for stage, (setup, function) in case_stages.items()
+                             if stages is None or stage in stages}
+    return {
+        'commit': current_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': scale,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(results: dict, baseline: dict):
+    """
+    :param results: results of run_benchmarks
+    :param baseline: results of a previous run
+    :return: table of the minimal times and the peak memory of the stages in both runs
+    :rtype: str
+    """
+    lines = [f'{"case":<20} {"stage":<26} {"baseline":>10} {"current":>10} {"ratio":>7} {"memory ratio":>13}']
+    for case, stages in results['results'].items():
+        for stage, timing in stages.items():
+            previous = baseline['results'].get(case, {}).get(stage)
+            if previous is None:
+                continue
+            ratio = timing['min'] / previous['min'] if previous['min'] else float('inf')
+            memory_ratio = '-'
+            if previous.get('peak_memory'):  # results recorded before memory was measured don't have it
+                memory_ratio = f'{timing["peak_memory"] / previous["peak_memory"]:.2f}'
+            lines.append(f'{case:<20} {stage:<26} {previous["min"]:>10.4f} {timing["min"]:>10.4f} {ratio:>7.2f} '
+                         f'{memory_ratio:>13}')
+    return '\n'.join(lines)
+
+
+def _main():
+    parser = argparse.ArgumentParser(prog='benchmarks.run', description='Time the stages of transpose on synthetic '
+                                                                        'headers')
+    parser.add_argument('--scale', choices=SCALES, default='small', help='size of the generated headers')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs of each stage (3 by default)')
+    parser.add_argument('--case', action='append', dest='cases', help='run only this case (can be repeated)')
+    parser.add_argument('--stage', action='append', dest='stages', help='run only this stage (can be repeated)')
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--compare', metavar='baseline.json', help='compare the results to a previous run')
+    args = parser.parse_args()
+    results = run_benchmarks(args.scale, args.repeat, args.cases, args.stages)
+    if args.output is not None:
+        with open(args.output, 'w') as writer:
+            json.dump(results, writer, indent=4)
+    if args.compare is not None:
+        with open(args.compare, 'r') as reader:
+            print(compare(results, json.load(reader)))
+    else:
+        for case, stages in results['results'].items():
+            for stage, timing in stages.items():
+                print(f'{case:<20} {stage:<26} {timing["min"]:>10.4f}s {timing["peak_memory"] // 1024:>10}KB')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
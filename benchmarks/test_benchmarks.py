@@ -0,0 +1,51 @@
+"""
+The benchmarks as pytest-benchmark tests, on the small scale, and tests of the benchmarks themselves (which don't need
+pytest-benchmark):
+    python -m pytest benchmarks --benchmark-json results.json
+"""
+import importlib.util
+import os
+import shutil
+import pytest
+from transpose import CParser, RecursiveUtil, main
+from .c_parsers import benchmark_header
+from .run import create_cases, create_stages
+
+SYSTEM_TEST_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'system_test')
+HEADER_STAGES = ('parse', 'parse_fast', 'parse_macros_values', 'create_defines', 'find_prefixes',
+                 'create_define_macros', 'create_enum_macros', 'main')
+PARAMETERS = [(case, stage) for case in ('prefixed_groups', 'forward_chain', 'value_collisions', 'big_enums')
+              for stage in HEADER_STAGES] + [('include_dag', 'build_dependencies_graph'), ('include_dag', 'main')]
+
+
+@pytest.fixture(scope='module')
+def cases(tmp_path_factory):
+    return create_cases(str(tmp_path_factory.mktemp('headers')), 'small')
+
+
+@pytest.mark.skipif(importlib.util.find_spec('pytest_benchmark') is None, reason='needs pytest-benchmark')
+@pytest.mark.parametrize('case, stage', PARAMETERS)
+def test_stage(benchmark, cases, case, stage, tmp_path):
+    setup, function = create_stages(cases[case], case == 'include_dag', str(tmp_path / 'out.h'))[stage]
+    benchmark.group = case
+    benchmark.pedantic(function, setup=lambda: (setup(), {}), rounds=3)
+
+
+def test_benchmark_generators(tmpdir):
+    cases = create_cases(str(tmpdir), 'small')
+    assert len(CParser([cases['prefixed_groups']]).defs['macros']) == 400
+    util = RecursiveUtil(cases['include_dag'], False, [os.path.dirname(cases['include_dag'])], 'gcc', 100)
+    assert len(util.create_header_traversal_list()) == 13
+
+
+@pytest.mark.parametrize('style', ['switch', 'functions'])
+def test_c_parsers_benchmark(tmpdir, style):
+    shutil.copyfile(os.path.join(SYSTEM_TEST_PATH, 'test.h'), tmpdir / 'test.h')
+    assert main(str(tmpdir / 'test.h'), str(tmpdir / 'result.h'), [], False, False, 'gcc', [], 20, False, style=style,
+                from_str=True) == 0
+    results = benchmark_header(str(tmpdir / 'result.h'), lookups=1024, repeat=1)
+    assert set(results['parsers']) == {f'{name}_{kind}' for name in ('LOGPRIORITY', 'LOG_ID', 'DF', 'DF_1')
+                                       for kind in ('PARSER', 'FROM_STR')} | {'DF_FLAGS_PARSER', 'DF_1_FLAGS_PARSER'}
+    assert results['skipped'] == 0 and (results['source_size'] is None) == (style != 'functions')
+    for result in results['parsers'].values():
+        assert result['hit_ns'] > 0 and result['miss_ns'] > 0 and result['code_size'] > 0
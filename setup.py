@@ -11,7 +11,9 @@ setup(
     },
     author='amirbou',
     install_requires=['pyclibrary',
-                      'plusminus',
                       'networkx'
-                      ]
+                      ],
+    extras_require={
+        'plusminus': ['plusminus'],
+    }
 )
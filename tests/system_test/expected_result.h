@@ -96,6 +96,44 @@
 } while (0);
 
 
+#define DF_FLAGS_MAX_LEN 67
+#define DF_FLAGS_PARSER(n, buf) do {\
+    unsigned long long transpose_flags_ = (unsigned long long)(n);\
+    unsigned long long transpose_unknown_ = transpose_flags_ & ~0x1fULL;\
+    char *transpose_end_ = (buf);\
+    strcpy(transpose_end_, "0");\
+    for (transpose_flags_ &= 0x1fULL; transpose_flags_; transpose_flags_ &= transpose_flags_ - 1) {\
+        const char *transpose_name_ = "";\
+        switch (transpose_flags_ & -transpose_flags_) {\
+        case DF_ORIGIN:\
+                transpose_name_ = "DF_ORIGIN";\
+                break;\
+        case DF_SYMBOLIC:\
+                transpose_name_ = "DF_SYMBOLIC";\
+                break;\
+        case DF_TEXTREL:\
+                transpose_name_ = "DF_TEXTREL";\
+                break;\
+        case DF_BIND_NOW:\
+                transpose_name_ = "DF_BIND_NOW";\
+                break;\
+        case DF_STATIC_TLS:\
+                transpose_name_ = "DF_STATIC_TLS";\
+                break;\
+        }\
+        if (transpose_end_ != (buf))\
+                *transpose_end_++ = '|';\
+        strcpy(transpose_end_, transpose_name_);\
+        transpose_end_ += strlen(transpose_name_);\
+    }\
+    if (transpose_unknown_) {\
+        if (transpose_end_ != (buf))\
+                *transpose_end_++ = '|';\
+        strcpy(transpose_end_, "Unknown");\
+    }\
+} while (0);
+
+
 #define DF_1_MAX_LEN 15
 #define DF_1_PARSER(n, buf) do {\
     switch(n) {\
@@ -121,4 +159,45 @@
             strcpy(buf, "Unknown");\
             break;\
     }\
+} while (0);
+
+
+#define DF_1_FLAGS_MAX_LEN 83
+#define DF_1_FLAGS_PARSER(n, buf) do {\
+    unsigned long long transpose_flags_ = (unsigned long long)(n);\
+    unsigned long long transpose_unknown_ = transpose_flags_ & ~0x3fULL;\
+    char *transpose_end_ = (buf);\
+    strcpy(transpose_end_, "0");\
+    for (transpose_flags_ &= 0x3fULL; transpose_flags_; transpose_flags_ &= transpose_flags_ - 1) {\
+        const char *transpose_name_ = "";\
+        switch (transpose_flags_ & -transpose_flags_) {\
+        case DF_1_NOW:\
+                transpose_name_ = "DF_1_NOW";\
+                break;\
+        case DF_1_GLOBAL:\
+                transpose_name_ = "DF_1_GLOBAL";\
+                break;\
+        case DF_1_GROUP:\
+                transpose_name_ = "DF_1_GROUP";\
+                break;\
+        case DF_1_NODELETE:\
+                transpose_name_ = "DF_1_NODELETE";\
+                break;\
+        case DF_1_LOADFLTR:\
+                transpose_name_ = "DF_1_LOADFLTR";\
+                break;\
+        case DF_1_INITFIRST:\
+                transpose_name_ = "DF_1_INITFIRST";\
+                break;\
+        }\
+        if (transpose_end_ != (buf))\
+                *transpose_end_++ = '|';\
+        strcpy(transpose_end_, transpose_name_);\
+        transpose_end_ += strlen(transpose_name_);\
+    }\
+    if (transpose_unknown_) {\
+        if (transpose_end_ != (buf))\
+                *transpose_end_++ = '|';\
+        strcpy(transpose_end_, "Unknown");\
+    }\
 } while (0);
\ No newline at end of file
@@ -21,4 +21,12 @@ int main(void)
     DF_1_PARSER(DF_1_INITFIRST, buf4);
     printf("DF_1_INITFIRST=%s\n", buf4);
 
+    char buf5[DF_FLAGS_MAX_LEN] = { 0 };
+    DF_FLAGS_PARSER(DF_ORIGIN | DF_BIND_NOW | 0x100, buf5);
+    printf("DF_ORIGIN | DF_BIND_NOW | 0x100=%s\n", buf5);
+
+    char buf6[DF_1_FLAGS_MAX_LEN] = { 0 };
+    DF_1_FLAGS_PARSER(0, buf6);
+    printf("0=%s\n", buf6);
+
 }
@@ -0,0 +1,48 @@
+#! /usr/bin/env python
+import pytest
+from transpose.arithmatic_parser import *
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('0xff', 255),
+    ('010', 8),
+    ('0b101', 5),
+    ('10UL', 10),
+    ('(1 << 4)', 16),
+    ('(-7 / 2)', -3),
+    ('(-7 % 2)', -1),
+    ('~0U', 0xffffffff),
+    ('(unsigned char)300', 44),
+    ('(-1 < 0U)', 0),
+    ('sizeof(long)', 8),
+    ('(0 ? 2 : 3 + 4)', 7),
+    ('(0 ? 1U : -1)', 0xffffffff),
+    ('(1 ? -1 : 2UL)', 0xffffffffffffffff),
+    ('(1 ? 1 : 2.0)', 1.0),
+    ('(0 ? 1 / 0 : 5)', 5),
+    ("'a'", 97),
+    ('(2147483647 + 1)', -2147483648),
+    ('(1.5 * 2)', 3.0),
+])
+def test_evaluate(expression, expected):
+    assert MacrosArithmeticParser().parse(expression).evaluate() == expected
+
+
+def test_variables():
+    parser = MacrosArithmeticParser()
+    parser.add_variables({'BASE': 0x1000})
+    assert parser.parse('(BASE | 0x10)').evaluate() == 0x1010
+    with pytest.raises(NameError):
+        parser.parse('(OTHER + 1)').evaluate()
+
+
+@pytest.mark.parametrize('expression', ['', '__attribute__((packed))', '"string"', '(1 +', '1 2'])
+def test_invalid_expressions(expression):
+    with pytest.raises(CExpressionError):
+        MacrosArithmeticParser().parse(expression).evaluate()
+
+
+def test_plusminus_backend():
+    pytest.importorskip('plusminus')
+    parser = create_arithmetic_parser('plusminus')
+    assert parser.parse('0x10').evaluate() == 16
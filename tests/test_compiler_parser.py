@@ -0,0 +1,50 @@
+from transpose import *
+from transpose.compiler_parser import read_probe_values
+import os
+import shutil
+import pytest
+
+SYSTEM_TEST_PATH = os.path.join('tests', 'system_test')
+
+pytestmark = pytest.mark.skipif(shutil.which('gcc') is None, reason='gcc is needed to run the compiler front end')
+
+
+def test_same_as_pyclibrary():
+    path = os.path.join(SYSTEM_TEST_PATH, 'test.h')
+    macros, enums = compiler_definitions([path], {}, [])
+    expected = CParser([path]).defs
+    assert enums == expected['enums']
+    assert macros == parse_macros_values(dict(expected['macros']))
+
+
+def test_probe_values(tmpdir):
+    path = str(tmpdir / 'probe.h')
+    with open(path, 'w') as writer:
+        writer.write('int var;\n#define NEG (-5)\n#define BIG 0xffffffffffffffffULL\n#define SIZE sizeof(long)\n'
+                     '#define FLOAT 1.5\n#define STR "s"\n#define VAR var\n#define BROKEN (1 +\n'
+                     '#ifdef ON\n#define CHOSEN 2\n#endif\nenum e { A = -1, B = SIZE << 1 };\n')
+    values = probe_values(path, ['NEG', 'BIG', 'SIZE', 'FLOAT', 'STR', 'VAR', 'BROKEN', 'CHOSEN', 'A', 'B'],
+                          {'ON': ''}, [])
+    assert values == {'NEG': -5, 'BIG': 2 ** 64 - 1, 'SIZE': 8, 'CHOSEN': 2, 'A': -1, 'B': 16}
+    macros, enums = compiler_definitions([path], {}, [])
+    assert macros == {'NEG': -5, 'BIG': 2 ** 64 - 1, 'SIZE': 8, 'FLOAT': '1.5', 'STR': '"s"', 'VAR': 'var',
+                      'BROKEN': '(1 +'}
+    assert enums == {'e': {'A': -1, 'B': 16}}
+
+
+def test_read_probe_values():
+    assembly = 'transpose_probe_0:\n\t.quad\t-5\n\t.quad\t1\n\t.quad\t1\n' \
+               '_transpose_probe_1:\n\t.long\t7\n\t.long\t0\n\t.zero\t8\n\t.quad\t1\n' \
+               'transpose_probe_2:\n\t.quad\t.LC0\n\t.quad\t0\n\t.quad\t1\n' \
+               'transpose_probe_3:\n\t.quad\t1\n\t.zero\t16\n'
+    assert read_probe_values(assembly) == {0: -5, 1: 7}
+
+
+def test_main_compiler_frontend(tmpdir):
+    path = os.path.join(SYSTEM_TEST_PATH, 'test.h')
+    assert main(path, str(tmpdir / 'result.h'), [], False, False, 'gcc', [], 20, False,
+                frontend='compiler') == 0
+    with open(os.path.join(SYSTEM_TEST_PATH, 'expected_result.h'), 'r') as reader:
+        expected = reader.read()
+    with open(tmpdir / 'result.h', 'r') as reader:
+        assert reader.read() == expected
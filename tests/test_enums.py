@@ -32,3 +32,33 @@ def test_merge_enumee():
 
 
 
+def test_lookup_strategy():
+    assert MacroCreator.lookup_strategy([0, 1, 3]) == 'dense'
+    assert MacroCreator.lookup_strategy([1 << i for i in range(10)]) == 'sorted'
+    assert MacroCreator.lookup_strategy([1, 100, 10000]) == 'switch'
+    assert MacroCreator.lookup_strategy([0, 1.5]) == 'switch'
+    assert MacroCreator.lookup_strategy([1 << i for i in range(64)]) == 'sorted'
+    assert MacroCreator.lookup_strategy([-1] + [1 << i for i in range(64)]) == 'switch'
+
+
+def test_flags_macro():
+    assert MacroCreator.is_flags([0, 1, 2, 8])
+    assert not MacroCreator.is_flags([1, 2, 3])
+    assert not MacroCreator.is_flags([0, 1])
+    assert not MacroCreator.is_flags([0, 1, 2]) and not MacroCreator.is_flags([7, 8])  # sequences, not bitmasks
+    assert MacroCreator.is_flags([0, 1, 2, 4]) and MacroCreator.is_flags([0, 1, 4])
+    assert MacroCreator.is_flags([1, 2, 0x0ff00000, 0xf0000000])  # disjoint masks, as SHF_MASKOS and SHF_MASKPROC
+    assert not MacroCreator.is_flags([1, 2, 0xf0000000, 0x80000000])
+    enum = MacroCreator('FLAG', [Enumee('FLAG_NONE', 0), Enumee('FLAG_A', 1), Enumee('FLAG_B', 4)])
+    assert 'FLAG_FLAGS_MAX_LEN 22' in enum.create_flags_macro()
+    assert MacroCreator('LOG', [Enumee('LOG_A', 1), Enumee('LOG_B', 3)]).create_flags_macro() == ''
+
+
+def test_perfect_hash():
+    names = [f'NAME_{i}'.encode() for i in range(1000)] + [b'A', b'B']
+    seeds, slots = perfect_hash(names)
+    assert sorted(slots) == list(range(len(names)))
+    for index, name in enumerate(names):
+        seed = seeds[name_hash(name, 0) % len(names)]
+        slot = name_hash(name, seed) % len(names) if seed > 0 else -seed - 1
+        assert slots[slot] == index
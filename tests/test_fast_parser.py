@@ -0,0 +1,58 @@
+from transpose import *
+import os
+import pytest
+
+SYSTEM_TEST_PATH = os.path.join('tests', 'system_test')
+
+
+def fast_defs(tmpdir, text, macros=None):
+    path = str(tmpdir / 'fast.h')
+    with open(path, 'w') as writer:
+        writer.write(text)
+    parser = FastParser([path], macros)
+    parser.process_all()
+    return parser.defs
+
+
+def test_same_as_pyclibrary():
+    path = os.path.join(SYSTEM_TEST_PATH, 'test.h')
+    parser = FastParser([path])
+    parser.process_all()
+    expected = CParser([path]).defs
+    for kind in ('macros', 'fnmacros', 'enums'):
+        assert parser.defs[kind] == expected[kind]
+    assert transpose_files([path], {}, frontend='fast') == transpose_files([path], {})
+
+
+def test_conditionals(tmpdir):
+    text = '#ifdef DEBUG\n#define LEVEL 3\n#else\n#define LEVEL 0\n#endif\n' \
+           '#if defined(DEBUG) && LEVEL > 2\n#define VERBOSE 1\n#elif LEVEL == 0\n#define VERBOSE 2\n#endif\n' \
+           '#if 0\n#if 1\n#define NEVER 1\n#else\n#define NEVER 2\n#endif\n#endif\n'
+    assert fast_defs(tmpdir, text)['macros'] == {'LEVEL': '0', 'VERBOSE': '2'}
+    assert fast_defs(tmpdir, text, {'DEBUG': ''})['macros'] == {'DEBUG': '', 'LEVEL': '3', 'VERBOSE': '1'}
+
+
+def test_macros(tmpdir):
+    defs = fast_defs(tmpdir, '#define A 1 /* one */\n#define B (A +\\\n 1)\n#define ADD(x, y) ((x) + (y))\n'
+                             '#define C ADD(B, 2)\n#define S "A // B"\n#define E\n#undef E\n')
+    assert defs['macros'] == {'A': '1', 'B': '(1 + 1)', 'C': '(((1 + 1)) + (2))', 'S': '"A // B"'}
+    assert defs['fnmacros'] == {'ADD': ('(({}) + ({}))', [0, 1])}
+
+
+def test_enums(tmpdir):
+    defs = fast_defs(tmpdir, '#define BASE 4\nenum first;\ntypedef enum {\n  X = BASE, /* x */\n  Y,\n#if 0\n  HIDDEN,\n'
+                             '#endif\n  Z = sizeof(int) | 0x10u,\n} anonymous_t;\n'
+                             'struct s { enum first f; };\nenum first { F = Y + 1 };\nint f(void) { return 0; }\n'
+                             'enum second\n{\n  S = \'a\', T = (1 << 2) };\nenum first { G };\n')
+    assert defs['enums'] == {'first': {'F': 6}, 'anon_enum0': {'X': 4, 'Y': 5, 'Z': 20}, 'second': {'S': 97, 'T': 4}}
+
+
+@pytest.mark.parametrize('frontend', FRONTENDS)
+def test_main_frontend(tmpdir, frontend):
+    path = os.path.join(SYSTEM_TEST_PATH, 'test.h')
+    assert main(path, str(tmpdir / 'result.h'), [], False, False, 'gcc', [], 20, False,
+                cache_dir=str(tmpdir / 'cache'), frontend=frontend) == 0
+    with open(os.path.join(SYSTEM_TEST_PATH, 'expected_result.h'), 'r') as reader:
+        expected = reader.read()
+    with open(tmpdir / 'result.h', 'r') as reader:
+        assert reader.read() == expected.replace('#include "tests/system_test/test.h"', '#include "test.h"')
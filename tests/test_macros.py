@@ -102,4 +102,54 @@ def test_merge_prefixes_collisions():
     assert sorted(list(prefixes.keys())) == sorted(['PF', 'STB', 'SHF', 'SHF_INFO'])
 
 
+def test_merge_prefixes_chain():
+    subject = {
+        'A': [Define('A_X', '1'), Define('A_Y', '2')],
+        'A_B': [Define('A_B_X', '3'), Define('A_B_Y', '4')],
+        'A_B_C': [Define('A_B_C_X', '5'), Define('A_B_C_Y', '1')],
+        'A_B_D': [Define('A_B_D_X', '6'), Define('A_B_D_Y', '7')],
+    }
+    prefixes = merge_prefixes(subject)
+    # A_B_C is merged into A_B, which then collides with A on the value 1
+    assert sorted(prefixes.keys()) == ['A', 'A_B', 'A_B_D']
+    assert [define.name for define in prefixes['A_B']] == ['A_B_X', 'A_B_Y', 'A_B_C_X', 'A_B_C_Y']
+
+
+def test_split_default_parser():
+    subject = [Define('A', '1'), Define('B', '2'), Define('C', '1'), Define('D', '1'), Define('E', '3'), Define('F', '2')]
+    parsers = split_default_parser(subject)
+    assert [[define.name for define in parser] for parser in parsers] == [['A', 'B', 'E'], ['C', 'F'], ['D']]
+    assert split_default_parser([]) == []
+
+
+def test_parse_macros_values_forward_references():
+    subject = {
+        'BASE': '0',
+        'TWO': '(ONE + 1)',
+        'ONE': '(BASE + 1)',
+    }
+    assert parse_macros_values(subject) == {'BASE': 0, 'TWO': 2, 'ONE': 1}
+    assert list(subject.keys()) == ['BASE', 'TWO', 'ONE']
+
+
+def test_macros_resolver_cycles():
+    subject = {
+        'A': 'B',
+        'B': '(A + 1)',
+        'C': '(B + 1)',
+        'D': '(UNKNOWN + 1)',
+        'E': '2',
+    }
+    resolver = MacrosResolver(subject)
+    resolver.resolve()
+    assert resolver.cycles == [['A', 'B']]
+    assert sorted(resolver.unresolved.keys()) == ['A', 'B', 'C', 'D']
+    assert subject['E'] == 2
+
 
+def test_define_slots_and_hash():
+    first, second, other = Define('A_X', '0x1'), Define('B_X', 1), Enumee('C_X', 2)
+    assert not hasattr(first, '__dict__') and not hasattr(other, '__dict__')
+    assert first == second and hash(first) == hash(second)
+    assert first != other and first != 1
+    assert len({first, second, other}) == 2
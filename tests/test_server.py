@@ -0,0 +1,87 @@
+from transpose import *
+from transpose.client import request
+from transpose.server import TransposeServer
+import asyncio
+import os
+import threading
+import time
+
+
+def write_header(path, content):
+    with open(path, 'w') as writer:
+        writer.write(content)
+
+
+def target_arguments(tmpdir, **arguments):
+    return dict(dict(path=str(tmpdir / 'top.h'), out_path=str(tmpdir / 'out.h'), macros=[], recursive=True,
+                     parse_std=False, compiler='gcc', include_dirs=[str(tmpdir)], max_headers=20, force=True,
+                     evaluator='native', style='switch', depfile=None, output_format='c'), **arguments)
+
+
+def test_server_keeps_sessions(tmpdir):
+    write_header(tmpdir / 'a.h', '#define A_ONE 1\n#define A_TWO 2\n')
+    write_header(tmpdir / 'top.h', '#include "a.h"\n#define TOP_ONE (A_TWO + 1)\n#define TOP_TWO 5\n')
+    server = TransposeServer(str(tmpdir / 'server.sock'))
+    arguments = target_arguments(tmpdir)
+    assert server.transpose(arguments) == (0, None)
+    session = next(iter(server.targets.values())).session
+    assert session.parsed_headers == 2
+    mtime = os.stat(tmpdir / 'out.h').st_mtime_ns
+
+    assert server.transpose(arguments) == (0, None)
+    assert session.parsed_headers == 2 and os.stat(tmpdir / 'out.h').st_mtime_ns == mtime  # nothing to do
+
+    write_header(tmpdir / 'top.h', '#include "a.h"\n#define TOP_ONE (A_TWO + 1)\n#define TOP_TWO 66\n')
+    assert server.transpose(arguments) == (0, None)
+    assert session.parsed_headers == 1
+    with open(tmpdir / 'out.h') as reader:
+        assert reader.read() == transpose_files([str(tmpdir / 'a.h'), str(tmpdir / 'top.h')], {})
+
+    code, error = server.transpose(dict(arguments, force=False))
+    assert code == -1 and 'already exists' in error
+    code, error = server.transpose(target_arguments(tmpdir, path=str(tmpdir / 'missing.h')))
+    assert code == -1 and 'missing.h' in error
+    assert len(server.targets) == 1
+
+
+def test_server_shares_headers(tmpdir):
+    write_header(tmpdir / 'a.h', '#define A_ONE 1\n#define A_TWO 2\n')
+    write_header(tmpdir / 'top.h', '#include "a.h"\n#define TOP_ONE (A_TWO + 1)\n#define TOP_TWO 5\n')
+    server = TransposeServer(str(tmpdir / 'server.sock'))
+    assert server.transpose(target_arguments(tmpdir)) == (0, None)
+    assert server.transpose(target_arguments(tmpdir, out_path=str(tmpdir / 'other.h'))) == (0, None)
+    first, second = (target.session for target in server.targets.values())
+    assert first.parsed_headers == 2 and second.parsed_headers == 0  # parsed by the first target
+    with open(tmpdir / 'out.h') as reader, open(tmpdir / 'other.h') as other_reader:
+        assert reader.read() == other_reader.read()
+
+    assert server.transpose(target_arguments(tmpdir, out_path=str(tmpdir / 'defined.h'), macros=['A_ONE=3'])) == \
+        (0, None)
+    assert next(reversed(server.targets.values())).session.parsed_headers == 2  # other macros, other keys
+
+
+def test_server_socket(tmpdir):
+    write_header(tmpdir / 'top.h', '#define TOP_ONE 1\n#define TOP_TWO 2\n')
+    server = TransposeServer(str(tmpdir / 'server.sock'), workers=2)
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(server.serve())
+
+    def serve():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+    thread = threading.Thread(target=serve)
+    thread.start()
+    try:
+        for _ in range(100):
+            if os.path.exists(server.socket_path):
+                break
+            time.sleep(0.05)
+        assert request(server.socket_path, target_arguments(tmpdir)) == (0, None)
+        assert os.path.exists(tmpdir / 'out.h')
+    finally:
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join()
+        loop.close()
+    assert not os.path.exists(server.socket_path)
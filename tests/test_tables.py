@@ -0,0 +1,45 @@
+from transpose import *
+import importlib.util
+import os
+import pytest
+
+SYSTEM_TEST_PATH = os.path.join('tests', 'system_test')
+
+
+def load_module(path):
+    spec = importlib.util.spec_from_file_location('tables', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_python_and_json_tables(tmpdir):
+    path = os.path.join(SYSTEM_TEST_PATH, 'test.h')
+    assert main(path, str(tmpdir / 'tables.py'), [], False, False, 'gcc', [], 20, False,
+                output_format='python') == 0
+    assert main(path, str(tmpdir / 'tables.json'), [], False, False, 'gcc', [], 20, False,
+                output_format='json') == 0
+    module_tables = load_module(str(tmpdir / 'tables.py')).TABLES
+    json_tables = load_tables(str(tmpdir / 'tables.json'))
+    for tables in (module_tables, json_tables):
+        assert list(tables) == ['LOGPRIORITY', 'LOG_ID', 'DF', 'DF_1']
+        assert tables['LOGPRIORITY'].to_str(2) == 'LOG_VERBOSE'
+        assert tables['LOG_ID'].to_str(0) == 'LOG_ID_MIN_OR_MAIN'
+        assert tables['LOG_ID'].to_str(100) == 'Unknown'
+        assert tables['DF'].flags_to_str(0x1 | 0x8 | 0x100) == 'DF_ORIGIN|DF_BIND_NOW|Unknown'
+        assert tables['DF'].flags_to_str(0) == '0'
+        with pytest.raises(ValueError):
+            tables['LOG_ID'].flags_to_str(1)
+    assert {name: table.names for name, table in module_tables.items()} == \
+           {name: table.names for name, table in json_tables.items()}
+
+
+def test_flags_table():
+    table = LookupTable('O', {0: 'O_NONE', 1: 'O_READ', 2: 'O_WRITE'}, flags=True)
+    assert table.flags_to_str(0) == 'O_NONE'
+    assert table.flags_to_str(3) == 'O_READ|O_WRITE'
+    assert table.flags_to_str(-1) == 'O_READ|O_WRITE|Unknown'
+    assert table.flags_to_str(4) == 'Unknown'
+    table = LookupTable('SHF', {1: 'SHF_WRITE', 2: 'SHF_ALLOC', 0xf0: 'SHF_MASKOS'}, flags=True)
+    assert table.flags_to_str(0xf1) == 'SHF_WRITE|SHF_MASKOS'
+    assert table.flags_to_str(0x12) == 'SHF_ALLOC|Unknown'
@@ -1,8 +1,10 @@
 from transpose import *
+import json
 import os
 import subprocess
 import shutil
 import sys
+import pytest
 
 SYSTEM_TEST_PATH = os.path.join('tests', 'system_test')
 
@@ -14,8 +16,8 @@ def do_transpose(path):
     return create_output(os.path.basename(path), enum_macros, define_macros)
 
 
-def compile_c(path, out_path):
-    subprocess.run(['gcc', path, '-o', out_path], check=True)
+def compile_c(path, out_path, *sources):
+    subprocess.run(['gcc', path, *sources, '-o', out_path], check=True)
 
 
 def run_binary(path):
@@ -31,14 +33,16 @@ def test_main():
     assert transposed == expected_result
 
 
-def test_in_c(tmpdir):
+@pytest.mark.parametrize('style', OUTPUT_STYLES)
+def test_in_c(tmpdir, style):
     main(os.path.join(SYSTEM_TEST_PATH, 'test.h'), tmpdir / 'result.h', macros=[],
-         recursive=False, parse_std=False, compiler='gcc', include_dirs=[], max_headers=20, force=False)
+         recursive=False, parse_std=False, compiler='gcc', include_dirs=[], max_headers=20, force=False, style=style)
     shutil.copyfile(os.path.join(SYSTEM_TEST_PATH, 'test.h'), tmpdir / 'test.h')
     shutil.copyfile(os.path.join(SYSTEM_TEST_PATH, 'main.c'), tmpdir / 'main.c')
     result = ""
     try:
-        compile_c(tmpdir / 'main.c', tmpdir / 'test.out')
+        sources = [tmpdir / 'result.c'] if style == 'functions' else []
+        compile_c(tmpdir / 'main.c', tmpdir / 'test.out', *sources)
         result = run_binary(tmpdir / 'test.out').decode('utf-8')
     except subprocess.CalledProcessError as e:
         print(e.stderr, file=sys.stderr)
@@ -48,3 +52,274 @@ def test_in_c(tmpdir):
         expected = fd.read()
     assert result == expected
 
+
+def test_from_str_in_c(tmpdir):
+    main(os.path.join(SYSTEM_TEST_PATH, 'test.h'), tmpdir / 'result.h', macros=[], recursive=False, parse_std=False,
+         compiler='gcc', include_dirs=[], max_headers=20, force=False, from_str=True)
+    shutil.copyfile(os.path.join(SYSTEM_TEST_PATH, 'test.h'), tmpdir / 'test.h')
+    checks = [('LOG_ID', name) for name in ('LOG_ID_MIN', 'LOG_ID_MAIN', 'LOG_ID_RADIO', 'LOG_ID_KERNEL', 'LOG_ID_MAX')]
+    checks += [('DF', 'DF_ORIGIN'), ('DF', 'DF_STATIC_TLS'), ('DF_1', 'DF_1_NOW'), ('DF_1', 'DF_1_INITFIRST')]
+    lines = ['#include <stdio.h>', '#include "test.h"', '#include "result.h"', 'int main(void)', '{',
+             '    long long value = -1;']
+    for group, name in checks:
+        lines.append(f'    if (!{group}_FROM_STR("{name}", &value) || value != {name}) return 1;')
+    for group, name in (('LOG_ID', 'LOG_ID_NONE'), ('LOG_ID', 'LOG_ID_MAI'), ('LOG_ID', ''), ('DF', 'DF_1_NOW')):
+        lines.append(f'    if ({group}_FROM_STR("{name}", &value)) return 2;')
+    lines += ['    if (!LOG_ID_FROM_STR("LOG_ID_MIN_OR_MAIN", &value) || value != LOG_ID_MIN) return 3;',
+              '    printf("ok");', '    return 0;', '}']
+    with open(tmpdir / 'main.c', 'w') as writer:
+        writer.write('\n'.join(lines) + '\n')
+    compile_c(tmpdir / 'main.c', tmpdir / 'test.out')
+    assert run_binary(tmpdir / 'test.out') == b'ok'
+
+
+def test_lookup_wide_values_in_c(tmpdir):
+    # a negative value and one above LLONG_MAX are not sorted anymore once wrapped to long long
+    defines = [('WIDE_NEGATIVE', '(-5)'), ('WIDE_HIGH', '0x8000000000000001ULL')]
+    defines += [(f'WIDE_{i}', f'{1 << (4 * i):#x}') for i in range(8)]
+    with open(tmpdir / 'wide.h', 'w') as writer:
+        writer.write(''.join(f'#define {name} {value}\n' for name, value in defines))
+    assert main(str(tmpdir / 'wide.h'), str(tmpdir / 'result.h'), [], False, False, 'gcc', [], 20, False,
+                style='lookup') == 0
+    lines = ['#include <stdio.h>', '#include <string.h>', '#include "wide.h"', '#include "result.h"',
+             'int main(void)', '{']
+    lines += [f'    printf("%s\\n", WIDE_TO_STR({name}));' for name, _ in defines] + ['}']
+    with open(tmpdir / 'main.c', 'w') as writer:
+        writer.write('\n'.join(lines) + '\n')
+    compile_c(tmpdir / 'main.c', tmpdir / 'test.out')
+    assert run_binary(tmpdir / 'test.out').decode().splitlines() == [name for name, _ in defines]
+
+
+@pytest.mark.parametrize('style', OUTPUT_STYLES)
+def test_generated_headers_together(tmpdir, style):
+    # the defines without a prefix and the anonymous enums are in the _DEFAULT and ANON_ENUM0 groups of both headers
+    for name in ('first', 'second'):
+        with open(tmpdir / f'{name}.h', 'w') as writer:
+            writer.write(f'#pragma once\n#define {name.upper()} 1\n#define OTHER_{name.upper()} 2\n'
+                         f'enum {{ {name.upper()}_A, {name.upper()}_B }};\n')
+        assert main(str(tmpdir / f'{name}.h'), str(tmpdir / f'{name}_parsers.h'), [], False, False, 'gcc', [], 20,
+                    False, style=style, from_str=True) == 0
+    with open(tmpdir / 'first_parsers.h') as reader:
+        header = reader.read()
+    assert 'int FIRST_PARSERS_DEFAULT_FROM_STR(const char *str, long long *value)' in header
+    assert 'int FIRST_PARSERS_ANON_ENUM0_FROM_STR(const char *str, long long *value)' in header
+    # both headers in a single source file, and (in the functions style) both source files in a single program
+    with open(tmpdir / 'main.c', 'w') as writer:
+        writer.write('#include <stdio.h>\n#include "first_parsers.h"\n#include "second_parsers.h"\n'
+                     'int main(void)\n{\n    long long first, second;\n'
+                     '    FIRST_PARSERS_DEFAULT_FROM_STR("FIRST", &first);\n'
+                     '    SECOND_PARSERS_ANON_ENUM0_FROM_STR("SECOND_B", &second);\n'
+                     '    printf("%lld %lld", first, second);\n}\n')
+    sources = [tmpdir / 'first_parsers.c', tmpdir / 'second_parsers.c'] if style == 'functions' else []
+    compile_c(tmpdir / 'main.c', tmpdir / 'test.out', *sources)
+    assert run_binary(tmpdir / 'test.out') == b'1 1'
+
+
+@pytest.mark.parametrize('style', ['switch', 'functions'])
+def test_flags_masks_in_c(tmpdir, style):
+    with open(tmpdir / 'shf.h', 'w') as writer:
+        writer.write('#define SHF_WRITE 0x1\n#define SHF_ALLOC 0x2\n#define SHF_MASKOS 0x0ff00000\n'
+                     '#define SHF_MASKPROC 0xf0000000\n')
+    assert main(str(tmpdir / 'shf.h'), str(tmpdir / 'result.h'), [], False, False, 'gcc', [], 20, False,
+                style=style) == 0
+    # _flags was a local of the macro, so an argument named so was left uninitialized
+    checks = {'_flags': 'SHF_WRITE', 'SHF_WRITE | SHF_MASKPROC': 'SHF_WRITE|SHF_MASKPROC',
+              'SHF_ALLOC | 0x00100000': 'SHF_ALLOC|Unknown', 'SHF_MASKOS | 0x4': 'SHF_MASKOS|Unknown', '0': '0'}
+    lines = ['#include <stdio.h>', '#include <string.h>', '#include "shf.h"', '#include "result.h"',
+             'int main(void)', '{', '    char buf[SHF_FLAGS_MAX_LEN];', '    unsigned long long _flags = SHF_WRITE;']
+    for value in checks:
+        lines += [f'    SHF_FLAGS_PARSER({value}, buf);', '    printf("%s\\n", buf);']
+    with open(tmpdir / 'main.c', 'w') as writer:
+        writer.write('\n'.join(lines + ['}']) + '\n')
+    compile_c(tmpdir / 'main.c', tmpdir / 'test.out', *([tmpdir / 'result.c'] if style == 'functions' else []))
+    assert run_binary(tmpdir / 'test.out').decode().splitlines() == list(checks.values())
+
+
+def test_functions_source(tmpdir):
+    path = os.path.join(SYSTEM_TEST_PATH, 'test.h')
+    assert main(path, str(tmpdir / 'result.h'), [], False, False, 'gcc', [], 20, False, style='functions',
+                from_str=True) == 0
+    with open(tmpdir / 'result.h', 'r') as reader:
+        header = reader.read()
+    with open(tmpdir / 'result.c', 'r') as reader:
+        source = reader.read()
+    assert 'const char *LOG_ID_TO_STR(long long n);' in header and 'switch' not in header
+    assert 'int LOG_ID_FROM_STR(const char *str, long long *value);' in header
+    # the names returned by the parsers and found by the FROM_STR functions, and Unknown, are pooled once
+    assert source.count('"Unknown\\0"') == 1 and source.count('"LOG_ID_RADIO\\0"') == 1
+    assert source.count('TRANSPOSE_NAME_HASH') == 2
+    assert main(path, str(tmpdir / 'result.c'), [], False, False, 'gcc', [], 20, True, style='functions') == -1
+
+
+def test_cache(tmpdir, monkeypatch):
+    path = os.path.join(SYSTEM_TEST_PATH, 'test.h')
+    cache = DefinitionsCache(str(tmpdir / 'cache'))
+    expected = transpose_files([path, ], {})
+    assert transpose_files([path, ], {}, cache=cache) == expected
+
+    def fail(*args, **kwargs):
+        raise AssertionError('headers should be loaded from the cache')
+    monkeypatch.setattr('transpose.transpose.create_parser', fail)
+    assert transpose_files([path, ], {}, cache=cache) == expected
+
+
+def test_cache_empty_header(tmpdir):
+    with open(tmpdir / 'empty.h', 'w') as writer:
+        writer.write('#pragma once\n')
+    cache = DefinitionsCache(str(tmpdir / 'cache'))
+    paths = [str(tmpdir / 'empty.h'), str(tmpdir / 'top.h')]
+    for value in (1, 2):
+        with open(tmpdir / 'top.h', 'w') as writer:
+            writer.write(f'#include "empty.h"\n#define TOP_A {value}\n#define TOP_B 3\n')
+        assert transpose_files(paths, {}, cache=cache) == transpose_files(paths, {})
+
+
+def test_recursive_without_compiler(tmpdir, monkeypatch):
+    shutil.copyfile(os.path.join(SYSTEM_TEST_PATH, 'test.h'), tmpdir / 'test.h')
+    with open(tmpdir / 'top.h', 'w') as writer:
+        writer.write('#include "test.h"\n#include <stdio.h>\n')
+
+    def fail(*args, **kwargs):
+        raise AssertionError('the compiler should not be probed without --parse-std')
+    monkeypatch.setattr(RecursiveUtil, 'probe_include_dirs', fail)
+    util = RecursiveUtil(str(tmpdir / 'top.h'), False, [str(tmpdir)], 'gcc')
+    assert util.create_header_traversal_list() == [os.path.realpath(tmpdir / 'test.h'), str(tmpdir / 'top.h')]
+
+
+def test_include_dirs_probe_cache(tmpdir, monkeypatch):
+    cache = DefinitionsCache(str(tmpdir / 'cache'))
+    expected = RecursiveUtil.get_include_dirs('gcc', [str(tmpdir)], cache)
+    monkeypatch.setattr(RecursiveUtil, '_probe_results', {})
+
+    def fail(*args, **kwargs):
+        raise AssertionError('the include dirs should be loaded from the cache')
+    monkeypatch.setattr(RecursiveUtil, 'probe_include_dirs', fail)
+    assert RecursiveUtil.get_include_dirs('gcc', [str(tmpdir)], cache) == expected
+
+
+def test_batch(tmpdir):
+    path = os.path.join(SYSTEM_TEST_PATH, 'test.h')
+    with open(os.path.join(SYSTEM_TEST_PATH, 'expected_result.h'), 'r') as reader:
+        expected_result = reader.read()
+    target = dict(macros=[], recursive=False, parse_std=False, compiler='gcc', include_dirs=[], max_headers=20,
+                  force=False)
+    targets = [dict(path=path, out_path=str(tmpdir / 'first.h'), **target),
+               dict(path=path, out_path=str(tmpdir / 'second.h'), **target)]
+    assert batch_main(targets) == 0
+    for out_path in ('first.h', 'second.h'):
+        with open(tmpdir / out_path, 'r') as reader:
+            assert reader.read() == expected_result
+
+
+def test_batch_manifest(tmpdir):
+    from transpose.__main__ import TARGET_OPTIONS, _batch_targets
+    defaults = dict.fromkeys(TARGET_OPTIONS, False)
+    defaults.update(D=[], I=[], MF=None)
+    os.makedirs(tmpdir / 'sub')
+    manifest = str(tmpdir / 'sub' / 'manifest.json')
+    with open(manifest, 'w') as writer:
+        json.dump([{'in_file': 'log.h', 'out_file': os.path.join('out', 'log_parsers.h'), 'I': ['include', '/usr']}],
+                  writer)
+    target, = _batch_targets([manifest], defaults)
+    assert target['path'] == str(tmpdir / 'sub' / 'log.h')
+    assert target['out_path'] == str(tmpdir / 'sub' / 'out' / 'log_parsers.h')
+    assert target['include_dirs'][1:] == [str(tmpdir / 'sub' / 'include'), '/usr']
+    for option in ('D', 'I'):
+        with open(manifest, 'w') as writer:
+            json.dump([{'in_file': 'log.h', 'out_file': 'log_parsers.h', option: 'DEBUG'}], writer)
+        with pytest.raises(ValueError, match=f'{option} must be a list'):
+            _batch_targets([manifest], defaults)
+
+
+def test_parallel_matches_serial(tmpdir):
+    headers = {
+        'common.h': '#define COMMON_BASE 100\n',
+        'a.h': '#include "common.h"\n#define A_X (COMMON_BASE + 1)\n',
+        'b.h': '#include "common.h"\n#ifdef A_X\n#define B_Y 2\n#else\n#define B_Y 3\n#endif\n',
+        'c.h': '#include "b.h"\n#define C_W (B_Y + 10)\n',
+        'top.h': '#include "a.h"\n#include "c.h"\n',
+    }
+    for name, content in headers.items():
+        with open(tmpdir / name, 'w') as writer:
+            writer.write(content)
+    paths = [str(tmpdir / name) for name in headers]
+    common, a, b, c, top = paths
+    dependencies = {common: set(), a: {common}, b: {common}, c: {b, common}, top: {a, b, c, common}}
+    serial = parse_headers(paths, {})
+    parallel = parse_headers(paths, {}, dependencies=dependencies, jobs=2)
+    assert list(parallel.defs['macros'].items()) == list(serial.defs['macros'].items())
+    assert parallel.defs['macros']['B_Y'] == '2'
+
+
+def test_dependencies_graph(tmpdir):
+    os.mkdir(tmpdir / 'sub')
+    with open(tmpdir / 'sub' / 'inner.h', 'w') as writer:
+        writer.write('#define INNER 1\n')
+    with open(tmpdir / 'sub' / 'middle.h', 'w') as writer:
+        writer.write('#include "inner.h"\n#include <missing_platform_header.h>\n')
+    with open(tmpdir / 'top.h', 'w') as writer:
+        writer.write('#include "sub/middle.h"\n#include "sub/inner.h"\n')
+    util = RecursiveUtil(str(tmpdir / 'top.h'), False, [str(tmpdir)], 'gcc')
+    traversal_list = util.create_header_traversal_list()
+    assert traversal_list == [os.path.realpath(tmpdir / 'sub' / 'inner.h'), os.path.realpath(tmpdir / 'sub' / 'middle.h'),
+                              str(tmpdir / 'top.h')]
+
+
+def test_depfile_and_unchanged_output(tmpdir):
+    shutil.copyfile(os.path.join(SYSTEM_TEST_PATH, 'test.h'), tmpdir / 'test.h')
+    with open(tmpdir / 'top.h', 'w') as writer:
+        writer.write('#include "test.h"\n')
+    out_path, depfile = str(tmpdir / 'out dir.h'), str(tmpdir / 'out.d')
+    arguments = dict(macros=[], recursive=True, parse_std=False, compiler='gcc', include_dirs=[str(tmpdir)],
+                     max_headers=20, force=True, depfile=depfile)
+    assert main(str(tmpdir / 'top.h'), out_path, **arguments) == 0
+    with open(depfile) as reader:
+        assert reader.read() == f'{tmpdir}/out\\ dir.h: \\\n {os.path.realpath(tmpdir / "test.h")} \\\n {tmpdir}/top.h\n'
+    mtimes = [os.stat(path).st_mtime_ns for path in (out_path, depfile)]
+    assert main(str(tmpdir / 'top.h'), out_path, **arguments) == 0
+    assert [os.stat(path).st_mtime_ns for path in (out_path, depfile)] == mtimes
+    assert not [name for name in os.listdir(tmpdir) if name.endswith('.tmp')]
+
+
+def test_streaming_output(tmpdir):
+    path = os.path.join(SYSTEM_TEST_PATH, 'test.h')
+    out_path = str(tmpdir / 'out.h')
+    assert write_output(out_path, iter_transposed([path, ], {}))
+    with open(out_path) as reader:
+        assert reader.read() == transpose_files([path, ], {}) == do_transpose(path)
+    assert not write_output(out_path, iter_transposed([path, ], {}))
+    assert os.listdir(tmpdir) == ['out.h']
+
+
+def test_startup_imports():
+    # --help and the shell completion only need argparse, the modules doing the actual work are imported later
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'transpose', '--help'], capture_output=True,
+                            text=True, check=True)
+    imports = {line.split('|')[-1].strip() for line in result.stderr.splitlines() if line.startswith('import time:')}
+    assert 'transpose' in imports
+    assert not {'pyclibrary', 'networkx', 'argcomplete'} & imports
+
+
+def test_non_recursive_imports(tmpdir):
+    code = ('import sys\n'
+            'from transpose import main\n'
+            f'main({os.path.join(SYSTEM_TEST_PATH, "test.h")!r}, {str(tmpdir / "out.h")!r}, [], False, False, "gcc", '
+            '[], 20, False)\n'
+            'print(sorted({"networkx", "multiprocessing"} & set(sys.modules)))\n')
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
+
+
+def test_stats(tmpdir):
+    with collect_stats() as stats:
+        assert main(os.path.join(SYSTEM_TEST_PATH, 'test.h'), tmpdir / 'result.h', [], False, False, 'gcc', [], 20,
+                    False) == 0
+    assert {'parse headers', 'preprocess', 'evaluate macros', 'create define parsers', 'total'} <= set(stats.stages)
+    assert stats.stages['total']['peak_memory'] >= stats.stages['parse headers']['peak_memory'] > 0
+    assert stats.counters['headers parsed'] == 1
+    assert stats.counters['enums'] == 2
+    assert stats.counters['evaluation attempts'] >= stats.counters['macros'] > 0
+    with profile(str(tmpdir / 'out.prof')):
+        transpose_files([os.path.join(SYSTEM_TEST_PATH, 'test.h')], {})
+    assert os.path.getsize(tmpdir / 'out.prof') > 0
+    assert stats.counters['headers parsed'] == 1  # nothing is collected outside collect_stats
@@ -0,0 +1,66 @@
+from transpose import *
+from transpose.watch import WatchSession, PollingWatcher, create_watcher
+import os
+import pytest
+
+
+def write_header(path, content):
+    with open(path, 'w') as writer:
+        writer.write(content)
+
+
+def create_session(tmpdir, out_path):
+    write_header(tmpdir / 'a.h', '#define A_ONE 1\n#define A_TWO 2\n')
+    write_header(tmpdir / 'b.h', '#include "a.h"\n#define B_ONE (A_TWO + 1)\n#define B_TWO 5\n')
+    write_header(tmpdir / 'c.h', '#define C_ONE 7\n#define C_TWO 8\n')
+    write_header(tmpdir / 'top.h', '#include "a.h"\n#include "b.h"\n#include "c.h"\n')
+    return WatchSession(str(tmpdir / 'top.h'), out_path, [], True, False, 'gcc', [str(tmpdir)], 20)
+
+
+def expected_output(session):
+    return transpose_files(session.paths, {})
+
+
+def test_watch_session(tmpdir):
+    out_path = str(tmpdir / 'out.h')
+    session = create_session(tmpdir, out_path)
+    assert session.update()
+    assert session.parsed_headers == 4
+    with open(out_path) as reader:
+        assert reader.read() == expected_output(session)
+
+    mtime = os.stat(out_path).st_mtime_ns
+    write_header(tmpdir / 'c.h', '#define C_ONE 7\n#define C_TWO 8\n\n')
+    assert not session.update({os.path.realpath(tmpdir / 'c.h')})
+    assert session.parsed_headers == 1
+    assert os.stat(out_path).st_mtime_ns == mtime
+
+    write_header(tmpdir / 'a.h', '#define A_ONE 1\n#define A_TWO 3\n#define A_THREE 4\n')
+    assert session.update({os.path.realpath(tmpdir / 'a.h')})
+    assert session.parsed_headers == 2  # b.h refers to A_TWO and is parsed after a.h, c.h is not parsed again
+    assert session.parsed_macros['B_ONE'] == 4
+    with open(out_path) as reader:
+        assert reader.read() == expected_output(session)
+
+
+def test_watch_session_includes(tmpdir):
+    out_path = str(tmpdir / 'out.h')
+    session = create_session(tmpdir, out_path)
+    session.update()
+    write_header(tmpdir / 'd.h', '#define D_ONE 1\n#define D_TWO 2\n')
+    write_header(tmpdir / 'c.h', '#include "d.h"\n#define C_ONE 7\n#define C_TWO 8\n')
+    assert session.update({os.path.realpath(tmpdir / 'c.h')})
+    assert os.path.realpath(tmpdir / 'd.h') in session.paths
+    with open(out_path) as reader:
+        assert 'D_ONE' in reader.read()
+
+
+@pytest.mark.parametrize('watcher', [PollingWatcher(0.01), create_watcher()], ids=['polling', 'default'])
+def test_watcher(tmpdir, watcher):
+    write_header(tmpdir / 'a.h', '#define A 1\n')
+    write_header(tmpdir / 'b.h', '#define B 1\n')
+    watcher.watch([str(tmpdir / 'a.h'), str(tmpdir / 'b.h')])
+    assert watcher.wait(0.05) == set()
+    os.replace(tmpdir / 'b.h', tmpdir / 'a.h')
+    assert watcher.wait(5) == {os.path.realpath(tmpdir / 'a.h'), os.path.realpath(tmpdir / 'b.h')}
+    watcher.close()
@@ -1,4 +1,39 @@
-from .transpose import *
-from .macros import *
-from .enums import *
-from .macro_creator import *
+import importlib
+
+# the public names of the package, by the module defining them. modules are imported on first access (PEP 562), so
+# importing the package (or running transpose --help) does not load pyclibrary and networkx
+_LAZY_NAMES = {
+    '.transpose': ('iter_formatted', 'iter_output', 'create_output', 'parse_macro_arguments', 'file_digest',
+                   'write_output', 'default_depfile', 'default_source', 'create_source', 'header_group_prefix',
+                   'escape_make', 'write_depfile', 'parse_headers', 'iter_transposed', 'transpose_files',
+                   'transpose_header', 'main', 'batch_main'),
+    '.macros': ('Define', 'strip_underscore', 'parse_macros_values', 'merge_prefixes', 'find_prefixes',
+                'split_default_parser', 'group_defines', 'iter_define_macros', 'create_define_macros'),
+    '.enums': ('Enumee', 'iter_enum_groups', 'iter_enum_macros', 'create_enum_macros'),
+    '.macro_creator': ('CDefinition', 'MacroCreator', 'OUTPUT_STYLES', 'OUTPUT_FORMATS', 'SourceFile', 'name_hash',
+                       'perfect_hash'),
+    '.tables': ('iter_tables', 'iter_python_module', 'iter_json_tables'),
+    '.runtime': ('LookupTable', 'load_tables'),
+    '.macros_resolver': ('MacrosResolver', 'extract_references'),
+    '.arithmatic_parser': ('MacrosArithmeticParser', 'create_arithmetic_parser', 'ARITHMETIC_BACKENDS'),
+    '.fast_parser': ('FastParser', 'create_parser', 'FRONTENDS'),
+    '.compiler_parser': ('compiler_definitions', 'preprocess_definitions', 'probe_values'),
+    '.cache': ('DefinitionsCache', 'DEFAULT_CACHE_DIR'),
+    '.recursive_utils': ('RecursiveUtil', ),
+    '.stats': ('Stats', 'collect_stats', 'profile'),
+    'pyclibrary': ('CParser', ),
+}
+_MODULES = {name: module for module, names in _LAZY_NAMES.items() for name in names}
+__all__ = list(_MODULES)
+
+
+def __getattr__(name: str):
+    if name not in _MODULES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(_MODULES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
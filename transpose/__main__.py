@@ -1,15 +1,149 @@
 #! /usr/bin/env python
 # PYTHON_ARGCOMPLETE_OK
 import argparse
-from .transpose import main
+import contextlib
+import json
+from .arithmatic_parser import ARITHMETIC_BACKENDS
+from .cache import DEFAULT_CACHE_DIR
+from .client import DEFAULT_SOCKET
+from .fast_parser import FRONTENDS
+from .macro_creator import OUTPUT_STYLES, OUTPUT_FORMATS
 import os, sys
+# the modules doing the actual work (and pyclibrary, networkx) are imported only after the arguments are parsed,
+# so --help and the shell completion start fast
 
 DEFAULT_MAX_HEADERS = 20
+# options a batch manifest target can override, by their argparse dest
+TARGET_OPTIONS = ('D', 'recursive', 'parse_std', 'compiler', 'I', 'max_headers', 'force', 'evaluator', 'style',
+                  'MD', 'MF', 'output_format', 'frontend', 'from_str')
+
+
+def _target_arguments(target: dict):
+    """
+    Converts the options of a single target to arguments of transpose_header
+    :param target: dictionary of in_file, out_file and TARGET_OPTIONS
+    :return: dictionary of keyword arguments
+    :rtype: dict
+    """
+    depfile = target['MF']
+    if depfile is None and target['MD']:
+        from .transpose import default_depfile
+        depfile = default_depfile(target['out_file'])
+    include_dirs = list(target['I'])
+    if os.path.curdir not in [os.path.realpath(include_dir) for include_dir in include_dirs]:  # add cwd if not present
+        include_dirs.insert(0, os.path.curdir)
+    return dict(path=target['in_file'],
+                out_path=target['out_file'],
+                macros=target['D'],
+                recursive=target['recursive'],
+                parse_std=target['parse_std'],
+                compiler=target['compiler'],
+                include_dirs=include_dirs,
+                max_headers=target['max_headers'],
+                force=target['force'],
+                evaluator=target['evaluator'],
+                style=target['style'],
+                depfile=depfile,
+                output_format=target['output_format'],
+                frontend=target['frontend'],
+                from_str=target['from_str']
+                )
+
+
+def _batch_targets(batch: list, defaults: dict):
+    """
+    Collects the targets of a batch run
+    :param batch: list of in_file:out_file pairs and paths of json manifests. a manifest holds a list of objects with
+                  in_file and out_file, and optionally any of TARGET_OPTIONS, overriding the command line options.
+                  relative paths in a manifest (in_file, out_file, I and MF) are relative to its directory
+    :param defaults: the command line options
+    :return: list of dictionaries of transpose_header arguments
+    :rtype: list
+    """
+    targets = []
+    for entry in batch:
+        if entry.endswith('.json'):
+            with open(entry, 'r') as reader:
+                manifest = json.load(reader)
+            base_dir = os.path.dirname(entry)
+        elif entry.count(':') == 1:
+            in_file, out_file = entry.split(':')
+            manifest = [{'in_file': in_file, 'out_file': out_file}]
+            base_dir = ''
+        else:
+            raise ValueError(f'batch entries must be manifest.json or in_file:out_file, got {entry}')
+        for target in manifest:
+            unknown = set(target) - set(TARGET_OPTIONS) - {'in_file', 'out_file'}
+            if unknown or 'in_file' not in target or 'out_file' not in target:
+                raise ValueError(f'invalid batch target {target} in {entry}')
+            for option in ('D', 'I'):
+                if option in target and not isinstance(target[option], list):
+                    raise ValueError(f'{option} must be a list in batch target {target} in {entry}')
+            target = dict(target, in_file=os.path.join(base_dir, target['in_file']),
+                          out_file=os.path.join(base_dir, target['out_file']))
+            if 'I' in target:
+                target['I'] = [os.path.join(base_dir, include_dir) for include_dir in target['I']]
+            if target.get('MF') is not None:
+                target['MF'] = os.path.join(base_dir, target['MF'])
+            targets.append(_target_arguments({**defaults, **target}))
+    return targets
+
+
+def _absolute_paths(target: dict):
+    """
+    :param target: dictionary of transpose_header arguments
+    :return: the arguments, with the paths made absolute, so they don't depend on the working directory
+    :rtype: dict
+    """
+    return dict(target,
+                path=os.path.abspath(target['path']),
+                out_path=os.path.abspath(target['out_path']),
+                include_dirs=[os.path.abspath(include_dir) for include_dir in target['include_dirs']],
+                depfile=os.path.abspath(target['depfile']) if target['depfile'] is not None else None)
+
+
+def _transpose_by_server(socket_path: str, targets: list):
+    """
+    Transposes targets by a server started with transpose serve
+    :param socket_path: path of the server's unix socket
+    :param targets: list of dictionaries of transpose_header arguments
+    :return: exit code, None if no server is listening on socket_path
+    """
+    from .client import connectable, request
+    if not connectable(socket_path):
+        return None
+    result = 0
+    for target in targets:
+        try:
+            code, error = request(socket_path, _absolute_paths(target))
+        except (OSError, ValueError) as failure:
+            code, error = -1, f'request failed: {failure}'
+        if code != 0:
+            print(f'{target["path"]}: {error}' if len(targets) > 1 else error, file=sys.stderr)
+            result = -1
+    return result
+
+
+def _serve(argv: list):
+    from .server import DEFAULT_WORKERS, serve_main
+    parser = argparse.ArgumentParser(prog='transpose serve',
+                                     description='Transpose headers for transpose --server clients, keeping the parsed '
+                                                 'headers in memory between requests')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET,
+                        help=f'unix socket to listen on ({DEFAULT_SOCKET} by default)')
+    parser.add_argument('-j', '--jobs', default=DEFAULT_WORKERS, type=int,
+                        help=f'number of requests handled at the same time, their parsing is serialized '
+                             f'({DEFAULT_WORKERS} by default)')
+    args = parser.parse_args(argv)
+    return serve_main(args.socket, args.jobs)
+
 
 def _main():
+    if sys.argv[1:2] == ['serve']:
+        return _serve(sys.argv[2:])
     parser = argparse.ArgumentParser(prog='transpose', description='Create macros to reverse enums and defines from header file')
-    parser.add_argument('in_file', help='input file')
-    parser.add_argument('out_file', help='output file.')
+    parser.add_argument('in_file', nargs='?', help='input file')
+    parser.add_argument('out_file', nargs='?', help='output file.')
     parser.add_argument('-D', action='append', default=[], metavar='macro[=defn]',
                         help='pass macros, as in gcc, for the preproceccor (i.e -D DEBUG)')
     parser.add_argument('-r', dest='recursive', action='store_true',
@@ -17,39 +151,129 @@ def _main():
     parser.add_argument('--parse-std', dest='parse_std', action='store_true',
                         help='when -r is given parse <> includes as well')
     parser.add_argument('--compiler', default='gcc',
-                        help='when parse-std is given, use the same default include directories as the provided compiler')
+                        help='when parse-std is given, use the same default include directories as the provided compiler '
+                             '(with --frontend compiler, also preprocess the headers and evaluate the values with it)')
     parser.add_argument('-I', action='append', default=[], metavar='dir',
                         help='add include directories to search when recursively transposing headers')
     parser.add_argument('--max-headers', dest='max_headers', default=DEFAULT_MAX_HEADERS, type=int,
                         help=f'maximum number of headers to parse in recursion mode ({DEFAULT_MAX_HEADERS} by default)')
     parser.add_argument('-f,--force', action='store_true', dest='force',
                         help='overwrite existing out_path')
+    parser.add_argument('--evaluator', choices=ARITHMETIC_BACKENDS, default='native',
+                        help='backend used to evaluate the values of macros (native by default, plusminus requires the plusminus package)')
+    parser.add_argument('--style', choices=OUTPUT_STYLES, default='switch',
+                        help='switch creates a switch copying the names, lookup also creates NAME_TO_STR functions, '
+                             'finding the names in tables indexed by value or by binary search, functions declares '
+                             'the functions in out_file and defines them in a source file next to it (out.h -> out.c), '
+                             'compiled once instead of at every call site (switch by default)')
+    parser.add_argument('--from-str', dest='from_str', action='store_true',
+                        help='also create NAME_FROM_STR functions, finding the value of a name (i.e from a config '
+                             'file) by a minimal perfect hash of the names of the group')
+    parser.add_argument('--format', dest='output_format', choices=OUTPUT_FORMATS, default='c',
+                        help='c creates a header of parsers, python creates a module of lookup tables (TABLES) and json '
+                             'a json file of them, both loaded without parsing the header (see transpose.runtime) '
+                             '(c by default)')
+    parser.add_argument('--frontend', choices=FRONTENDS, default='pyclibrary',
+                        help='pyclibrary parses all the declarations of the headers, fast reads them line by line and '
+                             'extracts only the macros and the enums, skipping the other declarations, compiler '
+                             'preprocesses the headers with --compiler and evaluates all the values with a single '
+                             'compiled probe (pyclibrary by default)')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=DEFAULT_CACHE_DIR,
+                        help=f'directory in which parsed headers are cached ({DEFAULT_CACHE_DIR} by default)')
+    parser.add_argument('--no-cache', dest='cache_dir', action='store_const', const=None,
+                        help='do not use the parsed headers cache')
+    parser.add_argument('--batch', nargs='+', metavar='manifest.json|in_file:out_file',
+                        help='transpose many headers in one process, sharing the parsed headers between them. '
+                             'the other options apply to all the targets, unless overridden in the manifest')
+    parser.add_argument('-j', '--jobs', default=1, type=int,
+                        help='number of processes used to parse independent headers with -r, '
+                             'or to transpose the targets of --batch (1 by default)')
+    parser.add_argument('-MD', action='store_true',
+                        help='also write a make compatible dependency file listing the parsed headers, '
+                             'named as out_file with a .d suffix unless -MF is given')
+    parser.add_argument('-MF', metavar='depfile',
+                        help='write the dependency file to depfile (implies -MD)')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running, and transpose again whenever the header (or the headers it includes) changes. '
+                             'only the changed headers are parsed again, and out_file is written only if it changed')
+    parser.add_argument('--stats', action='store_true',
+                        help='print the time, peak memory and counts (headers, macros, enums, parsers) of each stage to stderr')
+    parser.add_argument('--stats-json', dest='stats_json', metavar='stats.json',
+                        help='write the stats of each stage to a json file')
+    parser.add_argument('--profile', metavar='out.prof',
+                        help='profile the run with cProfile and write the profile to out.prof (for pstats or snakeviz)')
+    parser.add_argument('--server', nargs='?', const=DEFAULT_SOCKET, metavar='socket',
+                        help='transpose by a server started with transpose serve, listening on socket '
+                             f'({DEFAULT_SOCKET} by default). runs locally if no server is listening')
     parser.set_defaults(force=False)
-    try:
-        import argcomplete
-        argcomplete.autocomplete(parser)
-    except ImportError:
-        pass
+    if '_ARGCOMPLETE' in os.environ:  # set by the shell when completing
+        try:
+            import argcomplete
+            argcomplete.autocomplete(parser)
+        except ImportError:
+            pass
     args = parser.parse_args()
     if not args.recursive:
         if args.parse_std or args.I:
             print("Warning: no -r , ignoring --parse-std,-I and max-headers")
-    if args.compiler != 'gcc' and not args.parse_std:
+    if args.compiler != 'gcc' and not args.parse_std and args.frontend != 'compiler':
         print("Warning: no --parse-std, ignoring --compiler")
-    if os.path.curdir not in [os.path.realpath(include_dir) for include_dir in args.I]:  # add cwd if not present
-        args.I.insert(0, os.path.curdir)
-    return main(args.in_file,
-                args.out_file,
-                args.D,
-                args.recursive,
-                args.parse_std,
-                args.compiler,
-                args.I,
-                args.max_headers,
-                args.force
-                )
+    if args.batch is not None:
+        if args.watch:
+            parser.error('--watch can not be used with --batch')
+        if args.in_file is not None:
+            parser.error('in_file and out_file can not be used with --batch')
+    elif args.out_file is None:
+        parser.error('the following arguments are required: in_file, out_file')
+    if args.server is not None and args.watch:
+        parser.error('--watch can not be used with --server')
+    if not (args.stats or args.stats_json or args.profile):
+        return _run(args)
+    from .stats import collect_stats, profile
+    with contextlib.ExitStack() as stack:
+        collected = stack.enter_context(collect_stats()) if args.stats or args.stats_json else None
+        if args.profile is not None:
+            stack.enter_context(profile(args.profile))
+        try:
+            return _run(args)
+        finally:
+            stack.close()
+            if args.stats:
+                print(collected.format(), file=sys.stderr)
+            if args.stats_json is not None:
+                collected.write_json(args.stats_json)
+
+
+def _run(args: argparse.Namespace):
+    """
+    Runs the transpose mode selected by the command line arguments
+    :param args: the parsed arguments
+    :return: exit code
+    """
+    if args.batch is not None:
+        try:
+            targets = _batch_targets(args.batch, {option: getattr(args, option) for option in TARGET_OPTIONS})
+        except (OSError, ValueError) as error:
+            print(error, file=sys.stderr)
+            return -1
+        if args.server is not None:
+            result = _transpose_by_server(args.server, targets)
+            if result is not None:
+                return result
+        from .transpose import batch_main
+        return batch_main(targets, args.jobs, args.cache_dir)
+    if args.server is not None:
+        result = _transpose_by_server(args.server, [_target_arguments(vars(args))])
+        if result is not None:
+            return result
+    if args.watch:
+        from .watch import watch_main
+        return watch_main(cache_dir=args.cache_dir, **_target_arguments(vars(args)))
+    from .transpose import main
+    return main(cache_dir=args.cache_dir,
+                jobs=args.jobs,
+                **_target_arguments(vars(args)))
 
 
 if __name__ == '__main__':
     sys.exit(_main())
-
@@ -1,12 +1,533 @@
-from plusminus import ArithmeticParser
-try:
-    from plusminus import LiteralNode
-except ImportError:
-    from plusminus.plusminus import LiteralNode
+import re
+from functools import lru_cache
 
+ARITHMETIC_BACKENDS = ('native', 'plusminus')
+
+# C types are represented by (bits, unsigned), using the LP64 model. floating types have 0 bits
+CHAR = (8, False)
+UCHAR = (8, True)
+SHORT = (16, False)
+USHORT = (16, True)
+INT = (32, False)
+UINT = (32, True)
+LONG = (64, False)
+ULONG = (64, True)
+BOOL = (1, True)
+FLOAT = (0, False)
+
+# typedef names commonly found in casts, mapped to their C type and size
+TYPEDEFS = {
+    'int8_t': CHAR, 'uint8_t': UCHAR, '__s8': CHAR, '__u8': UCHAR, 's8': CHAR, 'u8': UCHAR,
+    'int16_t': SHORT, 'uint16_t': USHORT, '__s16': SHORT, '__u16': USHORT, 's16': SHORT, 'u16': USHORT,
+    'int32_t': INT, 'uint32_t': UINT, '__s32': INT, '__u32': UINT, 's32': INT, 'u32': UINT,
+    'int64_t': LONG, 'uint64_t': ULONG, '__s64': LONG, '__u64': ULONG, 's64': LONG, 'u64': ULONG,
+    'size_t': ULONG, 'ssize_t': LONG, 'intptr_t': LONG, 'uintptr_t': ULONG, 'ptrdiff_t': LONG,
+    'intmax_t': LONG, 'uintmax_t': ULONG, 'off_t': LONG,
+}
+TYPE_KEYWORDS = {'char', 'short', 'int', 'long', 'signed', 'unsigned', '_Bool', 'bool', 'float', 'double', 'void',
+                 'const', 'volatile'}
+
+TOKEN_REGEX = re.compile(r"""\s*(?:
+    (?P<float>(?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?[fFlL]?|\d+[eE][+-]?\d+[fFlL]?)
+    |(?P<int>(?:0[xX][0-9a-fA-F]+|0[bB][01]+|\d+))(?P<suffix>[uUlL]*)(?![\w.])
+    |(?P<char>'(?:\\.|[^'\\])+')
+    |(?P<ident>[A-Za-z_]\w*)
+    |(?P<op><<|>>|<=|>=|==|!=|&&|\|\||[-+*/%<>&^|!~?:()])
+    )""", re.VERBOSE)
+CHAR_ESCAPES = {'n': 10, 't': 9, 'r': 13, '0': 0, 'a': 7, 'b': 8, 'f': 12, 'v': 11, 'e': 27,
+                '\\': 92, "'": 39, '"': 34, '?': 63}
+CHAR_REGEX = re.compile(r"\\(x[0-9a-fA-F]+|[0-7]{1,3}|.)|(.)", re.DOTALL)
+
+BINARY_PRECEDENCE = {
+    '||': 1, '&&': 2, '|': 3, '^': 4, '&': 5,
+    '==': 6, '!=': 6,
+    '<': 7, '>': 7, '<=': 7, '>=': 7,
+    '<<': 8, '>>': 8,
+    '+': 9, '-': 9,
+    '*': 10, '/': 10, '%': 10,
+}
+
+
+class CExpressionError(ValueError):
+    """
+    raised when a string is not a valid C constant expression
+    """
+    pass
+
+
+def wrap(value, ctype: tuple):
+    """
+    Converts a value to a C type, truncating it to the type's width
+    :param value: integer or floating point value
+    :param ctype: (bits, unsigned) tuple
+    :return: the converted value
+    """
+    bits, unsigned = ctype
+    if not bits:
+        return float(value)
+    if isinstance(value, float):
+        value = int(value)
+    if ctype == BOOL:
+        return int(value != 0)
+    value &= (1 << bits) - 1
+    if not unsigned and value >> (bits - 1):
+        value -= 1 << bits
+    return value
+
+
+def promote(ctype: tuple):
+    """
+    Applies the C integer promotions to a type
+    :param ctype: (bits, unsigned) tuple
+    :return: the promoted type
+    :rtype: tuple
+    """
+    if ctype[0] and ctype[0] < INT[0]:
+        return INT
+    return ctype
+
+
+def common_type(left: tuple, right: tuple):
+    """
+    Applies the C usual arithmetic conversions to the types of two operands
+    :param left: (bits, unsigned) tuple
+    :param right: (bits, unsigned) tuple
+    :return: the type both operands are converted to
+    :rtype: tuple
+    """
+    if not left[0] or not right[0]:
+        return FLOAT
+    left = promote(left)
+    right = promote(right)
+    if left[0] == right[0]:
+        return left[0], left[1] or right[1]
+    return left if left[0] > right[0] else right
+
+
+def constant_type(value):
+    """
+    Guess the C type of an already evaluated value, the same way the type of a hexadecimal literal is picked
+    :param value: integer or floating point value
+    :return: (bits, unsigned) tuple
+    :rtype: tuple
+    """
+    if isinstance(value, float):
+        return FLOAT
+    if not isinstance(value, int):
+        raise CExpressionError(f'{value!r} is not a numeric value')
+    for ctype in (INT, UINT, LONG, ULONG):
+        if wrap(value, ctype) == value:
+            return ctype
+    return ULONG
+
+
+def literal_type(value: int, suffix: str, decimal: bool):
+    """
+    Finds the type of an integer literal, as described in the C standard (6.4.4.1)
+    :param value: value of the literal
+    :param suffix: the u/l suffix of the literal
+    :param decimal: True if the literal is written in base 10
+    :return: (bits, unsigned) tuple
+    :rtype: tuple
+    """
+    suffix = suffix.lower()
+    if suffix not in ('', 'u', 'l', 'ul', 'lu', 'll', 'ull', 'llu'):
+        raise CExpressionError(f'invalid integer suffix {suffix}')
+    if 'u' in suffix:
+        candidates = (UINT, ULONG) if 'l' not in suffix else (ULONG, )
+    elif decimal:
+        candidates = (INT, LONG) if 'l' not in suffix else (LONG, )
+    else:
+        candidates = (INT, UINT, LONG, ULONG) if 'l' not in suffix else (LONG, ULONG)
+    for ctype in candidates:
+        if wrap(value, ctype) == value:
+            return ctype
+    return ULONG
+
+
+def char_value(literal: str):
+    """
+    Evaluates a C character constant, multi-character constants are evaluated the way gcc does
+    :param literal: the character constant, including the quotes
+    :return: integer value
+    :rtype: int
+    """
+    value = 0
+    matches = list(CHAR_REGEX.finditer(literal[1:-1]))
+    for match in matches:
+        escape, char = match.groups()
+        if char is not None:
+            code = ord(char)
+        elif escape[0] == 'x':
+            code = int(escape[1:], 16)
+        elif escape[0] in '01234567':
+            code = int(escape, 8)
+        elif escape in CHAR_ESCAPES:
+            code = CHAR_ESCAPES[escape]
+        else:
+            code = ord(escape)
+        value = (value << 8) | (code & 0xff)
+    if len(matches) == 1:
+        return wrap(value, CHAR)
+    return wrap(value, INT)
+
+
+def c_div(left, right):
+    """
+    Divides like C does, rounding integer results toward zero
+    """
+    if isinstance(left, float) or isinstance(right, float):
+        return left / right
+    if right == 0:
+        raise ZeroDivisionError('division by zero')
+    quotient = abs(left) // abs(right)
+    return -quotient if (left < 0) != (right < 0) else quotient
+
+
+def c_mod(left, right):
+    """
+    Calculates the remainder like C does, the result has the sign of the dividend
+    """
+    if isinstance(left, float) or isinstance(right, float):
+        raise CExpressionError('invalid operands to binary %')
+    return left - right * c_div(left, right)
+
+
+def c_shift(left, right, operator):
+    """
+    Shifts an integer like C does
+    """
+    if isinstance(left, float) or isinstance(right, float):
+        raise CExpressionError(f'invalid operands to binary {operator}')
+    if right < 0:
+        raise CExpressionError('negative shift count')
+    right = min(right, 128)  # the result is truncated to at most 64 bits anyway
+    return left << right if operator == '<<' else left >> right
+
+
+def bitwise(function, operator):
+    """
+    Wraps a bitwise operation so it fails on floating point operands
+    """
+    def operation(left, right):
+        if isinstance(left, float) or isinstance(right, float):
+            raise CExpressionError(f'invalid operands to binary {operator}')
+        return function(left, right)
+    return operation
+
+
+ARITHMETIC_OPERATIONS = {
+    '+': lambda left, right: left + right,
+    '-': lambda left, right: left - right,
+    '*': lambda left, right: left * right,
+    '/': c_div,
+    '%': c_mod,
+    '&': bitwise(lambda left, right: left & right, '&'),
+    '^': bitwise(lambda left, right: left ^ right, '^'),
+    '|': bitwise(lambda left, right: left | right, '|'),
+}
+COMPARISON_OPERATIONS = {
+    '==': lambda left, right: left == right,
+    '!=': lambda left, right: left != right,
+    '<': lambda left, right: left < right,
+    '>': lambda left, right: left > right,
+    '<=': lambda left, right: left <= right,
+    '>=': lambda left, right: left >= right,
+}
+
+
+def tokenize(expression: str):
+    """
+    Splits a C constant expression to tokens
+    :param expression: the expression
+    :return: list of (kind, text, suffix) tuples, kind is one of float, int, char, ident and op
+    :rtype: list
+    """
+    tokens = []
+    position = 0
+    end = len(expression.rstrip())
+    while position < end:
+        match = TOKEN_REGEX.match(expression, position)
+        if not match:
+            raise CExpressionError(f'invalid token at {expression[position:].strip()!r}')
+        kind = match.lastgroup if match.lastgroup != 'suffix' else 'int'
+        tokens.append((kind, match.group(kind), match.group('suffix') or ''))
+        position = match.end()
+    return tokens
+
+
+class ExpressionCompiler:
+    """
+    Precedence climbing parser, compiling the tokens of a C constant expression into a closure.
+    the closure receives a dictionary of variables and returns the (value, type) of the expression
+    """
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.position = 0
+
+    def peek(self, offset=0):
+        if self.position + offset < len(self.tokens):
+            return self.tokens[self.position + offset]
+        return None, None, None
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise CExpressionError(f'unexpected end of expression {self.expression!r}')
+        self.position += 1
+        return token
+
+    def expect(self, text: str):
+        kind, token, _ = self.next()
+        if kind != 'op' or token != text:
+            raise CExpressionError(f'expected {text!r} but found {token!r} in {self.expression!r}')
+
+    def compile(self):
+        """
+        :return: closure evaluating the expression
+        """
+        if not self.tokens:
+            raise CExpressionError('empty expression')
+        evaluator = self.conditional()
+        if self.position != len(self.tokens):
+            raise CExpressionError(f'unexpected {self.peek()[1]!r} in {self.expression!r}')
+        return evaluator
+
+    def conditional(self):
+        condition = self.binary(1)
+        if self.peek()[:2] != ('op', '?'):
+            return condition
+        self.next()
+        if_true = self.conditional()
+        self.expect(':')
+        if_false = self.conditional()
+
+        def evaluate(variables):
+            selected, other = (if_true, if_false) if condition(variables)[0] else (if_false, if_true)
+            value, ctype = selected(variables)
+            # the result has the common type of both branches, though only the selected one is evaluated
+            try:
+                ctype = common_type(ctype, other(variables)[1])
+            except (ArithmeticError, NameError, ValueError):  # i.e a division by zero the condition guards against
+                ctype = promote(ctype)
+            return wrap(value, ctype), ctype
+        return evaluate
+
+    def binary(self, min_precedence: int):
+        left = self.unary()
+        while True:
+            kind, operator, _ = self.peek()
+            if kind != 'op' or BINARY_PRECEDENCE.get(operator, 0) < min_precedence:
+                return left
+            self.next()
+            right = self.binary(BINARY_PRECEDENCE[operator] + 1)
+            left = self.binary_operation(operator, left, right)
+
+    @staticmethod
+    def binary_operation(operator: str, left, right):
+        if operator == '&&':
+            def evaluate(variables):
+                return int(bool(left(variables)[0]) and bool(right(variables)[0])), INT
+        elif operator == '||':
+            def evaluate(variables):
+                return int(bool(left(variables)[0]) or bool(right(variables)[0])), INT
+        elif operator in ('<<', '>>'):
+            def evaluate(variables):
+                left_value, left_type = left(variables)
+                ctype = promote(left_type)
+                return wrap(c_shift(left_value, right(variables)[0], operator), ctype), ctype
+        elif operator in COMPARISON_OPERATIONS:
+            comparison = COMPARISON_OPERATIONS[operator]
+
+            def evaluate(variables):
+                left_value, left_type = left(variables)
+                right_value, right_type = right(variables)
+                ctype = common_type(left_type, right_type)
+                return int(comparison(wrap(left_value, ctype), wrap(right_value, ctype))), INT
+        else:
+            operation = ARITHMETIC_OPERATIONS[operator]
+
+            def evaluate(variables):
+                left_value, left_type = left(variables)
+                right_value, right_type = right(variables)
+                ctype = common_type(left_type, right_type)
+                return wrap(operation(wrap(left_value, ctype), wrap(right_value, ctype)), ctype), ctype
+        return evaluate
+
+    def unary(self):
+        kind, token, _ = self.peek()
+        if kind == 'op' and token in ('+', '-', '~', '!'):
+            self.next()
+            operand = self.unary()
+            return self.unary_operation(token, operand)
+        if kind == 'ident' and token == 'sizeof':
+            self.next()
+            return self.sizeof()
+        if kind == 'op' and token == '(' and self.is_type_name(self.peek(1)):
+            self.next()
+            ctype = self.type_name()[0]
+            self.expect(')')
+            operand = self.unary()
+
+            def evaluate(variables):
+                return wrap(operand(variables)[0], ctype), promote(ctype)
+            return evaluate
+        return self.primary()
+
+    @staticmethod
+    def unary_operation(operator: str, operand):
+        if operator == '!':
+            def evaluate(variables):
+                return int(not operand(variables)[0]), INT
+        elif operator == '~':
+            def evaluate(variables):
+                value, ctype = operand(variables)
+                if not ctype[0]:
+                    raise CExpressionError('invalid operand to unary ~')
+                ctype = promote(ctype)
+                return wrap(~value, ctype), ctype
+        elif operator == '-':
+            def evaluate(variables):
+                value, ctype = operand(variables)
+                ctype = promote(ctype)
+                return wrap(-value, ctype), ctype
+        else:
+            def evaluate(variables):
+                value, ctype = operand(variables)
+                return value, promote(ctype)
+        return evaluate
+
+    @staticmethod
+    def is_type_name(token: tuple):
+        return token[0] == 'ident' and (token[1] in TYPE_KEYWORDS or token[1] in TYPEDEFS)
+
+    def type_name(self):
+        """
+        Parses a type name used in a cast or sizeof
+        :return: the type and its size in bytes
+        :rtype: tuple
+        """
+        words = []
+        while self.is_type_name(self.peek()):
+            words.append(self.next()[1])
+        if self.peek()[:2] == ('op', '*'):
+            while self.peek()[:2] == ('op', '*'):
+                self.next()
+            return ULONG, 8
+        words = [word for word in words if word not in ('const', 'volatile')]
+        if len(words) == 1 and words[0] in TYPEDEFS:
+            ctype = TYPEDEFS[words[0]]
+            return ctype, ctype[0] // 8
+        if 'void' in words:
+            raise CExpressionError('cast to void in constant expression')
+        if 'float' in words:
+            return FLOAT, 4
+        if 'double' in words:
+            return FLOAT, 16 if 'long' in words else 8
+        if '_Bool' in words or 'bool' in words:
+            return BOOL, 1
+        unsigned = 'unsigned' in words
+        if 'char' in words:
+            ctype = (8, unsigned)
+        elif 'short' in words:
+            ctype = (16, unsigned)
+        elif 'long' in words:
+            ctype = (64, unsigned)
+        else:
+            ctype = (32, unsigned)
+        return ctype, ctype[0] // 8
+
+    def sizeof(self):
+        if self.peek()[:2] == ('op', '(') and self.is_type_name(self.peek(1)):
+            self.next()
+            size = self.type_name()[1]
+            self.expect(')')
+
+            def evaluate(variables):
+                return size, ULONG
+            return evaluate
+        operand = self.unary()
+
+        def evaluate(variables):
+            ctype = operand(variables)[1]
+            return (ctype[0] // 8 if ctype[0] else 8), ULONG
+        return evaluate
+
+    def primary(self):
+        kind, token, suffix = self.next()
+        if kind == 'int':
+            if len(token) > 1 and token[0] == '0' and token[1] in 'xXbB':
+                value = int(token, 0)
+            elif token[0] == '0':
+                try:
+                    value = int(token, 8)
+                except ValueError:
+                    raise CExpressionError(f'invalid octal constant {token}') from None
+            else:
+                value = int(token)
+            result = value, literal_type(value, suffix, token[0] != '0' or token == '0')
+            return lambda variables: result
+        if kind == 'float':
+            result = float(token.rstrip('fFlL')), FLOAT
+            return lambda variables: result
+        if kind == 'char':
+            result = char_value(token), INT
+            return lambda variables: result
+        if kind == 'ident':
+            if self.peek()[:2] == ('op', '('):
+                raise CExpressionError(f"'{token}' is not a recognized function")
+            return self.variable(token)
+        if token == '(':
+            evaluator = self.conditional()
+            self.expect(')')
+            return evaluator
+        raise CExpressionError(f'unexpected {token!r} in {self.expression!r}')
+
+    @staticmethod
+    def variable(name: str):
+        def evaluate(variables):
+            try:
+                value = variables[name]
+            except KeyError:
+                raise NameError(f"variable '{name}' not known") from None
+            return value, constant_type(value)
+        return evaluate
+
+
+@lru_cache(maxsize=8192)
+def compile_expression(expression: str):
+    """
+    Compiles a C constant expression, compiled expressions are cached so they can be reused by all parsers
+    :param expression: the expression
+    :return: closure receiving a variables dictionary, and returning the (value, type) of the expression
+    """
+    return ExpressionCompiler(expression).compile()
+
+
+class CExpression:
+    """
+    class holding a compiled expression, and the variables it's evaluated with
+    """
+    def __init__(self, evaluator, variables: dict):
+        self._evaluator = evaluator
+        self._variables = variables
+
+    def evaluate(self):
+        """
+        :return: the value of the expression
+        :rtype: int or float
+        """
+        return self._evaluator(self._variables)[0]
+
+
+class MacrosArithmeticParser:
+    """
+    Evaluator of C integer (and floating point) constant expressions found in macros
+    """
+    def __init__(self):
+        self._variable_map = {}
 
-# TODO: write tests for all this shit, maybe break up main a little
-class MacrosArithmeticParser(ArithmeticParser):
     def add_variables(self, vars_dict: dict, reset=False):
         """
         Update the vars and constants dictionary used when parsing a string, if reset is True, then the current dictionary
@@ -15,13 +536,30 @@ class MacrosArithmeticParser(ArithmeticParser):
         :param reset: if True, the old dictionary will be ignored
         :return: None
         """
-        formatted_dict = {}
-        for var_name, value in vars_dict.items():
-            formatted_dict[var_name] = LiteralNode([value])
         if reset:
-            self._variable_map = formatted_dict
+            self._variable_map = dict(vars_dict)
         else:
-            self._variable_map.update(formatted_dict)
+            self._variable_map.update(vars_dict)
+
+    def parse(self, expression: str):
+        """
+        Compiles an expression, might raise CExpressionError
+        :param expression: C constant expression
+        :return: the compiled expression
+        :rtype: CExpression
+        """
+        return CExpression(compile_expression(expression), self._variable_map)
+
 
-    def customize(self):
-        self.add_operator('0x', 1, ArithmeticParser.RIGHT, lambda a: int(a, 16))
+def create_arithmetic_parser(backend='native'):
+    """
+    Creates the parser used to evaluate the values of macros
+    :param backend: one of ARITHMETIC_BACKENDS, 'plusminus' requires the plusminus package
+    :return: parser with the add_variables and parse methods
+    """
+    if backend == 'native':
+        return MacrosArithmeticParser()
+    if backend == 'plusminus':
+        from .plusminus_parser import PlusminusArithmeticParser
+        return PlusminusArithmeticParser()
+    raise ValueError(f'unknown arithmetic backend {backend}, expected one of {", ".join(ARITHMETIC_BACKENDS)}')
@@ -0,0 +1,180 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+# part of every key, bumped when the stored definitions change so older (or broken) entries are not loaded
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+                                 'transpose')
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+CACHE_SUFFIX = '.pickle'
+
+
+class DefinitionsCache:
+    """
+    Content addressed cache of parsed header definitions, kept in memory and on disk.
+    entries are evicted by least recent use when the memory or the cache directory grows beyond max_size bytes
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE):
+        """
+        Creates a DefinitionsCache object, creating cache_dir if needed
+        :param cache_dir: directory in which entries are stored, None to keep entries only in memory
+        :param max_size: maximum total size of the entries, in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        # pickled entries, so values handed out can be modified without changing the cache
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        # the entries in memory are shared by the threads of a server
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def base_key(macros: dict, include_dirs: list, frontend='pyclibrary'):
+        """
+        Creates the key all the header keys of a run are chained to
+        :param macros: dictionary of macros defined before parsing the headers
+        :param include_dirs: list of include directories
+        :param frontend: front end the headers are parsed with, as each extracts different definitions
+        :return: hex digest
+        :rtype: str
+        """
+        digest = hashlib.sha256(f'transpose cache {CACHE_VERSION}'.encode())
+        digest.update(repr(sorted(macros.items())).encode())
+        digest.update(repr(list(include_dirs)).encode())
+        if frontend != 'pyclibrary':  # so the keys of headers parsed by pyclibrary stay the same
+            digest.update(f'frontend {frontend}'.encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def header_key(previous_key: str, path: str):
+        """
+        Creates the key of a header, the definitions of a header depend on the headers parsed before it,
+        so its key is derived from the key of the previous header
+        :param previous_key: key of the previous header (or the base key)
+        :param path: path of the header
+        :return: hex digest
+        :rtype: str
+        """
+        digest = hashlib.sha256(previous_key.encode())
+        digest.update(os.path.basename(path).encode() + b'\0')
+        with open(path, 'rb') as reader:
+            digest.update(reader.read())
+        return digest.hexdigest()
+
+    def header_keys(self, paths: list, macros: dict, include_dirs: list, frontend='pyclibrary'):
+        """
+        :param paths: list of headers, in the order they are parsed
+        :param macros: dictionary of macros defined before parsing the headers
+        :param include_dirs: list of include directories
+        :param frontend: front end the headers are parsed with (see FRONTENDS)
+        :return: list of keys, one for each header
+        :rtype: list
+        """
+        keys = []
+        key = self.base_key(macros, include_dirs, frontend)
+        for path in paths:
+            key = self.header_key(key, path)
+            keys.append(key)
+        return keys
+
+    @staticmethod
+    def derived_key(key: str, *args):
+        """
+        Creates a key for a value computed from the entry of key and args (i.e the resolved values of the macros)
+        :return: hex digest
+        :rtype: str
+        """
+        return hashlib.sha256(repr((key, ) + args).encode()).hexdigest()
+
+    def _entry_path(self, key: str):
+        return os.path.join(self.cache_dir, key + CACHE_SUFFIX)
+
+    def get(self, key: str):
+        """
+        :param key: key of the entry
+        :return: the cached value, None if the key is not in the cache
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+        if data is not None:
+            return pickle.loads(data)
+        if self.cache_dir is None:
+            return None
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as reader:
+                data = reader.read()
+            value = pickle.loads(data)
+            os.utime(path)  # mark as recently used
+        except Exception:  # missing, evicted by another process, or corrupted entries are all cache misses
+            return None
+        self._remember(key, data)
+        return value
+
+    def _remember(self, key: str, data: bytes):
+        """
+        Keeps a pickled entry in memory, evicting the least recently used entries if needed
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory_size -= len(self._memory.pop(key))
+            self._memory[key] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.max_size:
+                self._memory_size -= len(self._memory.popitem(last=False)[1])
+
+    def put(self, key: str, value):
+        """
+        Stores a value in the cache, and evicts old entries if the cache is too big
+        :param key: key of the entry
+        :param value: picklable value
+        """
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, data)
+        if self.cache_dir is None:
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as writer:
+                writer.write(data)
+            os.replace(temp_path, self._entry_path(key))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache directory fits in max_size
+        """
+        if self.cache_dir is None:
+            return
+        entries = []
+        total_size = 0
+        with os.scandir(self.cache_dir) as scanner:
+            for entry in scanner:
+                if not entry.name.endswith(CACHE_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total_size -= size
@@ -0,0 +1,41 @@
+import json
+import os
+import socket
+from .cache import DEFAULT_CACHE_DIR
+
+# the client only needs the standard library, so requests don't pay for importing the parsers
+DEFAULT_SOCKET = os.path.join(DEFAULT_CACHE_DIR, 'transpose.sock')
+
+
+def connectable(socket_path: str):
+    """
+    :param socket_path: path of a unix socket
+    :return: True if a server is listening on the socket
+    :rtype: bool
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+def request(socket_path: str, arguments: dict):
+    """
+    Transposes a single target by a server, might raise OSError if no server is listening on socket_path.
+    relative paths are resolved by the server's working directory, so they should be made absolute first
+    :param socket_path: path of the server's unix socket
+    :param arguments: dictionary of transpose_header arguments (without cache and jobs)
+    :return: exit code and error message (None if the target was transposed)
+    :rtype: tuple(int, str)
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(json.dumps(arguments).encode() + b'\n')
+        with client.makefile('rb') as reader:
+            response = reader.readline()
+    if not response:
+        raise ConnectionError(f'the server on {socket_path} closed the connection')
+    response = json.loads(response)
+    return response['exit'], response['error']
@@ -0,0 +1,212 @@
+import os
+import re
+import subprocess
+import tempfile
+from .fast_parser import FastParser
+from . import stats
+
+LINE_MARKER_REGEX = re.compile(r'#\s*(\d+)\s+"((?:\\.|[^"\\])*)"')
+DEFINE_REGEX = re.compile(r'#define\s+([A-Za-z_]\w*)(\()?\s*(.*)$')
+UNDEF_REGEX = re.compile(r'#undef\s+([A-Za-z_]\w*)')
+# values which can't be integer constants, and would confuse the compiler about the lines after them in the probe
+UNPROBED_REGEX = re.compile(r'["{};#]')
+PROBE_LABEL_REGEX = re.compile(r'_?transpose_probe_(\d+):')
+LABEL_REGEX = re.compile(r'\S+:')
+DATA_REGEX = re.compile(r'\s*\.(quad|8byte|xword|dword|long|4byte|zero|space|skip)\s+([^,\s]+)')
+DATA_SIZES = {'quad': 8, '8byte': 8, 'xword': 8, 'dword': 8, 'long': 4, '4byte': 4}
+# the probe is compiled again without the candidates the compiler rejected, at most this many times
+MAX_PROBE_COMPILES = 8
+
+PROBE_STRUCT = 'struct transpose_probe { unsigned long long value, negative, integral; };'
+# each candidate is materialised as its value (as unsigned), whether it is negative, and whether it is an integer
+PROBE_LINE = 'const struct transpose_probe transpose_probe_{index} = {{(unsigned long long)({name}), ({name}) < 0, ' \
+             '_Generic(({name}), float: 0, double: 0, long double: 0, default: 1)}};'
+
+
+def compiler_flags(macros: dict, include_dirs: list):
+    """
+    :param macros: dictionary of macros to define
+    :param include_dirs: list of include directories
+    :return: list of -D and -I arguments of the compiler
+    :rtype: list
+    """
+    flags = [f'-D{name}={value}' if value else f'-D{name}' for name, value in macros.items()]
+    for include_dir in include_dirs:
+        flags += ['-I', include_dir]
+    return flags
+
+
+def run_compiler(args: list):
+    """
+    Runs the compiler, might raise ValueError if it is not found
+    :param args: command line of the compiler
+    :return: the completed process, with its output decoded
+    :rtype: subprocess.CompletedProcess
+    """
+    try:
+        return subprocess.run(args, capture_output=True, text=True, errors='replace')
+    except OSError as error:
+        raise ValueError(f'could not run the compiler {args[0]}: {error}') from None
+
+
+def preprocess_definitions(paths: list, macros: dict, include_dirs: list, compiler='gcc'):
+    """
+    Preprocesses the last header (which includes the others) with the compiler, keeping the definitions of macros
+    (-E -dD), and extracts the object like macros and the enums of the headers in paths, might raise ValueError
+    :param paths: list of paths of the headers whose definitions are extracted, the last one is preprocessed
+    :param macros: dictionary of macros to define before the headers
+    :param include_dirs: list of include directories
+    :param compiler: path/name of the compiler
+    :return: dictionary of the unparsed macros (the macros passed first) and dictionary of the enums
+    :rtype: tuple(dict, dict)
+    """
+    with stats.stage('preprocess'):
+        result = run_compiler([compiler, '-E', '-dD', '-w', '-x', 'c'] + compiler_flags(macros, include_dirs) +
+                              [paths[-1]])
+    if result.returncode != 0:
+        raise ValueError(f'{compiler} failed to preprocess {paths[-1]}:\n{result.stderr.strip()}')
+    kept_paths = {os.path.realpath(path) for path in paths}
+    found_macros = dict(macros)
+    code = []
+    kept = False
+    with stats.stage('parse definitions'):
+        for line in result.stdout.splitlines():
+            if not line.startswith('#'):
+                if kept:
+                    code.append(line)
+                continue
+            marker = LINE_MARKER_REGEX.match(line)
+            if marker is not None:
+                path = marker.group(2).replace('\\"', '"').replace('\\\\', '\\')
+                kept = not path.startswith('<') and os.path.realpath(path) in kept_paths
+                continue
+            if not kept:
+                continue
+            define = DEFINE_REGEX.match(line)
+            if define is not None:
+                if define.group(2) is None:  # function like macros are not transposed
+                    found_macros[define.group(1)] = define.group(3).strip()
+                continue
+            undef = UNDEF_REGEX.match(line)
+            if undef is not None:
+                found_macros.pop(undef.group(1), None)
+        # the code is already preprocessed, so only the enums are left to extract
+        parser = FastParser()
+        parser.parse_lines(code)
+    stats.count('headers parsed', len(kept_paths))
+    return found_macros, parser.defs['enums']
+
+
+def read_probe_values(assembly: str):
+    """
+    Reads the values materialised by the probe from the compiled assembly
+    :param assembly: assembly listing of the compiled probe
+    :return: dictionary where [index] = integer value, of the candidates whose value is an integer constant
+    :rtype: dict
+    """
+    contents = {}
+    addresses = set()
+    current = None
+    for line in assembly.splitlines():
+        label = PROBE_LABEL_REGEX.match(line)
+        if label is not None:
+            current = int(label.group(1))
+            contents[current] = bytearray()
+            continue
+        if current is None:
+            continue
+        data = DATA_REGEX.match(line)
+        if data is not None:
+            directive, operand = data.groups()
+            try:
+                number = int(operand, 0)
+            except ValueError:  # an address (i.e of a string literal), not an integer
+                addresses.add(current)
+                continue
+            if directive in DATA_SIZES:
+                size = DATA_SIZES[directive]
+                contents[current] += (number % (1 << (8 * size))).to_bytes(size, 'little')
+            else:
+                contents[current] += bytes(number)
+        elif LABEL_REGEX.match(line) or line.lstrip().startswith(('.section', '.text', '.data', '.bss')):
+            current = None
+    values = {}
+    for index, content in contents.items():
+        if index in addresses or len(content) != 24:
+            continue
+        value, negative, integral = (int.from_bytes(content[i:i + 8], 'little') for i in (0, 8, 16))
+        if integral == 1:
+            values[index] = value - (1 << 64) if negative else value
+    return values
+
+
+def probe_values(header: str, names: list, macros: dict, include_dirs: list, compiler='gcc'):
+    """
+    Evaluates macros and enumerators with the compiler: a probe including header materialises the value of each of
+    them into a constant, the probe is compiled to assembly, and the constants are read back from it. names the
+    compiler rejects are removed and the probe is compiled again, so it is usually compiled once or twice
+    :param header: path of the header defining names
+    :param names: list of names of macros and enumerators
+    :param macros: dictionary of macros to define before the header
+    :param include_dirs: list of include directories
+    :param compiler: path/name of the compiler
+    :return: dictionary where [name] = integer value, of the names whose value is an integer constant
+    :rtype: dict
+    """
+    flags = ['-S', '-w', '-x', 'c'] + compiler_flags(macros, include_dirs)
+    if 'clang' in os.path.basename(compiler):
+        flags.append('-ferror-limit=0')  # clang stops after 20 errors by default, gcc reports them all
+    candidates = list(names)
+    with tempfile.TemporaryDirectory() as directory:
+        probe_path = os.path.join(directory, 'probe.c')
+        assembly_path = os.path.join(directory, 'probe.s')
+        for _ in range(MAX_PROBE_COMPILES):
+            if not candidates:
+                return {}
+            with open(probe_path, 'w') as writer:
+                writer.write(f'#include "{os.path.abspath(header)}"\n{PROBE_STRUCT}\n')
+                for index, name in enumerate(candidates):
+                    writer.write(PROBE_LINE.format(index=index, name=name) + '\n')
+            with stats.stage('probe compile'):
+                result = run_compiler([compiler] + flags + [probe_path, '-o', assembly_path])
+            stats.count('probe compiles')
+            if result.returncode == 0:
+                with open(assembly_path, 'r') as reader:
+                    values = read_probe_values(reader.read())
+                return {candidates[index]: value for index, value in values.items() if index < len(candidates)}
+            # the errors (and the notes of errors in macro expansions) point at the lines of the rejected candidates,
+            # the candidates start on the third line
+            rejected = {int(line) - 3 for line in re.findall(rf'^{re.escape(probe_path)}:(\d+):', result.stderr,
+                                                             re.MULTILINE)}
+            rejected &= set(range(len(candidates)))
+            if not rejected:
+                raise ValueError(f'{compiler} failed to compile {header}:\n{result.stderr.strip()}')
+            candidates = [name for index, name in enumerate(candidates) if index not in rejected]
+    raise ValueError(f'{compiler} rejected the values of too many macros of {header}')
+
+
+def compiler_definitions(paths: list, macros: dict, include_dirs: list, compiler='gcc'):
+    """
+    Extracts the macros and the enums of headers with the compiler, and evaluates their values with it (see
+    preprocess_definitions and probe_values). macros the compiler can't evaluate as integers keep their unparsed
+    value, so they can still be evaluated by the arithmetic backend
+    :param paths: list of paths of headers, the last one includes the others
+    :param macros: dictionary of macros to define before the headers
+    :param include_dirs: list of include directories
+    :param compiler: path/name of the compiler
+    :return: dictionary of the macros (parsed in place where possible) and dictionary of the enums
+    :rtype: tuple(dict, dict)
+    """
+    found_macros, enums = preprocess_definitions(paths, macros, include_dirs, compiler)
+    names = [name for name, value in found_macros.items() if value and not UNPROBED_REGEX.search(value)]
+    names += [enumee for enum in enums.values() for enumee in enum]
+    stats.count('values probed', len(names))
+    values = probe_values(paths[-1], names, macros, include_dirs, compiler)
+    for name in found_macros:
+        if name in values:
+            found_macros[name] = values[name]
+    for enum in enums.values():
+        for enumee in enum:
+            if enumee in values:
+                enum[enumee] = values[enumee]
+    return found_macros, enums
@@ -1,4 +1,8 @@
 from .macro_creator import CDefinition, MacroCreator
+from . import stats
+
+# the front ends name the anonymous enums anon_enum0, anon_enum1...
+ANONYMOUS_ENUM_PREFIX = 'anon_enum'
 
 
 class Enumee(CDefinition):
@@ -6,20 +10,55 @@ class Enumee(CDefinition):
     class holding name and values extracted from specific enum
     values are used to try resolve multiple enumees with the same value
     """
-    pass
+    __slots__ = ()
 
 
-def create_enum_macros(enums: dict):
+def iter_enum_groups(enums: dict, group_prefix=''):
     """
-    finds all enums declared in code text, merges enumees with same value and creates a macro for each
     :param enums: dictionary where enums[enum_name] is dictionary of enumees
-    :return: list of resulting macros
-    :rtype: list
+    :param group_prefix: prefix of the names of the anonymous enums (anon_enum0 -> PREFIX_ANON_ENUM0), which are named
+                         the same in every header otherwise (see header_group_prefix)
+    :return: generator of a MacroCreator for each enum
     """
-    macros = []
+    stats.count('enums', len(enums))
     for enum in enums:
         enumee_list = [Enumee(enumee.upper(), enums[enum][enumee]) for enumee in enums[enum]]
-        current_enum = MacroCreator(enum.upper(), enumee_list)
-        macros.append(current_enum.create_macro())
+        name = f'{group_prefix}_{enum}' if group_prefix and enum.startswith(ANONYMOUS_ENUM_PREFIX) else enum
+        yield MacroCreator(name.upper(), enumee_list)
+
+
+def iter_enum_macros(enums: dict, style='switch', from_str=False, source=None, group_prefix=''):
+    """
+    finds all enums declared in code text, merges enumees with same value and creates a macro for each, and a flags
+    macro for enums of bit flags. the macros are created one at a time, as they are consumed
+    :param enums: dictionary where enums[enum_name] is dictionary of enumees
+    :param style: style of the created parsers (see OUTPUT_STYLES)
+    :param from_str: if True, also create a NAME_FROM_STR function for each enum (see MacroCreator.create_from_str)
+    :param source: SourceFile the functions style defines the functions in, None to define them static inline
+    :param group_prefix: prefix of the names of the anonymous enums (see iter_enum_groups)
+    :return: generator of the resulting macros
+    """
+    for current_enum in iter_enum_groups(enums, group_prefix):
+        with stats.stage('create enum parsers'):
+            macro = current_enum.create_macro(style, source)
+            extra_macros = [current_enum.create_flags_macro(style, source),
+                            current_enum.create_from_str(source) if from_str else '']
+        extra_macros = [extra_macro for extra_macro in extra_macros if extra_macro]
+        stats.count('parsers generated', 1 + len(extra_macros))
+        yield macro
+        yield from extra_macros
+
 
-    return macros
+def create_enum_macros(enums: dict, style='switch', from_str=False, source=None, group_prefix=''):
+    """
+    finds all enums declared in code text, merges enumees with same value and creates a macro for each, and a flags
+    macro for enums of bit flags
+    :param enums: dictionary where enums[enum_name] is dictionary of enumees
+    :param style: style of the created parsers (see OUTPUT_STYLES)
+    :param from_str: if True, also create a NAME_FROM_STR function for each enum (see MacroCreator.create_from_str)
+    :param source: SourceFile the functions style defines the functions in, None to define them static inline
+    :param group_prefix: prefix of the names of the anonymous enums (see iter_enum_groups)
+    :return: list of resulting macros
+    :rtype: list
+    """
+    return list(iter_enum_macros(enums, style, from_str, source, group_prefix))
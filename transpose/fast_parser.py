@@ -0,0 +1,473 @@
+import os
+import re
+from .arithmatic_parser import MacrosArithmeticParser
+from .macros_resolver import TOKEN_REGEX
+
+FRONTENDS = ('pyclibrary', 'fast', 'compiler')
+
+DIRECTIVE_REGEX = re.compile(r'\s*#\s*([a-zA-Z]*)(.*)$')
+DEFINE_REGEX = re.compile(r'\s*([A-Za-z_]\w*)(?:\(([^)]*)\))?(.*)$')
+DEFINED_REGEX = re.compile(r'\bdefined\s*(?:\(\s*([A-Za-z_]\w*)\s*\)|([A-Za-z_]\w*))')
+IDENTIFIER_REGEX = re.compile(r'[A-Za-z_]\w*')
+# string and char literals are matched first, so comment markers and braces inside them are ignored
+COMMENT_REGEX = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|(/\*|//)')
+ENUM_REGEX = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|\b(enum)\b')
+BRACE_REGEX = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|([{}])')
+SEPARATOR_REGEX = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|([(),])')
+NEXT_TOKEN_REGEX = re.compile(r'\s*(?:([A-Za-z_]\w*)|(\S))')
+CALL_REGEX = re.compile(r'\s*\(')
+
+
+def create_parser(paths: list, macros: dict, frontend='pyclibrary'):
+    """
+    Creates the parser the definitions of headers are extracted with. the headers are only loaded, they are parsed
+    by process_header (or process_all)
+    :param paths: list of paths of headers
+    :param macros: dictionary of macros to define before parsing the headers
+    :param frontend: pyclibrary parses all the declarations, fast only extracts macros and enums (the compiler front
+                     end preprocesses all the headers at once, see compiler_definitions)
+    :return: parser with the CParser attributes and methods transpose uses
+    :rtype: CParser or FastParser
+    """
+    if frontend == 'fast':
+        return FastParser(paths, macros)
+    if frontend == 'pyclibrary':
+        from pyclibrary import CParser
+        return CParser(paths, macros=macros, process_all=False)
+    raise ValueError(f'front end {frontend} does not parse headers one by one, expected pyclibrary or fast')
+
+
+def split_top_level(text: str):
+    """
+    :param text: text of macro arguments or enumerators
+    :return: list of the parts of text separated by commas that are not inside parentheses or literals
+    :rtype: list
+    """
+    parts = []
+    depth = 0
+    start = 0
+    for match in SEPARATOR_REGEX.finditer(text):
+        separator = match.group(1)
+        if separator == '(':
+            depth += 1
+        elif separator == ')':
+            depth -= 1
+        elif separator == ',' and depth == 0:
+            parts.append(text[start:match.start()])
+            start = match.end()
+    parts.append(text[start:])
+    return parts
+
+
+def strip_comments(line: str, in_comment: bool):
+    """
+    Replaces the comments of a line by spaces
+    :param line: line of code
+    :param in_comment: True if the line starts inside a block comment
+    :return: the line without comments, and whether it ends inside a block comment
+    :rtype: tuple(str, bool)
+    """
+    if '/' not in line and not in_comment:
+        return line, False
+    parts = []
+    position = 0
+    while position < len(line):
+        if in_comment:
+            end = line.find('*/', position)
+            if end < 0:
+                break
+            parts.append(' ')
+            position = end + 2
+            in_comment = False
+            continue
+        for match in COMMENT_REGEX.finditer(line, position):
+            if match.group(1) == '/*':
+                parts.append(line[position:match.start()])
+                position = match.end()
+                in_comment = True
+                break
+            if match.group(1) == '//':
+                parts.append(line[position:match.start()])
+                return ''.join(parts), False
+        else:
+            parts.append(line[position:])
+            break
+    return ''.join(parts), in_comment
+
+
+def logical_lines(lines):
+    """
+    Joins lines continued by a backslash and removes comments, a block comment spanning lines joins them as well
+    :param lines: iterable of the lines of a file
+    :return: generator of the logical lines
+    """
+    continued = ''
+    pending = ''
+    in_comment = False
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line.endswith('\\'):
+            continued += line[:-1]
+            continue
+        text, in_comment = strip_comments(continued + line, in_comment)
+        continued = ''
+        pending += text
+        if not in_comment:
+            yield pending
+            pending = ''
+    if continued or pending:
+        yield pending + strip_comments(continued, in_comment)[0]
+
+
+class FastParser:
+    """
+    Class extracting only the macros and the enums of headers, instead of parsing all their declarations as CParser
+    does. files are read line by line: conditional directives are evaluated with the macros defined so far, #define
+    and #undef are applied, and of the code only enum bodies are kept (every other declaration is skipped).
+    the definitions are kept in the CParser defs and file_defs format, so both parsers can be used (and cached) alike
+    """
+    def __init__(self, paths=(), macros=None):
+        """
+        Creates a FastParser object, and loads the headers in paths, might raise OSError
+        :param paths: list of paths of headers, parsed by process_all
+        :param macros: dictionary of macros to define before parsing the headers
+        """
+        self.data_list = ['types', 'variables', 'fnmacros', 'macros', 'structs', 'unions', 'enums', 'functions',
+                          'values']
+        self.defs = {kind: {} for kind in self.data_list}
+        self.file_defs = {}
+        self.file_order = []
+        self.current_file = None
+        # evaluates conditional directives and enumerators, the values of the enumerators are its variables
+        self._arithmetic_parser = MacrosArithmeticParser()
+        for path in paths:
+            if not os.path.isfile(path):
+                raise OSError(f'Cannot find header: {path}')
+        for name, value in (macros or {}).items():
+            self.add_def('macros', name, value)
+        for path in paths:
+            self.load_file(path)
+
+    def add_def(self, kind: str, name: str, value):
+        """
+        Adds a definition to the definitions of the current file and to all the definitions
+        """
+        self.defs[kind][name] = value
+        base_name = os.path.basename(self.current_file) if self.current_file is not None else None
+        if base_name not in self.file_defs:
+            self.file_defs[base_name] = {kind: {} for kind in self.data_list}
+        self.file_defs[base_name][kind][name] = value
+        if kind == 'values':
+            self._arithmetic_parser.add_variables({name: value})
+
+    def rem_def(self, kind: str, name: str):
+        """
+        Removes a definition, if it exists
+        """
+        self.defs[kind].pop(name, None)
+        base_name = os.path.basename(self.current_file) if self.current_file is not None else None
+        if base_name in self.file_defs:
+            self.file_defs[base_name][kind].pop(name, None)
+
+    def import_dict(self, data: dict):
+        """
+        Imports definitions of headers parsed before
+        :param data: definitions, in the file_defs format
+        """
+        for path, file_defs in data.items():
+            self.current_file = path
+            for kind in self.data_list:
+                for name, value in file_defs.get(kind, {}).items():
+                    self.add_def(kind, name, value)
+
+    def load_file(self, path: str):
+        """
+        Adds a header to the headers parsed by process_all
+        :param path: path of the header
+        :return: False if the header does not exist
+        :rtype: bool
+        """
+        if not os.path.isfile(path):
+            return False
+        self.file_order.append(path)
+        return True
+
+    def remove_comments(self, path: str):
+        """
+        Comments are removed while the header is preprocessed, so nothing is done here
+        """
+        pass
+
+    def preprocess(self, path: str):
+        """
+        Reads the header line by line, applying the directives and extracting the enums (in a single pass)
+        :param path: path of the header
+        """
+        self.current_file = path
+        with open(path, 'r', errors='replace') as reader:
+            self.parse_lines(reader)
+
+    def parse_lines(self, lines):
+        """
+        Applies the directives and extracts the enums of code, as the lines of the current file
+        :param lines: iterable of lines of code
+        """
+        self._conditions = []
+        self._active = True
+        self._enum_state = None
+        self._enum_tag = None
+        self._enum_body = []
+        self._enum_depth = 0
+        for line in logical_lines(lines):
+            match = DIRECTIVE_REGEX.match(line)
+            if match is not None:
+                self._directive(match.group(1), match.group(2))
+            elif self._active:
+                self._scan_code(line)
+
+    def parse_defs(self, path: str):
+        """
+        The enums are extracted while the header is preprocessed, so nothing is done here
+        :return: empty list, as there are no parsed declarations
+        """
+        return []
+
+    def process_all(self):
+        """
+        Parses all the loaded headers
+        """
+        for path in self.file_order:
+            self.remove_comments(path)
+            self.preprocess(path)
+            self.parse_defs(path)
+
+    def _directive(self, directive: str, rest: str):
+        """
+        Applies a preprocessor directive, directives other than conditionals, #define and #undef are ignored
+        """
+        if directive in ('if', 'ifdef', 'ifndef'):
+            if not self._active:
+                # [active, a branch was taken], no branch of a conditional inside a skipped block is taken
+                self._conditions.append([False, True])
+                return
+            if directive == 'ifdef':
+                active = self._is_defined(rest.strip())
+            elif directive == 'ifndef':
+                active = not self._is_defined(rest.strip())
+            else:
+                active = self._condition(rest)
+            self._conditions.append([active, active])
+        elif directive == 'elif' and self._conditions:
+            condition = self._conditions[-1]
+            condition[0] = not condition[1] and self._condition(rest)
+            condition[1] = condition[1] or condition[0]
+        elif directive == 'else' and self._conditions:
+            condition = self._conditions[-1]
+            condition[0], condition[1] = not condition[1], True
+        elif directive == 'endif' and self._conditions:
+            self._conditions.pop()
+        elif not self._active:
+            return
+        elif directive == 'define':
+            self._define(rest)
+        elif directive == 'undef':
+            name = rest.strip()
+            self.rem_def('macros', name)
+            self.rem_def('fnmacros', name)
+        self._active = not self._conditions or self._conditions[-1][0]
+
+    def _is_defined(self, name: str):
+        return name in self.defs['macros'] or name in self.defs['fnmacros']
+
+    def _condition(self, expression: str):
+        """
+        :param expression: expression of #if or #elif
+        :return: the value of the expression, False if it can't be evaluated
+        :rtype: bool
+        """
+        expression = DEFINED_REGEX.sub(lambda match: '1' if self._is_defined(match.group(1) or match.group(2)) else '0',
+                                       expression)
+        # identifiers left after the expansion are not macros, and are replaced by 0 as the C preprocessor does
+        expression = TOKEN_REGEX.sub(lambda match: '0' if match.group(1) else match.group(0), self.expand(expression))
+        try:
+            return bool(self._arithmetic_parser.parse(expression).evaluate())
+        except Exception:
+            return False
+
+    def _define(self, rest: str):
+        """
+        Registers a macro, its value is stored with the macros it refers to expanded, as CParser does
+        """
+        match = DEFINE_REGEX.match(rest)
+        if match is None:
+            return
+        name, parameters, value = match.groups()
+        if parameters is None:
+            value = self.expand(value.strip(), {name})
+            if value in self.defs['fnmacros']:  # an alias of a function like macro
+                self.add_def('fnmacros', name, self.defs['fnmacros'][value])
+            else:
+                self.add_def('macros', name, value)
+            return
+        parameters = [parameter.strip() for parameter in parameters.split(',') if parameter.strip()]
+        value = self.expand(value.strip(), {name, *parameters})
+        # the parameters are replaced by {}, and their indices listed in order, as in CParser's fnmacros
+        parts = []
+        indices = []
+        position = 0
+        for match in TOKEN_REGEX.finditer(value):
+            if match.group(1) in parameters:
+                parts.append(value[position:match.start()] + '{}')
+                indices.append(parameters.index(match.group(1)))
+                position = match.end()
+        parts.append(value[position:])
+        self.add_def('fnmacros', name, (''.join(parts), indices))
+
+    def expand(self, text: str, hidden=frozenset()):
+        """
+        Expands the macros text refers to, the expansions are expanded again, except for the macros in hidden
+        :param text: code
+        :param hidden: names of the macros being expanded, which are not expanded again
+        :return: the expanded text
+        :rtype: str
+        """
+        macros = self.defs['macros']
+        fnmacros = self.defs['fnmacros']
+        parts = []
+        position = 0
+        for match in TOKEN_REGEX.finditer(text):
+            name = match.group(1)
+            if name is None or name in hidden or match.start() < position:
+                continue
+            if name in macros:
+                parts.append(text[position:match.start()])
+                parts.append(self.expand(macros[name], hidden | {name}))
+                position = match.end()
+            elif name in fnmacros:
+                call = self._call_arguments(text, match.end())
+                if call is None:
+                    continue
+                arguments, end = call
+                template, indices = fnmacros[name]
+                pieces = template.split('{}')
+                if len(pieces) != len(indices) + 1 or any(index >= len(arguments) for index in indices):
+                    continue
+                arguments = [self.expand(argument.strip(), hidden) for argument in arguments]
+                body = pieces[0] + ''.join(arguments[index] + piece for index, piece in zip(indices, pieces[1:]))
+                parts.append(text[position:match.start()])
+                parts.append(self.expand(body, hidden | {name}))
+                position = end
+        parts.append(text[position:])
+        return ''.join(parts)
+
+    @staticmethod
+    def _call_arguments(text: str, position: int):
+        """
+        :param text: code
+        :param position: position after the name of a function like macro
+        :return: the arguments of the call at position and the position after it, None if there is no call
+        :rtype: tuple(list, int)
+        """
+        opening = CALL_REGEX.match(text, position)
+        if opening is None:
+            return None
+        depth = 1
+        for match in SEPARATOR_REGEX.finditer(text, opening.end()):
+            if match.group(1) == '(':
+                depth += 1
+            elif match.group(1) == ')':
+                depth -= 1
+                if depth == 0:
+                    return split_top_level(text[opening.end():match.start()]), match.end()
+        return None
+
+    def _scan_code(self, line: str):
+        """
+        Finds the enums in a line of code, enums may span lines, so the state of the enum being read is kept between
+        lines: None while looking for the enum keyword, 'tag' after it, 'open' after the tag, and 'body' until the
+        closing brace
+        """
+        position = 0
+        while position < len(line):
+            if self._enum_state is None:
+                if 'enum' not in line:
+                    return
+                for match in ENUM_REGEX.finditer(line, position):
+                    if match.group(1):
+                        self._enum_state = 'tag'
+                        position = match.end()
+                        break
+                else:
+                    return
+            elif self._enum_state == 'body':
+                position = self._scan_body(line, position)
+            else:
+                match = NEXT_TOKEN_REGEX.match(line, position)
+                if match is None:  # the rest of the line is blank
+                    return
+                identifier, symbol = match.groups()
+                if symbol == '{':
+                    self._enum_state, self._enum_body, self._enum_depth = 'body', [], 1
+                    position = match.end()
+                elif self._enum_state == 'tag' and identifier is not None:
+                    self._enum_state, self._enum_tag = 'open', identifier
+                    position = match.end()
+                else:
+                    # a declaration using the enum (or a forward declaration), registered without enumees, as CParser
+                    # does. the token is scanned again, it may be another enum keyword
+                    if self._enum_state == 'open' and self._enum_tag not in self.defs['enums']:
+                        self.add_def('enums', self._enum_tag, {})
+                    self._enum_state, self._enum_tag = None, None
+                    position = match.start(1) if identifier is not None else match.start(2)
+
+    def _scan_body(self, line: str, position: int):
+        """
+        Collects the body of an enum until its closing brace
+        :return: position after the body, or the end of the line if the body continues
+        :rtype: int
+        """
+        for match in BRACE_REGEX.finditer(line, position):
+            if match.group(1) == '{':
+                self._enum_depth += 1
+            elif match.group(1) == '}':
+                self._enum_depth -= 1
+                if self._enum_depth == 0:
+                    self._enum_body.append(line[position:match.start()])
+                    self._add_enum(self._enum_tag, '\n'.join(self._enum_body))
+                    self._enum_state, self._enum_tag, self._enum_body = None, None, []
+                    return match.end()
+        self._enum_body.append(line[position:])
+        return len(line)
+
+    def _add_enum(self, tag, body: str):
+        """
+        Evaluates the enumerators of an enum and registers it. an enumerator whose value can't be evaluated keeps the
+        running value, as in CParser
+        :param tag: name of the enum, None for anonymous enums, which are named anon_enum0, anon_enum1...
+        :param body: text between the braces of the enum
+        """
+        if tag is None:
+            number = 0
+            while f'anon_enum{number}' in self.defs['enums']:
+                number += 1
+            tag = f'anon_enum{number}'
+        elif self.defs['enums'].get(tag):  # the first definition is kept
+            return
+        enum = {}
+        value = 0
+        for enumerator in split_top_level(self.expand(body)):
+            name, _, expression = enumerator.partition('=')
+            name = name.strip()
+            if not IDENTIFIER_REGEX.fullmatch(name):
+                continue
+            if expression.strip():
+                try:
+                    result = self._arithmetic_parser.parse(expression.strip()).evaluate()
+                    if isinstance(result, int):
+                        value = result
+                except Exception:
+                    pass
+            enum[name] = value
+            self.add_def('values', name, value)
+            value += 1
+        self.add_def('enums', tag, enum)
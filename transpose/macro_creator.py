@@ -2,9 +2,132 @@ from dataclasses import dataclass
 from os.path import commonprefix
 from typing import Any
 
+# functions moves the parsers out of line: the generated header declares them, and a source file next to it (out.h ->
+# out.c) defines them once, instead of expanding a switch at every call site
+OUTPUT_STYLES = ('switch', 'lookup', 'functions')
+# formats of the generated file: a C header of parsers, a python module or a json file of lookup tables
+OUTPUT_FORMATS = ('c', 'python', 'json')
+# lookup parsers use a dense table when at least this fraction of the values in range are used
+DENSE_TABLE_MIN_DENSITY = 0.5
+# and a sorted table with binary search when there are at least this many values, otherwise a switch
+SORTED_TABLE_MIN_VALUES = 8
+LLONG_MAX = 2 ** 63 - 1
+ULLONG_MAX = 2 ** 64 - 1
+# FNV-1a constants of the hash of the names, used by the NAME_FROM_STR functions
+FNV_OFFSET_BASIS = 0x811c9dc5
+FNV_PRIME = 0x01000193
+# a bucket of names that can't be placed with any seed up to this one fails the perfect hash
+MAX_HASH_SEED = 1 << 20
+# hash function shared by all the NAME_FROM_STR functions, defined once even if many generated headers are included
+NAME_HASH_FUNCTION = '''#ifndef TRANSPOSE_NAME_HASH
+#define TRANSPOSE_NAME_HASH
+static inline unsigned int transpose_name_hash(const char *name, unsigned long length, unsigned int seed)
+{
+    unsigned int hash = 0x811c9dc5u ^ seed;
+    unsigned long i;
+    for (i = 0; i < length; i++)
+        hash = (hash ^ (unsigned char)name[i]) * 0x01000193u;
+    return hash ^ (hash >> 16);
+}
+#endif'''
+# array of the strings returned by the functions of a source file, each stored once
+STRING_POOL_NAME = 'transpose_strings'
+
+
+def continue_lines(lines: list):
+    """
+    Ends all the lines of a multi line macro but the last with a line continuation
+    :param lines: list of the lines of the macro
+    :return: generator of the lines
+    """
+    last = len(lines) - 1
+    for i, line in enumerate(lines):
+        yield line + '\\' if i < last else line
+
+
+def quote(string: str):
+    """
+    :param string: a name
+    :return: C string literal of the name
+    :rtype: str
+    """
+    return f'"{string}"'
+
+
+def function_lines(signature: str, body: list, source=None):
+    """
+    Defines a function static inline in the generated header, or declares it in the header and defines it in source
+    :param signature: signature of the function
+    :param body: list of the lines of the function's body
+    :param source: SourceFile to define the function in, None to define it in the header
+    :return: list of the lines of the header defining or declaring the function
+    :rtype: list
+    """
+    if source is None:
+        return [f'static inline {signature}', '{'] + body + ['}']
+    source.add_function(signature, body)
+    return [signature + ';']
+
+
+def name_hash(name: bytes, seed: int):
+    """
+    Hashes a name as transpose_name_hash does in the generated header (FNV-1a, with the high bits folded down)
+    :param name: the name, encoded
+    :param seed: seed of the hash, 0 for the first level of the perfect hash
+    :rtype: int
+    """
+    value = FNV_OFFSET_BASIS ^ seed
+    for byte in name:
+        value = ((value ^ byte) * FNV_PRIME) & 0xffffffff
+    return value ^ (value >> 16)
+
+
+def perfect_hash(names: list):
+    """
+    Creates a minimal perfect hash of names (hash and displace): the names are split to buckets by their unseeded
+    hash, and the buckets are placed from the largest, each with the first seed placing all of its names in free
+    slots. names alone in their buckets are placed in the free slots left, without hashing again. might raise
+    ValueError if a bucket can't be placed
+    :param names: list of unique names, encoded
+    :return: list of seeds, where a name in bucket b is in slot name_hash(name, seeds[b]) % len(names) if
+             seeds[b] > 0, or in slot -seeds[b] - 1 otherwise, and list where [slot] = index of the name in names
+    :rtype: tuple(list, list)
+    """
+    size = len(names)
+    buckets = [[] for _ in range(size)]
+    for index, name in enumerate(names):
+        buckets[name_hash(name, 0) % size].append(index)
+    seeds = [-1] * size  # the names of empty buckets are unknown, they are compared to the first slot
+    slots = [None] * size
+    order = sorted(range(size), key=lambda bucket: len(buckets[bucket]), reverse=True)
+    placed = 0
+    for bucket in order:
+        indices = buckets[bucket]
+        if len(indices) <= 1:
+            break
+        for seed in range(1, MAX_HASH_SEED):
+            chosen = {name_hash(names[index], seed) % size for index in indices}
+            if len(chosen) == len(indices) and all(slots[slot] is None for slot in chosen):
+                break
+        else:
+            raise ValueError(f'could not create a perfect hash of {len(names)} names')
+        seeds[bucket] = seed
+        for index in indices:
+            slots[name_hash(names[index], seed) % size] = index
+        placed += 1
+    free = [slot for slot in range(size) if slots[slot] is None]
+    for bucket in order[placed:]:
+        if buckets[bucket]:
+            slot = free.pop()
+            seeds[bucket] = -slot - 1
+            slots[slot] = buckets[bucket][0]
+    return seeds, slots
+
 
 @dataclass
 class CDefinition:
+    # headers can have hundreds of thousands of definitions, so they are kept without a per instance __dict__
+    __slots__ = ('name', 'value')
     name: str
     value: Any
 
@@ -15,8 +138,69 @@ class CDefinition:
         :return: True iff self and other have the same value
         :rtype: bool
         """
-        if self.value == other.value:
-            return True
+        if not isinstance(other, CDefinition):
+            return NotImplemented
+        return self.value == other.value
+
+    def __hash__(self):
+        """
+        hashes a CDef by value (as it is compared), so CDefs can be grouped by value in sets and dictionaries
+        :rtype: int
+        """
+        return hash(self.value)
+
+
+class SourceFile:
+    """
+    class holding the source file of the functions style: the definitions of the functions declared in the generated
+    header, and a pool of the strings they return, shared by all the parsers, where each string is stored once
+    """
+    def __init__(self, header_name: str):
+        """
+        :param header_name: name of the generated header, included by the source file
+        """
+        self.header_name = header_name
+        # [string] = offset of the string in the pool
+        self.offsets = {}
+        self.pool_size = 0
+        self.functions = []
+        # whether a function uses transpose_name_hash, which is then defined before the functions
+        self.uses_hash = False
+
+    def string(self, string: str):
+        """
+        Adds a string to the pool, unless it is already there
+        :param string: a name
+        :return: C expression of a pointer to the string in the pool
+        :rtype: str
+        """
+        offset = self.offsets.get(string)
+        if offset is None:
+            offset = self.offsets[string] = self.pool_size
+            self.pool_size += len(string) + 1
+        return f'{STRING_POOL_NAME} + {offset} /* {string} */'
+
+    def add_function(self, signature: str, body: list):
+        """
+        :param signature: signature of the function, as declared in the generated header
+        :param body: list of the lines of the function's body
+        """
+        self.functions.append('\n'.join([signature, '{'] + body + ['}']))
+
+    def iter_source(self):
+        """
+        Creates the source file piece by piece
+        :return: generator of the parts of the source file
+        """
+        yield f'#include "{self.header_name}"\n\n\n'
+        if self.uses_hash:
+            yield NAME_HASH_FUNCTION + '\n\n\n'
+        if self.offsets:
+            strings = ''.join(f'\n    "{string}\\0"' for string in self.offsets)
+            yield f'static const char {STRING_POOL_NAME}[{self.pool_size + 1}] ={strings};\n\n\n'
+        for i, function in enumerate(self.functions):
+            yield '\n\n\n' + function if i else function
+        yield '\n'
 
 
 class MacroCreator:
@@ -37,10 +221,7 @@ class MacroCreator:
         reverse_cdefs = {}
         result = {}
         for cdef in self.cdefs:
-            if cdef.value in reverse_cdefs.keys():
-                reverse_cdefs[cdef.value].append(cdef)
-            else:
-                reverse_cdefs[cdef.value] = [cdef, ]
+            reverse_cdefs.setdefault(cdef.value, []).append(cdef)
         for value in reverse_cdefs:
             if len(reverse_cdefs[value]) > 1:
                 names = [cdef.name.upper() for cdef in reverse_cdefs[value]]
@@ -56,33 +237,276 @@ class MacroCreator:
                 result[cdef.name] = cdef
         return result
 
-    def create_macro(self):
+    def create_macro(self, style='switch', source=None):
         """
         creates 2 C macros:
             self.name_MAX_LEN - holding the max length of the names returned
             self.name_PARSER  - macro receiving a value and a buffer, that copies the name of the value to the buffer
+        :param style: one of OUTPUT_STYLES, 'lookup' also creates the self.name_TO_STR function (see create_lookup),
+                      'functions' defines it in source
+        :param source: SourceFile of the functions style, None to define the functions static inline
         :return: string defining the macros
         :rtype: str
         """
+        if style in ('lookup', 'functions'):
+            return self.create_lookup(source=source if style == 'functions' else None)
         merged = self._merge_cdefs()
         if merged is None or len(merged) == 0:
             return ""
         max_length = max([len(name) + 1 for name in merged.keys()])
         max_length = max(max_length, len('Unknown') + 1)
-        max_length_macro = f"#define {self.name.upper()}_MAX_LEN {max_length}"
-        macro = f"""#define {self.name.upper()}_PARSER(n, buf) do {{
-    switch(n) {{"""
+        lines = [f'#define {self.name.upper()}_PARSER(n, buf) do {{',
+                 '    switch(n) {']
         for name in merged:
-            macro += f"""
-    case {merged[name].name}:
-            strcpy(buf, \"{name}\");
-            break;"""
-        macro += """
-    default:
-            strcpy(buf, \"Unknown\");
-            break;
-    }
-} while (0);"""
-        final_macro = '\n'.join([line + '\\' for line in macro.splitlines()[:-1]])
-        final_macro += '\n' + macro.splitlines()[-1]
-        return max_length_macro + '\n' + final_macro
+            lines += [f'    case {merged[name].name}:',
+                      f'            strcpy(buf, "{name}");',
+                      '            break;']
+        lines += ['    default:',
+                  '            strcpy(buf, "Unknown");',
+                  '            break;',
+                  '    }',
+                  '} while (0);']
+        return f'#define {self.name.upper()}_MAX_LEN {max_length}\n' + '\n'.join(continue_lines(lines))
+
+    def create_table(self):
+        """
+        creates the table mapping values to names, as the macros created by create_macro do
+        :return: dictionary where [value] = name, empty if there are no definitions
+        :rtype: dict
+        """
+        return {cdef.value: string for string, cdef in self._merge_cdefs().items()}
+
+    @staticmethod
+    def lookup_strategy(values: list):
+        """
+        Chooses how a lookup function finds the name of a value
+        :param values: list of the (unique) values
+        :return: 'dense' for a table indexed by value - min, 'sorted' for binary search in a sorted table of values,
+                 or 'switch'
+        :rtype: str
+        """
+        if not all(isinstance(value, int) for value in values):
+            return 'switch'
+        if min(values, default=0) < 0 and max(values, default=0) > LLONG_MAX:
+            # no C type holds both, the values wrapped to long long would not be sorted anymore
+            return 'switch'
+        if len(values) >= 2 and len(values) / (max(values) - min(values) + 1) >= DENSE_TABLE_MIN_DENSITY:
+            return 'dense'
+        if len(values) >= SORTED_TABLE_MIN_VALUES:
+            return 'sorted'
+        return 'switch'
+
+    def create_lookup(self, strategy=None, source=None):
+        """
+        creates 3 C definitions:
+            self.name_MAX_LEN - holding the max length of the names returned
+            self.name_TO_STR  - static inline function receiving a value and returning a pointer to its name
+            self.name_PARSER  - macro receiving a value and a buffer, that copies the name of the value to the buffer
+        :param strategy: 'dense', 'sorted' or 'switch', chosen by the density of the values by default
+        :param source: SourceFile to define self.name_TO_STR in (returning strings of its pool), None to define it
+                       static inline
+        :return: string defining the macros and the function (or declaring the function)
+        :rtype: str
+        """
+        merged = self._merge_cdefs()
+        if merged is None or len(merged) == 0:
+            return ""
+        name = self.name.upper()
+        entries = sorted(merged.items(), key=lambda entry: entry[1].value) \
+            if all(isinstance(cdef.value, int) for cdef in merged.values()) else list(merged.items())
+        if strategy is None:
+            strategy = self.lookup_strategy([cdef.value for _, cdef in entries])
+        max_length = max([len(string) + 1 for string in merged.keys()])
+        max_length = max(max_length, len('Unknown') + 1)
+        value_type = 'long long'
+        if strategy != 'switch' and entries[0][1].value >= 0 and entries[-1][1].value > LLONG_MAX:
+            value_type = 'unsigned long long'
+        text = quote if source is None else source.string
+
+        lines = []
+        if strategy == 'dense':
+            first, last = entries[0][1].name, entries[-1][1].name
+            lines.append(f'    static const char *const names[({last}) - ({first}) + 1] = {{')
+            lines += [f'        [({cdef.name}) - ({first})] = {text(string)},' for string, cdef in entries]
+            lines += ['    };',
+                      f'    if (n < ({first}) || n > ({last}) || !names[n - ({first})])',
+                      f'        return {text("Unknown")};',
+                      f'    return names[n - ({first})];']
+        elif strategy == 'sorted':
+            lines.append(f'    static const {value_type} values[{len(entries)}] = {{')
+            lines += [f'        {cdef.name},' for _, cdef in entries]
+            lines += ['    };',
+                      f'    static const char *const names[{len(entries)}] = {{']
+            lines += [f'        {text(string)},' for string, _ in entries]
+            lines += ['    };',
+                      '    unsigned long low = 0, high = sizeof(values) / sizeof(values[0]);',
+                      '    while (low < high) {',
+                      '        unsigned long middle = low + (high - low) / 2;',
+                      '        if (values[middle] < n)',
+                      '            low = middle + 1;',
+                      '        else',
+                      '            high = middle;',
+                      '    }',
+                      '    if (low < sizeof(values) / sizeof(values[0]) && values[low] == n)',
+                      '        return names[low];',
+                      f'    return {text("Unknown")};']
+        else:
+            lines.append('    switch(n) {')
+            for string, cdef in entries:
+                lines += [f'    case {cdef.name}:',
+                          f'            return {text(string)};']
+            lines += ['    default:',
+                      f'            return {text("Unknown")};',
+                      '    }']
+        lines = [f'#define {name}_MAX_LEN {max_length}'] + \
+            function_lines(f'const char *{name}_TO_STR({value_type} n)', lines, source)
+        lines += [f'#define {name}_PARSER(n, buf) do {{\\',
+                  f'    strcpy(buf, {name}_TO_STR(n));\\',
+                  '} while (0);']
+        return '\n'.join(lines)
+
+    def create_from_str(self, source=None):
+        """
+        creates the self.name_FROM_STR static inline function, receiving a null terminated name and a pointer to
+        a value, that stores the value of the name and returns 1, or returns 0 for unknown names. both the names of
+        the definitions and the merged names create_macro returns are found. the name is found by a minimal perfect
+        hash (see perfect_hash) and confirmed by memcmp, so a lookup is linear in the length of the name
+        :param source: SourceFile to define the function in (comparing with strings of its pool), None to define it
+                       static inline
+        :return: string defining the function (and the shared hash function) or declaring it, empty string if there
+                 are no definitions or their values are not all integers
+        :rtype: str
+        """
+        entries = {cdef.name: cdef for cdef in self.cdefs}
+        for string, cdef in self._merge_cdefs().items():
+            entries.setdefault(string, cdef)
+        if not entries or not all(isinstance(cdef.value, int) for cdef in entries.values()):
+            return ""
+        name = self.name.upper()
+        strings = list(entries)
+        seeds, slots = perfect_hash([string.encode() for string in strings])
+        size = len(strings)
+        value_type = 'unsigned long long' if max(cdef.value for cdef in entries.values()) > LLONG_MAX else 'long long'
+        text = quote if source is None else source.string
+
+        lines = [f'    static const int seeds[{size}] = {{']
+        lines += [f'        {seed},' for seed in seeds]
+        lines += ['    };',
+                  f'    static const char *const names[{size}] = {{']
+        lines += [f'        {text(strings[index])},' for index in slots]
+        lines += ['    };',
+                  f'    static const unsigned int lengths[{size}] = {{']
+        lines += [f'        {len(strings[index])},' for index in slots]
+        lines += ['    };',
+                  f'    static const {value_type} values[{size}] = {{']
+        lines += [f'        {entries[strings[index]].name},' for index in slots]
+        lines += ['    };',
+                  '    unsigned long length = strlen(str);',
+                  f'    int seed = seeds[transpose_name_hash(str, length, 0) % {size}];',
+                  f'    unsigned int slot = seed > 0 ? transpose_name_hash(str, length, seed) % {size} : '
+                  '(unsigned int)(-seed - 1);',
+                  '    if (lengths[slot] != length || memcmp(names[slot], str, length) != 0)',
+                  '        return 0;',
+                  '    *value = values[slot];',
+                  '    return 1;']
+        lines = function_lines(f'int {name}_FROM_STR(const char *str, {value_type} *value)', lines, source)
+        if source is None:
+            lines.insert(0, NAME_HASH_FUNCTION)
+        else:
+            source.uses_hash = True
+        return '\n'.join(lines)
+
+    @staticmethod
+    def is_flags(values: list):
+        """
+        Checks whether values are bit flags: the non zero values share no bits (each is a single bit, or a mask of
+        bits such as SHF_MASKOS), and have the shape of a bitmask rather than of a sequence: there are at least 3 of
+        them, or 2 that are not consecutive (so {0, 1, 2} and {7, 8} are not groups of flags, but {0, 1, 4} is)
+        :param values: list of the (unique) values
+        :rtype: bool
+        """
+        flags = sorted(value for value in values if value != 0)
+        if len(flags) < 2 or not all(isinstance(value, int) and 0 < value <= ULLONG_MAX for value in flags):
+            return False
+        known = 0
+        for value in flags:
+            if known & value:
+                return False
+            known |= value
+        # disjoint values can't hold 3 consecutive numbers, so only pairs can be sequences
+        return len(flags) >= 3 or flags[1] != flags[0] + 1
+
+    def create_flags_macro(self, style='switch', source=None):
+        """
+        creates 2 C macros for groups of bit flags (see is_flags):
+            self.name_FLAGS_MAX_LEN - holding the max length of the names returned
+            self.name_FLAGS_PARSER  - macro receiving a combination of flags and a buffer, that copies the names of the
+                                      set flags to the buffer, separated by |. only the set single bits are visited,
+                                      masks of many bits are named when all their bits are set
+        the functions style also creates the self.name_FLAGS_TO_STR function doing the copying (returning the
+        buffer), which self.name_FLAGS_PARSER calls
+        :param style: one of OUTPUT_STYLES
+        :param source: SourceFile of the functions style, None to define the function static inline
+        :return: string defining the macros (and the function), empty string if the values are not bit flags
+        :rtype: str
+        """
+        merged = self._merge_cdefs()
+        if not merged or not self.is_flags([cdef.value for cdef in merged.values()]):
+            return ""
+        name = self.name.upper()
+        flags = sorted([(cdef.value, string, cdef) for string, cdef in merged.items() if cdef.value != 0],
+                       key=lambda flag: flag[0])
+        bits = [flag for flag in flags if flag[0] & (flag[0] - 1) == 0]
+        masks = [flag for flag in flags if flag[0] & (flag[0] - 1) != 0]
+        zero_string = next((string for string, cdef in merged.items() if cdef.value == 0), '0')
+        known_mask = f'{sum(flag[0] for flag in flags):#x}ULL'
+        bits_mask = f'{sum(flag[0] for flag in bits):#x}ULL'
+        max_length = sum(len(string) + 1 for _, string, _ in flags) + len('Unknown') + 1
+        max_length = max(max_length, len(zero_string) + 1)
+        text = quote if source is None else source.string
+
+        # the locals are named so they can't shadow the arguments of the macro (i.e a variable named flags)
+        lines = ['    unsigned long long transpose_flags_ = (unsigned long long)(n);']
+        if masks:
+            lines.append('    unsigned long long transpose_value_ = transpose_flags_;')
+        lines += [f'    unsigned long long transpose_unknown_ = transpose_flags_ & ~{known_mask};',
+                  '    char *transpose_end_ = (buf);',
+                  f'    strcpy(transpose_end_, {text(zero_string)});']
+        if bits:
+            lines += [f'    for (transpose_flags_ &= {bits_mask}; transpose_flags_; '
+                      'transpose_flags_ &= transpose_flags_ - 1) {',
+                      '        const char *transpose_name_ = "";',
+                      '        switch (transpose_flags_ & -transpose_flags_) {']
+            for _, string, cdef in bits:
+                lines += [f'        case {cdef.name}:',
+                          f'                transpose_name_ = {text(string)};',
+                          '                break;']
+            lines += ['        }',
+                      '        if (transpose_end_ != (buf))',
+                      "                *transpose_end_++ = '|';",
+                      '        strcpy(transpose_end_, transpose_name_);',
+                      '        transpose_end_ += strlen(transpose_name_);',
+                      '    }']
+        for value, string, cdef in masks:
+            lines += [f'    if ((transpose_value_ & {value:#x}ULL) == {value:#x}ULL) {{',
+                      '        if (transpose_end_ != (buf))',
+                      "                *transpose_end_++ = '|';",
+                      f'        strcpy(transpose_end_, {text(string)});',
+                      f'        transpose_end_ += {len(string)};',
+                      '    } else {',
+                      f'        transpose_unknown_ |= transpose_value_ & {value:#x}ULL;',
+                      '    }']
+        lines += ['    if (transpose_unknown_) {',
+                  '        if (transpose_end_ != (buf))',
+                  "                *transpose_end_++ = '|';",
+                  f'        strcpy(transpose_end_, {text("Unknown")});',
+                  '    }']
+        if style != 'functions':
+            lines = [f'#define {name}_FLAGS_PARSER(n, buf) do {{'] + lines + ['} while (0);']
+            return f'#define {name}_FLAGS_MAX_LEN {max_length}\n' + '\n'.join(continue_lines(lines))
+        lines = function_lines(f'char *{name}_FLAGS_TO_STR(unsigned long long n, char *buf)',
+                               lines + ['    return buf;'], source)
+        lines += [f'#define {name}_FLAGS_PARSER(n, buf) do {{\\',
+                  f'    {name}_FLAGS_TO_STR((unsigned long long)(n), buf);\\',
+                  '} while (0);']
+        return f'#define {name}_FLAGS_MAX_LEN {max_length}\n' + '\n'.join(lines)
@@ -1,8 +1,7 @@
 from .macro_creator import MacroCreator, CDefinition
-from .arithmatic_parser import *
-import re
-
-HEX_REGEX = re.compile(r"0[xX]([0-9a-fA-F]+)")
+from .arithmatic_parser import create_arithmetic_parser
+from .macros_resolver import MacrosResolver
+from . import stats
 
 
 class Define(CDefinition):
@@ -10,6 +9,8 @@ class Define(CDefinition):
     class holding name and values extracted from #define
     values are use to try and merge lists of Define's to minimize resulting code
     """
+    __slots__ = ()
+
     def __init__(self, name, value):
         """
         casts value from string to integer, might raise ValueError
@@ -31,44 +32,18 @@ def strip_underscore(st: str):
     return st[:st.rindex('_')]
 
 
-def parse_macros_values(macros: dict):
+def parse_macros_values(macros: dict, backend='native'):
     """
     Arithmetically parse the values of integral (and floating point) macros, in order to help creating a one to one
-    mapping from values to names
+    mapping from values to names.
+    macros are evaluated in dependency order, so each macro is parsed once (see MacrosResolver for the cycles and
+    unresolved macros found)
     :param macros: dictionary of unparsed macros
+    :param backend: arithmetic backend used to evaluate the values (see ARITHMETIC_BACKENDS)
     :return: the macros dictionary, after parsing the values (in place)
     :rtype: dict
     """
-    values_changed = True
-    arithmetic_parser = MacrosArithmeticParser()
-    while values_changed:
-        values_changed = False
-        for name, value in macros.items():
-            new_value = None
-            if value and not isinstance(value, (int, float)):
-                try:
-                    result = arithmetic_parser.parse(value)
-                    new_value = result.evaluate()
-                except NameError:
-                    continue
-            if new_value is not None and new_value != value:
-                macros[name] = new_value
-                values_changed = True
-                arithmetic_parser.add_variables({name: new_value, })
-    return macros
-
-
-def hack_fix_hex_values(macros: dict):
-    """
-    iterate through macros and replace hex values from "0xabc" to "0x'abc'".
-    this is a dirty hack so the arithmetic parser for the 0x operator created will receive the number unparsed,
-    because the default numbers parser is evaluating 'a1' to 0
-    :param macros: dictionary of macros
-    :return: the macros dictionary, after replacing the values (in place)
-    :rtype: dict
-    """
-    for name, value in macros.items():
-        macros[name] = HEX_REGEX.sub(r"0x'\1'", value)
+    return MacrosResolver(macros, create_arithmetic_parser(backend)).resolve()
 
 
 def merge_prefixes(prefixes_dict: dict):
@@ -80,24 +55,16 @@ def merge_prefixes(prefixes_dict: dict):
     """
     # sorts the keys, because if a string is prefixed by another, they must be 'close' under lexicographic order
     keys = sorted(list(prefixes_dict.keys()))
-    merge_candidates = []
-    for i in range(len(keys)-1):
-        if keys[i+1].startswith(keys[i]):
-            merge_candidates.append(i)
+    values = [{define.value for define in prefixes_dict[key]} for key in keys]
 
     # reverse the candidates, because if we have 'a', 'aa', 'aaa',
     # then it's easier to merge 'aaa' with 'aa' and then 'aa' with 'a' (we only need one loop)
-    merge_candidates_rev = merge_candidates[::-1]
-    for i in merge_candidates_rev:
-        can_merge = True
+    for i in reversed(range(len(keys) - 1)):
         # we can't merge if the values of the Define's associated with each prefix are not disjoint
-        for define_1 in prefixes_dict[keys[i]]:
-            for define_2 in prefixes_dict[keys[i+1]]:
-                if define_1 == define_2:
-                    can_merge = False
-        if can_merge:
-            prefixes_dict[keys[i]] += prefixes_dict[keys[i+1]]
-            del prefixes_dict[keys[i+1]]
+        if keys[i + 1].startswith(keys[i]) and values[i].isdisjoint(values[i + 1]):
+            prefixes_dict[keys[i]] += prefixes_dict[keys[i + 1]]
+            values[i] |= values[i + 1]
+            del prefixes_dict[keys[i + 1]]
     return prefixes_dict
 
 
@@ -140,39 +107,36 @@ def find_prefixes(defines: list):
 
 def split_default_parser(defines: list):
     """
-    Split the defines without a prefix to different parsers, to preserve one to one correspondents
+    Split the defines without a prefix to different parsers, to preserve one to one correspondents.
+    the i-th define with a given value goes to the i-th parser, so the number of parsers is the largest number of defines
+    sharing a value (the minimum possible), and each parser keeps the order of defines
     :param defines: list of Define's that hadn't fit in one of the specific parsers
     :return: list of lists of uniquely valued defines
     """
     split_parsers = list()
+    occurrences = dict()
     for define in defines:
-        if not split_parsers:  # initialize
-            split_parsers.append([define, ])
-            continue
-        added = False
-        for parser in split_parsers:
-            can_add = True
-            for inserted_define in parser:
-                if define.value == inserted_define.value:
-                    can_add = False
-                    break
-            if can_add:
-                added = True
-                parser.append(define)
-        if not added:
-            split_parsers.append([define, ])
+        index = occurrences.get(define.value, 0)
+        occurrences[define.value] = index + 1
+        if index == len(split_parsers):
+            split_parsers.append([])
+        split_parsers[index].append(define)
     return split_parsers
 
 
-def create_define_macros(original_macros: dict):
+def group_defines(original_macros: dict, backend='native', group_prefix=''):
     """
-    Parses defines, groups them by prefix, and creates matching macros.
-    :param original_macros: dictionary of macros and their values
-    :return: list of created macros, and dict of parsed macros
-    :rtype: list
+    Parses defines and groups them by prefix, the defines without a prefix are split to default groups
+    :param original_macros: dictionary of macros and their values, parsed in place
+    :param backend: arithmetic backend used to evaluate the values (see ARITHMETIC_BACKENDS)
+    :param group_prefix: prefix of the names of the default groups (PREFIX_DEFAULT), which are named the same in every
+                         header otherwise (see header_group_prefix)
+    :return: list of MacroCreator's of the prefix groups, and list of MacroCreator's of the default groups
+    :rtype: tuple(list, list)
     """
-    hack_fix_hex_values(original_macros)
-    parse_macros_values(original_macros)
+    stats.count('macros', len(original_macros))
+    with stats.stage('evaluate macros'):
+        parse_macros_values(original_macros, backend)
 
     defines = list()
 
@@ -181,17 +145,55 @@ def create_define_macros(original_macros: dict):
             defines.append(Define(name, value))
         except (ValueError, TypeError):
             pass
-    prefixes, no_prefix = find_prefixes(defines)
-    prefixes = merge_prefixes(prefixes)
-    macros = []
-    for prefix in prefixes:
-        macros.append(MacroCreator(prefix, prefixes[prefix]).create_macro())
-
-    split_default_parsers = split_default_parser(no_prefix)
+    with stats.stage('group prefixes'):
+        prefixes, no_prefix = find_prefixes(defines)
+        prefixes = merge_prefixes(prefixes)
+        split_default_parsers = split_default_parser(no_prefix)
     if len(split_default_parsers) == 1:
-        macros.append(MacroCreator(f'_DEFAULT', no_prefix).create_macro())
+        default_creators = [MacroCreator(f'{group_prefix}_DEFAULT', no_prefix)]
     else:
-        for i in range(len(split_default_parsers)):
-            macros.append(MacroCreator(f'_DEFAULT_{i}', split_default_parsers[i]).create_macro())
-    return macros
-
+        default_creators = [MacroCreator(f'{group_prefix}_DEFAULT_{i}', split_default_parsers[i])
+                            for i in range(len(split_default_parsers))]
+    return [MacroCreator(prefix, prefixes[prefix]) for prefix in prefixes], default_creators
+
+
+def iter_define_macros(original_macros: dict, backend='native', style='switch', from_str=False, source=None,
+                       group_prefix=''):
+    """
+    Parses defines, groups them by prefix, and creates matching macros (and flags macros for groups of bit flags).
+    the macros are created one at a time, as they are consumed (the values are parsed before the first one)
+    :param original_macros: dictionary of macros and their values, parsed in place
+    :param backend: arithmetic backend used to evaluate the values (see ARITHMETIC_BACKENDS)
+    :param style: style of the created parsers (see OUTPUT_STYLES)
+    :param from_str: if True, also create a NAME_FROM_STR function for each group (see MacroCreator.create_from_str)
+    :param source: SourceFile the functions style defines the functions in, None to define them static inline
+    :param group_prefix: prefix of the names of the default groups (see group_defines)
+    :return: generator of the created macros
+    """
+    prefix_creators, default_creators = group_defines(original_macros, backend, group_prefix)
+    for i, macro_creator in enumerate(prefix_creators + default_creators):
+        with stats.stage('create define parsers'):
+            macro = macro_creator.create_macro(style, source)
+            # the default parsers hold unrelated defines, so they are not checked for flags
+            extra_macros = [macro_creator.create_flags_macro(style, source) if i < len(prefix_creators) else '',
+                            macro_creator.create_from_str(source) if from_str else '']
+        extra_macros = [extra_macro for extra_macro in extra_macros if extra_macro]
+        stats.count('parsers generated', 1 + len(extra_macros))
+        yield macro
+        yield from extra_macros
+
+
+def create_define_macros(original_macros: dict, backend='native', style='switch', from_str=False, source=None,
+                         group_prefix=''):
+    """
+    Parses defines, groups them by prefix, and creates matching macros (and flags macros for groups of bit flags).
+    :param original_macros: dictionary of macros and their values
+    :param backend: arithmetic backend used to evaluate the values (see ARITHMETIC_BACKENDS)
+    :param style: style of the created parsers (see OUTPUT_STYLES)
+    :param from_str: if True, also create a NAME_FROM_STR function for each group (see MacroCreator.create_from_str)
+    :param source: SourceFile the functions style defines the functions in, None to define them static inline
+    :param group_prefix: prefix of the names of the default groups (see group_defines)
+    :return: list of created macros
+    :rtype: list
+    """
+    return list(iter_define_macros(original_macros, backend, style, from_str, source, group_prefix))
@@ -0,0 +1,124 @@
+import re
+from .arithmatic_parser import MacrosArithmeticParser
+from . import stats
+
+# string and char literals and numbers are matched (and ignored) before identifiers, so identifiers inside them,
+# hex digits or integer suffixes (10UL) are not mistaken for references to other macros
+TOKEN_REGEX = re.compile(r"'(?:\\.|[^'\\])*'|\"(?:\\.|[^\"\\])*\"|\d[\w.]*|([A-Za-z_]\w*)")
+
+
+def extract_references(value: str):
+    """
+    Extract the identifiers a macro value refers to
+    :param value: unparsed value of a macro
+    :return: list of identifiers, ordered by first appearance
+    :rtype: list
+    """
+    return list(dict.fromkeys(match.group(1) for match in TOKEN_REGEX.finditer(value) if match.group(1)))
+
+
+class MacrosResolver:
+    """
+    Class resolving the values of macros, evaluating each macro once, after all the macros it depends on
+    """
+    def __init__(self, macros: dict, arithmetic_parser=None):
+        """
+        Creates a MacrosResolver object, and builds the dependency graph of the macros
+        :param macros: dictionary of unparsed macros
+        :param arithmetic_parser: parser used to evaluate the values, a new MacrosArithmeticParser by default
+        """
+        self.macros = macros
+        self.arithmetic_parser = arithmetic_parser if arithmetic_parser is not None else MacrosArithmeticParser()
+        self.dependencies = {}
+        self.cycles = []
+        self.unresolved = {}
+        for name, value in macros.items():
+            if value and not isinstance(value, (int, float)):
+                self.dependencies[name] = [ref for ref in extract_references(value) if ref in macros]
+            else:
+                self.dependencies[name] = []
+
+    def evaluation_order(self):
+        """
+        Orders the macros so each macro comes after the macros it depends on. cycles found on the way are saved in
+        self.cycles
+        :return: list of macro names
+        :rtype: list
+        """
+        order = []
+        done = set()
+        in_stack = set()
+        self.cycles = []
+        for root in self.dependencies:
+            if root in done:
+                continue
+            stack = [(root, iter(self.dependencies[root]))]
+            in_stack.add(root)
+            while stack:
+                name, dependencies = stack[-1]
+                for dependency in dependencies:
+                    if dependency in done:
+                        continue
+                    if dependency in in_stack:
+                        names = [entry[0] for entry in stack]
+                        self.cycles.append(names[names.index(dependency):])
+                        continue
+                    stack.append((dependency, iter(self.dependencies[dependency])))
+                    in_stack.add(dependency)
+                    break
+                else:
+                    stack.pop()
+                    in_stack.remove(name)
+                    done.add(name)
+                    order.append(name)
+        return order
+
+    def evaluate(self, name: str, value: str):
+        """
+        Evaluates a single macro value. string results are evaluated again, until they can not be parsed any more
+        :param name: name of the macro
+        :param value: unparsed value of the macro
+        :return: the parsed value, None if the value could not be parsed
+        """
+        new_value = None
+        while value and not isinstance(value, (int, float)):
+            stats.count('evaluation attempts')
+            try:
+                result = self.arithmetic_parser.parse(value).evaluate()
+            except Exception as error:
+                if new_value is None:
+                    self.unresolved[name] = str(error)
+                break
+            if result == value:
+                break
+            new_value = value = result
+        return new_value
+
+    def resolve(self):
+        """
+        Arithmetically parse the values of the macros, each macro is parsed exactly once
+        :return: the macros dictionary, after parsing the values (in place)
+        :rtype: dict
+        """
+        self.unresolved = {}
+        # already parsed values (i.e kept from a previous run) can be referred to by the other macros
+        self.arithmetic_parser.add_variables({name: value for name, value in self.macros.items()
+                                              if isinstance(value, (int, float))})
+        order = self.evaluation_order()
+        in_cycles = {name for cycle in self.cycles for name in cycle}
+        for name in order:
+            value = self.macros[name]
+            if not value or isinstance(value, (int, float)):
+                continue
+            if name in in_cycles:
+                self.unresolved[name] = 'macro is part of a dependency cycle'
+                continue
+            missing = [dependency for dependency in self.dependencies[name] if dependency in self.unresolved]
+            if missing:
+                self.unresolved[name] = f'depends on unresolved macros {", ".join(sorted(missing))}'
+                continue
+            new_value = self.evaluate(name, value)
+            if new_value is not None:
+                self.macros[name] = new_value
+                self.arithmetic_parser.add_variables({name: new_value, })
+        return self.macros
@@ -0,0 +1,136 @@
+import os
+from .fast_parser import create_parser
+from .macros_resolver import extract_references
+from . import stats
+
+
+def process_header(parser, path: str):
+    """
+    Removes comments, preprocesses and parses a single header loaded by parser
+    :param parser: CParser (or FastParser) holding the definitions the header is parsed with
+    :param path: path of the header
+    :return: the definitions of the header, in the CParser.file_defs format
+    :rtype: dict
+    """
+    with stats.stage('preprocess'):
+        parser.remove_comments(path)
+        parser.preprocess(path)
+    with stats.stage('parse definitions'):
+        parser.parse_defs(path)
+    stats.count('headers parsed')
+    base_name = os.path.basename(path)
+    # pyclibrary leaves headers without definitions out of file_defs, import_dict needs all the kinds
+    return {base_name: parser.file_defs.get(base_name, {kind: {} for kind in parser.data_list})}
+
+
+def parse_header(path: str, macros: dict, dependencies_defs: list, frontend='pyclibrary'):
+    """
+    Parses a single header, after importing the definitions of the headers it depends on
+    :param path: path of the header
+    :param macros: dictionary of macros to define before parsing the header
+    :param dependencies_defs: definitions of the headers path depends on, in topological order
+    :param frontend: front end parsing the header, pyclibrary or fast (see FRONTENDS)
+    :return: the definitions of the header, in the CParser.file_defs format
+    :rtype: dict
+    """
+    parser = create_parser([path], macros, frontend)
+    for file_defs in dependencies_defs:
+        parser.import_dict(file_defs)
+    return process_header(parser, path)
+
+
+def defined_names(file_defs: dict):
+    """
+    :param file_defs: definitions of a header, in the CParser.file_defs format
+    :return: set of all the names the header defines
+    :rtype: set
+    """
+    return {name for defs in file_defs.values() for names in defs.values() for name in names}
+
+
+def referenced_names(path: str, macros: dict, fnmacros: dict):
+    """
+    Collects the identifiers a header refers to, directly or through the expansion of macros
+    :param path: path of the header
+    :param macros: dictionary of macros defined before the header
+    :param fnmacros: dictionary of function like macros defined before the header
+    :return: set of identifiers
+    :rtype: set
+    """
+    with open(path, 'r', errors='replace') as reader:
+        pending = extract_references(reader.read())
+    names = set()
+    while pending:
+        name = pending.pop()
+        if name in names:
+            continue
+        names.add(name)
+        if isinstance(macros.get(name), str):
+            pending.extend(extract_references(macros[name]))
+        if name in fnmacros:
+            pending.extend(extract_references(str(fnmacros[name][0])))
+    return names
+
+
+def parse_headers_parallel(paths: list, macros: dict, dependencies: dict, jobs: int, known_defs=(),
+                           frontend='pyclibrary'):
+    """
+    Parses headers concurrently, level by level: each header is parsed as soon as all the headers it depends on are,
+    with only their definitions.
+    the results are then merged in topological order. a header which refers to a name defined by an earlier header it
+    does not depend on (or depends on a header whose definitions changed) is parsed again with all the definitions
+    before it, so the result matches parsing all the headers serially.
+    :param paths: list of path of headers to parse. should be ordered in topological ordering regarding dependency
+    :param macros: dictionary of macros to define before parsing the headers
+    :param dependencies: dictionary where [path] = set of paths of the headers path depends on (transitively)
+    :param jobs: number of processes to parse with
+    :param known_defs: definitions of the first headers in paths, that don't need to be parsed
+    :param frontend: front end parsing the headers, pyclibrary or fast (see FRONTENDS)
+    :return: the parser holding all the definitions, and a list of the definitions of each header
+    :rtype: tuple(CParser, list)
+    """
+    from concurrent.futures import ProcessPoolExecutor  # loads multiprocessing, which only parallel runs need
+    index = {path: i for i, path in enumerate(paths)}
+    headers_defs = list(known_defs) + [None] * (len(paths) - len(known_defs))
+    levels = {}
+    for path in paths[len(known_defs):]:
+        levels[path] = max([levels[dependency] + 1 for dependency in dependencies[path] if dependency in levels],
+                           default=0)
+    with ProcessPoolExecutor(jobs) as executor:
+        for level in range(max(levels.values(), default=-1) + 1):
+            futures = {}
+            for path in paths[len(known_defs):]:
+                if levels[path] != level:
+                    continue
+                dependencies_defs = [headers_defs[i] for i in sorted(index[dependency]
+                                                                     for dependency in dependencies[path])]
+                futures[path] = executor.submit(parse_header, path, macros, dependencies_defs, frontend)
+            for path, future in futures.items():
+                headers_defs[index[path]] = future.result()
+
+    parser = create_parser([], macros, frontend)
+    definers = {}
+    changed = set()
+    for i, path in enumerate(paths):
+        if i >= len(known_defs):
+            foreign = False
+            if not dependencies[path].isdisjoint(changed):
+                foreign = True
+            else:
+                for name in referenced_names(path, parser.defs['macros'], parser.defs['fnmacros']):
+                    if not definers.get(name, set()).issubset(dependencies[path]):
+                        foreign = True
+                        break
+            if foreign:
+                parser.load_file(path)
+                file_defs = process_header(parser, path)
+                if file_defs != headers_defs[i]:
+                    changed.add(path)
+                    headers_defs[i] = file_defs
+            else:
+                parser.import_dict(headers_defs[i])
+        else:
+            parser.import_dict(headers_defs[i])
+        for name in defined_names(headers_defs[i]):
+            definers.setdefault(name, set()).add(path)
+    return parser, headers_defs
@@ -0,0 +1,40 @@
+import re
+from plusminus import ArithmeticParser
+try:
+    from plusminus import LiteralNode
+except ImportError:
+    from plusminus.plusminus import LiteralNode
+
+HEX_REGEX = re.compile(r"0[xX]([0-9a-fA-F]+)")
+
+
+class PlusminusArithmeticParser(ArithmeticParser):
+    """
+    Evaluator of macros values based on plusminus, kept as a fallback backend for MacrosArithmeticParser
+    """
+    def add_variables(self, vars_dict: dict, reset=False):
+        """
+        Update the vars and constants dictionary used when parsing a string, if reset is True, then the current dictionary
+        is replaced with vars_dict
+        :param vars_dict: dictionary of constants and variables and their values
+        :param reset: if True, the old dictionary will be ignored
+        :return: None
+        """
+        formatted_dict = {}
+        for var_name, value in vars_dict.items():
+            formatted_dict[var_name] = LiteralNode([value])
+        if reset:
+            self._variable_map = formatted_dict
+        else:
+            self._variable_map.update(formatted_dict)
+
+    def _parse(self, expression: str, *args, **kwargs):
+        """
+        replaces hex values from "0xabc" to "0x'abc'" before parsing.
+        this is a dirty hack so the arithmetic parser for the 0x operator created will receive the number unparsed,
+        because the default numbers parser is evaluating 'a1' to 0
+        """
+        return super()._parse(HEX_REGEX.sub(r"0x'\1'", expression), *args, **kwargs)
+
+    def customize(self):
+        self.add_operator('0x', 1, ArithmeticParser.RIGHT, lambda a: int(a, 16))
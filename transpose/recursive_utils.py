@@ -1,8 +1,11 @@
 import os
+import shutil
 import subprocess
+from collections import deque
 import networkx as nx
 import pyclibrary
 import re
+from . import stats
 
 
 class RecursiveUtil:
@@ -14,8 +17,11 @@ class RecursiveUtil:
     END_MAGIC = 'End of search list.'
     REGEX_LOCAL = re.compile(r"^\s*\#\s*include\s*\"([^\"]+)\"")
     REGEX_GLOBAL = re.compile(r"^\s*\#\s*include\s*<([^<>]+)>")
+    # results of probing the compiler, by (compiler path, mtime, size, include dirs)
+    _probe_results = {}
 
-    def __init__(self, base_header: str, parse_std: bool, include_dirs: list, compiler: str, max_headers=20):
+    def __init__(self, base_header: str, parse_std: bool, include_dirs: list, compiler: str, max_headers=20,
+                 cache=None):
         """
         Creates a RecursiveUtil object, using the include_dirs and compiler to generate a full list of paths to search in
         :param header: name of the base header
@@ -23,19 +29,34 @@ class RecursiveUtil:
         :param include_dirs: list of include dirs
         :param compiler: path/name of the compiler
         :param max_headers: maximum number of headers to parse
+        :param cache: DefinitionsCache used to store the compiler's search path between runs, None to always probe
         """
         self.base_header = base_header
         self.parse_std = parse_std
-        self.include_dirs = self.get_include_dirs(compiler, include_dirs)
+        self.compiler = compiler
+        self.cache = cache
+        self.user_include_dirs = include_dirs
+        # the compiler's search path starts with the -I dirs, so #include "..." can be searched in them alone,
+        # and the compiler is only probed for headers not found there
+        self.compiler_dirs_loaded = parse_std
+        if parse_std:
+            self.include_dirs = self.get_include_dirs(compiler, include_dirs, cache)
+        else:
+            self.include_dirs = [os.path.realpath(include_dir) for include_dir in include_dirs]
         self.max_headers = max_headers
+        self.graph = None
+        # (header, including dir) -> path of the header
+        self.resolved_includes = {}
+        self.missing_headers = set()
 
     @staticmethod
-    def get_include_dirs(compiler: str, include_dirs: list):
+    def probe_include_dirs(compiler: str, include_dirs: list):
         """
-        Extract the include search order from the compiler
+        Runs the compiler to extract its include search order
         :param compiler: path/name of the compiler
         :param include_dirs: list of -I dir to add to the search
-        :return: ordered list of include search paths
+        :return: ordered list of include search paths, as printed by the compiler
+        :rtype: list
         """
         include = []
         for include_dir in include_dirs:
@@ -48,7 +69,36 @@ class RecursiveUtil:
         global_index = lines.index(RecursiveUtil.GLOBAL_INCLUDE_MAGIC)
         end_index = lines.index(RecursiveUtil.END_MAGIC)
         final_include = lines[local_index+1:global_index] + lines[global_index+1:end_index]
-        return [os.path.realpath(include_dir.strip()) for include_dir in final_include]
+        return [include_dir.strip() for include_dir in final_include]
+
+    @staticmethod
+    def get_include_dirs(compiler: str, include_dirs: list, cache=None):
+        """
+        Extract the include search order from the compiler. the result is remembered for the lifetime of the process,
+        and in cache (if given) keyed by the compiler binary and the -I dirs
+        :param compiler: path/name of the compiler
+        :param include_dirs: list of -I dir to add to the search
+        :param cache: DefinitionsCache to store the result in, None to only remember it in memory
+        :return: ordered list of include search paths
+        """
+        compiler_path = shutil.which(compiler)
+        key = None
+        if compiler_path is not None:
+            stat = os.stat(compiler_path)
+            key = (os.path.realpath(compiler_path), stat.st_mtime_ns, stat.st_size, tuple(include_dirs))
+        probed = RecursiveUtil._probe_results.get(key)
+        cache_key = cache.derived_key('include dirs', *key) if key is not None and cache is not None else None
+        if probed is None and cache_key is not None:
+            probed = cache.get(cache_key)
+        if probed is None:
+            with stats.stage('compiler probe'):
+                probed = RecursiveUtil.probe_include_dirs(compiler, include_dirs)
+            if cache_key is not None:
+                cache.put(cache_key, probed)
+        if key is not None:
+            RecursiveUtil._probe_results[key] = probed
+        # relative -I dirs are printed as given, so they are resolved only after loading
+        return [os.path.realpath(include_dir) for include_dir in probed]
 
     def find_header(self, header: str):
         """
@@ -58,58 +108,86 @@ class RecursiveUtil:
         :rtype: str
         """
         try:
-            return pyclibrary.utils.find_header(header, dirs=self.include_dirs)
+            return pyclibrary.utils.find_header(header, dirs=list(self.include_dirs))
         except OSError:
+            pass
+        if self.compiler_dirs_loaded:
             return None
+        self.compiler_dirs_loaded = True
+        self.include_dirs = self.get_include_dirs(self.compiler, self.user_include_dirs, self.cache)
+        return self.find_header(header)
 
-    def extract_dependencies(self, header: str):
+    def resolve_include(self, header: str, including_dir=None):
         """
-        Extract a list of headers our header depends on
-        :param header: name of the header
-        :return: list of headers
-        :rtype: list
+        Finds the path of an included header, results are memoized
+        :param header: header name, as written in the #include
+        :param including_dir: for #include "header.h", the directory of the including header, which is searched first
+        :return: the full path to the header, None if header was not found
+        :rtype: str
+        """
+        key = (header, including_dir)
+        if key not in self.resolved_includes:
+            path = None
+            if including_dir is not None:
+                candidate = os.path.join(including_dir, header)
+                if os.path.isfile(candidate):
+                    path = candidate
+            if path is None:
+                path = self.find_header(header)
+            self.resolved_includes[key] = path
+        return self.resolved_includes[key]
+
+    def scan_includes(self, path: str):
         """
-        path = self.find_header(header)
-        if not path:
-            raise ValueError(f'Header {header} not found in include directories')
-        with open(path, 'r') as reader:
-            header_data = reader.read()
-        lines = header_data.splitlines()
-        included_headers = []
-        for line in lines:
-            match = self.REGEX_LOCAL.match(line)
-            if not match and self.parse_std:
-                match = self.REGEX_GLOBAL.match(line)
-            if match:
-                included_headers.append(match.group(1))
-        return included_headers
+        Reads a header line by line, and yields the headers it includes
+        :param path: path of the header
+        :return: generator of (header name, True for #include "..." and False for #include <...>)
+        """
+        with open(path, 'r', errors='replace') as reader:
+            for line in reader:
+                if '#' not in line:
+                    continue
+                match = self.REGEX_LOCAL.match(line)
+                if match:
+                    yield match.group(1), True
+                elif self.parse_std:
+                    match = self.REGEX_GLOBAL.match(line)
+                    if match:
+                        yield match.group(1), False
 
     def build_dependencies_graph(self):
         """
-        Generates the dependencies graph of the base header
+        Generates the dependencies graph of the base header, by a breadth first traversal of the includes.
+        headers are identified by their real path, so each header is scanned once
         :return The dependencies graph
         :rtype: nx.DiGraph
         """
-        new_nodes = True
+        base_path = self.find_header(self.base_header)
+        if not base_path:
+            raise ValueError(f'Header {self.base_header} not found in include directories')
         graph = nx.DiGraph()
         graph.add_node(self.base_header)
-        parsed_headers = []
-        while new_nodes:
-            new_nodes = False
-            if len(graph) > self.max_headers:
-                raise ValueError(f'Needed headers surpasses the maximum allowed ({self.max_headers})')
-            graph_nodes = graph.copy().nodes
-            for current_header in graph_nodes:
-                if current_header in parsed_headers:
+        nodes = {os.path.realpath(base_path): self.base_header}
+        worklist = deque([(self.base_header, base_path)])
+        while worklist:
+            current_header, current_path = worklist.popleft()
+            including_dir = os.path.dirname(os.path.abspath(current_path))
+            for header, local in self.scan_includes(current_path):
+                header_path = self.resolve_include(header, including_dir if local else None)
+                if not header_path:
+                    if local:
+                        raise ValueError(f'Header {header} not found in include directories')
+                    # standard headers often include platform specific headers under #if, skip them
+                    self.missing_headers.add(header)
                     continue
-                headers = self.extract_dependencies(current_header)
-                for header in headers:
-                    if header not in graph:
-                        new_nodes = True
-                        header_full_path = self.find_header(header)
-                        graph.add_node(header_full_path)
-                        graph.add_edge(current_header, header_full_path)
-                parsed_headers.append(current_header)
+                real_path = os.path.realpath(header_path)
+                if real_path not in nodes:
+                    nodes[real_path] = real_path
+                    graph.add_node(real_path)
+                    if len(graph) > self.max_headers:
+                        raise ValueError(f'Needed headers surpasses the maximum allowed ({self.max_headers})')
+                    worklist.append((real_path, header_path))
+                graph.add_edge(current_header, nodes[real_path])
         return graph
 
     def create_header_traversal_list(self):
@@ -118,9 +196,19 @@ class RecursiveUtil:
         :return: list of headers
         :rtype: list
         """
-        graph = self.build_dependencies_graph()
+        with stats.stage('dependency crawl'):
+            graph = self.graph = self.build_dependencies_graph()
+        stats.count('headers found', len(graph))
         try:
             traversal_list = list(nx.algorithms.dag.topological_sort(graph))[::-1]
         except nx.NetworkXUnfeasible:
             raise ValueError("Dependencies graph contains cycles")
         return traversal_list
+
+    def header_dependencies(self):
+        """
+        Finds the headers each header depends on, directly or not. must be called after create_header_traversal_list
+        :return: dictionary where [header] = set of headers
+        :rtype: dict
+        """
+        return {header: nx.descendants(self.graph, header) for header in self.graph}
@@ -0,0 +1,86 @@
+import json
+
+UNKNOWN = 'Unknown'
+ULLONG_MAX = 2 ** 64 - 1
+
+
+class LookupTable:
+    """
+    Class holding the names of the values of an enum (or of defines sharing a prefix), finding them as the parsers
+    of the generated C header do
+    """
+    __slots__ = ('name', 'names', 'flags', '_mask', '_masks', '_known', '_zero')
+
+    def __init__(self, name: str, names: dict, flags=False):
+        """
+        :param name: name of the group, as in NAME_PARSER
+        :param names: dictionary where [value] = name
+        :param flags: True if the values are bit flags (see MacroCreator.is_flags)
+        """
+        self.name = name
+        self.names = names
+        self.flags = flags
+        # single bits are visited one by one, masks of many bits are named when all their bits are set
+        self._mask = sum(value for value in names if value and value & (value - 1) == 0) if flags else 0
+        self._masks = sorted(value for value in names if value & (value - 1)) if flags else []
+        self._known = self._mask + sum(self._masks)
+        self._zero = names.get(0, '0')
+
+    def __repr__(self):
+        return f'LookupTable({self.name!r}, {len(self.names)} values, flags={self.flags})'
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, value):
+        return value in self.names
+
+    def __getitem__(self, value):
+        return self.names[value]
+
+    def to_str(self, value):
+        """
+        :param value: value to find
+        :return: the name of value, as NAME_PARSER copies it
+        :rtype: str
+        """
+        return self.names.get(value, UNKNOWN)
+
+    def flags_to_str(self, value: int):
+        """
+        Names the set flags of a combination of flags, might raise ValueError
+        :param value: combination of flags
+        :return: the names of the set flags, separated by |, as NAME_FLAGS_PARSER copies them
+        :rtype: str
+        """
+        if not self.flags:
+            raise ValueError(f'{self.name} is not a group of bit flags')
+        value &= ULLONG_MAX
+        flags = value & self._mask
+        names = []
+        while flags:
+            names.append(self.names[flags & -flags])
+            flags &= flags - 1
+        unknown = value & ~self._known
+        for mask in self._masks:
+            if value & mask == mask:
+                names.append(self.names[mask])
+            else:
+                unknown |= value & mask
+        if unknown:
+            names.append(UNKNOWN)
+        return '|'.join(names) if names else self._zero
+
+
+def load_tables(path: str):
+    """
+    Loads a json file of lookup tables
+    :param path: path of the json file created by transpose --format json
+    :return: dictionary where [group name] = LookupTable
+    :rtype: dict
+    """
+    with open(path, 'r') as reader:
+        groups = json.load(reader)['groups']
+    return {group['name']: LookupTable(group['name'], {value: name for value, name in group['values']},
+                                       group['flags'])
+            for group in groups}
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import os
+import signal
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .cache import DefinitionsCache
+from .client import DEFAULT_SOCKET, connectable
+from .watch import WatchSession, PollingWatcher
+
+DEFAULT_WORKERS = 4
+# number of targets whose parsed headers are kept, the least recently transposed are dropped first
+MAX_SESSIONS = 256
+
+
+class _Target:
+    """
+    State kept between requests for a single target
+    """
+    def __init__(self, session: WatchSession):
+        self.session = session
+        self.watcher = PollingWatcher()
+        self.lock = threading.Lock()
+        # state of out_path after it was last written, to notice when something else changed it
+        self.output_state = None
+
+
+class TransposeServer:
+    """
+    Class transposing headers for clients connecting to a unix socket. the parsed headers, the dependency graph and
+    the values of the macros of each target are kept in memory (in a WatchSession), so a request only parses the
+    headers that changed (by modification time, size and inode) since the previous request for the same target.
+    the definitions of the parsed headers are also shared by all the targets, in a single in-memory DefinitionsCache
+    keyed as the command line's cache is, so a header parsed for one target isn't parsed again for another.
+    requests are handled by threads: reading the headers and writing the outputs overlap, but parsing holds the GIL,
+    so the parsing of concurrent requests is serialized (the sessions live in this process, so they can't be
+    handed to other processes)
+    """
+    def __init__(self, socket_path=DEFAULT_SOCKET, workers=DEFAULT_WORKERS, max_sessions=MAX_SESSIONS):
+        """
+        :param socket_path: path of the unix socket to listen on
+        :param workers: number of requests handled at the same time (their parsing is serialized by the GIL)
+        :param max_sessions: number of targets to keep in memory
+        """
+        self.socket_path = socket_path
+        self.workers = workers
+        self.max_sessions = max_sessions
+        self.targets = OrderedDict()
+        # parsed headers of all the targets, the keys cover the macros, the include directories and the front end
+        self.cache = DefinitionsCache(None)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_target(self, key: str, arguments: dict):
+        """
+        :param key: key of the target
+        :param arguments: arguments of WatchSession
+        :return: the kept state of the target, created if needed (might raise ValueError)
+        :rtype: _Target
+        """
+        with self._lock:
+            target = self.targets.pop(key, None)
+            if target is None:
+                target = _Target(WatchSession(**arguments, cache=self.cache))
+            self.targets[key] = target
+            while len(self.targets) > self.max_sessions:
+                self.targets.popitem(last=False)
+            return target
+
+    def transpose(self, arguments: dict):
+        """
+        Transposes a single target, as transpose.main does, using (and updating) the state kept for it.
+        can be called from many threads at once
+        :param arguments: dictionary of transpose_header arguments (without cache and jobs)
+        :return: exit code and error message (None if the target was transposed)
+        :rtype: tuple(int, str)
+        """
+        arguments = dict(arguments)
+        force = arguments.pop('force', False)
+        key = json.dumps(arguments, sort_keys=True)
+        try:
+            target = self._get_target(key, arguments)
+        except (TypeError, ValueError) as error:
+            return -1, str(error)
+        out_path = target.session.out_path
+        with target.lock:
+            if os.path.exists(out_path) and not force:
+                return -1, f'File {out_path} already exists, use -f to overwrite'
+            session = target.session
+            try:
+                changed = target.watcher.wait(0) if session.paths else None
+                if changed is None or changed or PollingWatcher.state(out_path) != target.output_state or \
+                        (session.depfile is not None and not os.path.exists(session.depfile)):
+                    session.update(changed)
+                    target.watcher.watch(session.paths)
+                    target.output_state = PollingWatcher.state(out_path)
+            except Exception as error:  # a header in the middle of an edit may not parse, the client gets the error
+                # the watcher already saw the changes, so the session is parsed again from scratch next time
+                with self._lock:
+                    if self.targets.get(key) is target:
+                        del self.targets[key]
+                return -1, str(error)
+        return 0, None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Handles a single request: a json object of transpose_header arguments, answered by a json object of exit and
+        error
+        """
+        line = await reader.readline()
+        if not line:  # clients checking whether the server is listening connect without a request
+            writer.close()
+            return
+        try:
+            arguments = json.loads(line)
+            if not isinstance(arguments, dict):
+                raise ValueError('the request must be a json object')
+            code, error = await asyncio.get_running_loop().run_in_executor(self._executor, self.transpose, arguments)
+        except ValueError as invalid:
+            code, error = -1, f'invalid request: {invalid}'
+        writer.write(json.dumps({'exit': code, 'error': error}).encode() + b'\n')
+        try:
+            await writer.drain()
+        except ConnectionError:  # the client gave up waiting
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """
+        Listens on the socket until cancelled
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        if os.path.exists(self.socket_path):
+            if connectable(self.socket_path):
+                raise ValueError(f'a server is already listening on {self.socket_path}')
+            os.unlink(self.socket_path)  # left by a server that did not exit cleanly
+        with ThreadPoolExecutor(self.workers) as self._executor:
+            server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+            try:
+                async with server:
+                    await server.serve_forever()
+            finally:
+                if os.path.exists(self.socket_path):
+                    os.unlink(self.socket_path)
+
+
+def serve_main(socket_path=DEFAULT_SOCKET, workers=DEFAULT_WORKERS):
+    """
+    Runs a server on socket_path until interrupted (by Ctrl+C or SIGTERM)
+    :param socket_path: path of the unix socket to listen on
+    :param workers: number of requests handled at the same time (their parsing is serialized by the GIL)
+    :return: 0 when interrupted, -1 if the server could not start
+    """
+    server = TransposeServer(socket_path, workers)
+
+    async def serve():
+        # background servers (started with &) ignore SIGINT, so they are stopped with SIGTERM
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        await server.serve()
+
+    print(f'Listening on {socket_path}, press Ctrl+C to stop')
+    try:
+        asyncio.run(serve())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        return 0
+    except (OSError, ValueError) as error:
+        print(error, file=sys.stderr)
+        return -1
+    return 0
@@ -0,0 +1,152 @@
+import cProfile
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# the Stats object collecting, None when not collecting
+_current = None
+
+
+class Stats:
+    """
+    Class collecting the wall time, peak memory and number of runs of each stage of a transpose run, and counters
+    (headers, macros, enums, evaluation attempts, parsers generated)
+    """
+    def __init__(self, trace_memory=True):
+        """
+        :param trace_memory: if True, the peak memory of each stage is measured with tracemalloc (which slows the run)
+        """
+        self.trace_memory = trace_memory
+        # [stage] = {'time': seconds, 'peak_memory': bytes, 'runs': count}, in the order the stages first ran.
+        # peak_memory is the highest memory allocated during a run of the stage, above what was allocated before it
+        self.stages = {}
+        self.counters = {}
+        # [memory at start, peak memory] of each running stage, innermost last
+        self._peaks = []
+
+    def count(self, name: str, amount=1):
+        """
+        Increases a counter
+        :param name: name of the counter
+        :param amount: amount to add
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Context manager measuring a stage, stages can be nested (the time and memory of a nested stage are included in
+        the stages around it)
+        :param name: name of the stage
+        """
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            # the peak is reset for the new stage, so the peak of the stages around it is saved first
+            if self._peaks:
+                self._peaks[-1][1] = max(self._peaks[-1][1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            self._peaks.append([current, current])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            entry = self.stages.setdefault(name, {'time': 0.0, 'peak_memory': 0, 'runs': 0})
+            entry['time'] += elapsed
+            entry['runs'] += 1
+            if tracing:
+                start_memory, peak = self._peaks.pop()
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                entry['peak_memory'] = max(entry['peak_memory'], peak - start_memory)
+                if self._peaks:
+                    self._peaks[-1][1] = max(self._peaks[-1][1], peak)
+
+    def as_dict(self):
+        """
+        :return: the stages and counters, in a json serializable format
+        :rtype: dict
+        """
+        return {'stages': self.stages, 'counters': self.counters}
+
+    def format(self):
+        """
+        :return: table of the stages and the counters
+        :rtype: str
+        """
+        lines = [f'{"stage":<24} {"time (s)":>10} {"peak memory (KB)":>17} {"runs":>6}']
+        for name, entry in self.stages.items():
+            memory = f'{entry["peak_memory"] // 1024:>17}' if self.trace_memory else f'{"-":>17}'
+            lines.append(f'{name:<24} {entry["time"]:>10.4f} {memory} {entry["runs"]:>6}')
+        lines.append('')
+        lines += [f'{name:<24} {value:>10}' for name, value in self.counters.items()]
+        return '\n'.join(lines)
+
+    def write_json(self, path: str):
+        """
+        :param path: path of the json file to write the stats to
+        """
+        with open(path, 'w') as writer:
+            json.dump(self.as_dict(), writer, indent=4)
+
+
+@contextmanager
+def collect_stats(trace_memory=True):
+    """
+    Context manager collecting the stats of the transpose functions called inside it (in the current process):
+        with collect_stats() as stats:
+            main(...)
+        print(stats.format())
+    :param trace_memory: if True, measure the peak memory of each stage with tracemalloc
+    :return: the Stats object
+    """
+    global _current
+    previous, _current = _current, Stats(trace_memory)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        with _current.stage('total'):
+            yield _current
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _current = previous
+
+
+@contextmanager
+def profile(path: str):
+    """
+    Context manager running the code inside it under cProfile, and writing the profile to path (for pstats or
+    snakeviz)
+    :param path: path of the profile file
+    :return: the cProfile.Profile object
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+def stage(name: str):
+    """
+    :param name: name of the stage
+    :return: context manager measuring the stage in the collected stats, or doing nothing when not collecting
+    """
+    if _current is None:
+        return nullcontext()
+    return _current.stage(name)
+
+
+def count(name: str, amount=1):
+    """
+    Increases a counter of the collected stats, does nothing when not collecting
+    :param name: name of the counter
+    :param amount: amount to add
+    """
+    if _current is not None:
+        _current.count(name, amount)
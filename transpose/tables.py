@@ -0,0 +1,57 @@
+import json
+from .enums import iter_enum_groups
+from .macros import group_defines
+from .macro_creator import MacroCreator
+from . import stats
+
+
+def iter_tables(enums: dict, macros: dict, backend='native'):
+    """
+    Creates the lookup tables of the same groups create_enum_macros and create_define_macros create parsers for,
+    one at a time, as they are consumed
+    :param enums: dictionary where enums[enum_name] is dictionary of enumees
+    :param macros: dictionary of macros and their values, parsed in place
+    :param backend: arithmetic backend used to evaluate the values (see ARITHMETIC_BACKENDS)
+    :return: generator of (name, dictionary where [value] = name, True if the values are bit flags)
+    """
+    for current_enum in iter_enum_groups(enums):
+        table = current_enum.create_table()
+        if table:
+            stats.count('tables generated')
+            yield current_enum.name, table, MacroCreator.is_flags(list(table))
+    prefix_creators, default_creators = group_defines(macros, backend)
+    for i, macro_creator in enumerate(prefix_creators + default_creators):
+        table = macro_creator.create_table()
+        if table:
+            stats.count('tables generated')
+            # the default groups hold unrelated defines, so they are not checked for flags
+            yield macro_creator.name, table, i < len(prefix_creators) and MacroCreator.is_flags(list(table))
+
+
+def iter_python_module(orig_path: str, tables):
+    """
+    Creates a python module of lookup tables piece by piece, its TABLES dictionary holds a LookupTable of each group
+    :param orig_path: path of the original file, mentioned in the module
+    :param tables: iterable of tables, as iter_tables creates them
+    :return: generator of the parts of the module
+    """
+    yield f'# Generated by transpose from {orig_path}, do not edit\nfrom transpose.runtime import LookupTable\n\n' \
+          'TABLES = {\n'
+    for name, table, flags in tables:
+        entries = ''.join(f'        {value!r}: {string!r},\n' for value, string in table.items())
+        yield f'    {name!r}: LookupTable({name!r}, {{\n{entries}    }}, flags={flags}),\n'
+    yield '}\n'
+
+
+def iter_json_tables(orig_path: str, tables):
+    """
+    Creates a json file of lookup tables piece by piece, loaded by runtime.load_tables
+    :param orig_path: path of the original file, mentioned in the file
+    :param tables: iterable of tables, as iter_tables creates them
+    :return: generator of the parts of the json file
+    """
+    yield f'{{"header": {json.dumps(orig_path)}, "groups": ['
+    for i, (name, table, flags) in enumerate(tables):
+        group = json.dumps({'name': name, 'flags': flags, 'values': list(table.items())})
+        yield f',\n{group}' if i else f'\n{group}'
+    yield '\n]}\n'
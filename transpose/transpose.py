@@ -1,8 +1,58 @@
 #! /usr/bin/env python
-from pyclibrary import CParser, utils
-from .enums import create_enum_macros
-from .macros import create_define_macros
-from .recursive_utils import *
+from .enums import iter_enum_macros
+from .macros import iter_define_macros
+from .cache import DefinitionsCache
+from .fast_parser import create_parser
+from .parallel_parser import process_header
+from .tables import iter_tables, iter_python_module, iter_json_tables
+from .macro_creator import SourceFile
+from . import stats
+import hashlib
+import os
+import re
+import stat
+import tempfile
+
+
+def iter_output(orig_path: str, enum_macros, define_macros):
+    """
+    Creates the generated header file piece by piece, so it can be written without holding all of it in memory
+    :param orig_path: path of the original file, to be included in the generated header
+    :param enum_macros: iterable of macros associated with extracted enum's
+    :param define_macros: iterable of macros associated with extracted define's
+    :return: generator of the parts of the header file
+    """
+    yield f'#pragma once\n#include <string.h>\n#include "{orig_path}"\n\n\n'
+    for i, macro in enumerate(enum_macros):
+        yield '\n\n\n' + macro if i else macro
+    yield '\n\n\n'
+    for i, macro in enumerate(define_macros):
+        yield '\n\n\n' + macro if i else macro
+
+
+def iter_formatted(orig_path: str, enums: dict, macros: dict, evaluator='native', style='switch', output_format='c',
+                   from_str=False, source=None, group_prefix=''):
+    """
+    Creates the generated file piece by piece, in one of OUTPUT_FORMATS
+    :param orig_path: path of the original file, to be included in (or mentioned by) the generated file
+    :param enums: dictionary where enums[enum_name] is dictionary of enumees
+    :param macros: dictionary of macros and their values, parsed in place
+    :param evaluator: arithmetic backend used to evaluate the values of the macros (native or plusminus)
+    :param style: style of the created parsers, switch, lookup or functions (see OUTPUT_STYLES)
+    :param output_format: c for a header of parsers, python for a module of lookup tables, json for a json file of
+                          lookup tables (see OUTPUT_FORMATS)
+    :param from_str: if True, the C header also has NAME_FROM_STR functions, finding the value of a name
+    :param source: SourceFile the functions style defines the functions in (filled as the parts are consumed), None
+                   to define them static inline in the header
+    :param group_prefix: prefix of the names of the default groups and the anonymous enums (see header_group_prefix)
+    :return: generator of the parts of the generated file
+    """
+    if output_format == 'python':
+        return iter_python_module(orig_path, iter_tables(enums, macros, evaluator))
+    if output_format == 'json':
+        return iter_json_tables(orig_path, iter_tables(enums, macros, evaluator))
+    return iter_output(orig_path, iter_enum_macros(enums, style, from_str, source, group_prefix),
+                       iter_define_macros(macros, evaluator, style, from_str, source, group_prefix))
 
 
 def create_output(orig_path: str, enum_macros: list, define_macros: list):
@@ -13,28 +63,329 @@ def create_output(orig_path: str, enum_macros: list, define_macros: list):
     :param define_macros: list of macros associated with extracted define's
     :return: header file with includes to the original header and string.h and all the macros created.
     """
-    header = f'#pragma once\n#include <string.h>\n#include "{orig_path}"\n\n\n'
-    header += '\n\n\n'.join(enum_macros)
-    header += '\n\n\n'
-    header += '\n\n\n'.join(define_macros)
-    return header
+    return ''.join(iter_output(orig_path, enum_macros, define_macros))
+
+
+def parse_macro_arguments(macros: list, include_dirs: list):
+    """
+    Checks the -D and -I arguments, might raise ValueError
+    :param macros: list of macros to pass to the header parser (i.e DEBUG=True)
+    :param include_dirs: list of include directories
+    :return: dictionary of the macros and their values
+    :rtype: dict
+    """
+    macros_dict = dict()
+    for macro in macros:
+        if macro.count('=') == 1:
+            key, value = macro.split('=')
+            macros_dict[key] = value
+        elif macro.count('=') == 0:
+            macros_dict[macro] = ''
+        else:
+            raise ValueError('macros must comply to the gcc -D argument format')
+    for include_dir in include_dirs:
+        if not os.path.isdir(include_dir):
+            raise ValueError(f'include dir {include_dir} does not exist')
+    return macros_dict
+
+
+def file_digest(path: str):
+    """
+    :param path: path of a file
+    :return: sha256 digest of the file's content, None if it can't be read
+    :rtype: bytes
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as reader:
+            for chunk in iter(lambda: reader.read(64 * 1024), b''):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.digest()
+
+
+def write_output(out_path: str, output):
+    """
+    Writes a generated file, unless out_path already holds the same content, so its mtime is kept.
+    the content is written to a temporary file that is renamed over out_path, so readers never see a partial file
+    :param out_path: path of the generated file
+    :param output: content of the generated file, or an iterable of its parts (written as they are created, so the
+                   whole content is never held in memory)
+    :return: True if the file was written
+    :rtype: bool
+    """
+    if isinstance(output, str):
+        if file_digest(out_path) == hashlib.sha256(output.encode()).digest():
+            return False
+        output = (output, )
+    try:
+        mode = stat.S_IMODE(os.stat(out_path).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(out_path)), suffix='.tmp')
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, 'wb') as writer:
+            for part in output:
+                data = part.encode()
+                digest.update(data)
+                writer.write(data)
+        if file_digest(out_path) == digest.digest():
+            os.unlink(temp_path)
+            return False
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, out_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return True
+
+
+def default_depfile(out_path: str):
+    """
+    :param out_path: path of the generated header
+    :return: path of the dependency file of out_path, as gcc -MD names it (out.h -> out.d)
+    :rtype: str
+    """
+    return os.path.splitext(out_path)[0] + '.d'
+
+
+def default_source(out_path: str):
+    """
+    :param out_path: path of the generated header
+    :return: path of the source file defining the functions of the functions style (out.h -> out.c)
+    :rtype: str
+    """
+    return os.path.splitext(out_path)[0] + '.c'
+
+
+def create_source(out_path: str, style: str, output_format: str):
+    """
+    :param out_path: path of the generated header
+    :param style: style of the created parsers (see OUTPUT_STYLES)
+    :param output_format: format of the generated file (see OUTPUT_FORMATS)
+    :return: SourceFile of the functions style (written to default_source(out_path)), None for the other styles and
+             formats. might raise ValueError
+    :rtype: SourceFile
+    """
+    if style != 'functions' or output_format != 'c':
+        return None
+    if default_source(out_path) == os.fspath(out_path):
+        raise ValueError(f'the functions style writes the functions to {default_source(out_path)}, '
+                         'the output file must not be a .c file')
+    return SourceFile(os.path.basename(out_path))
+
+
+def header_group_prefix(out_path: str, style: str, output_format: str, from_str=False):
+    """
+    The default groups and the anonymous enums are named the same in every header (_DEFAULT, ANON_ENUM0), so the
+    functions defined for them (by the lookup and functions styles, and by from_str) would collide in programs using many generated
+    headers: in a source file including two of them, or when linking their source files. they are prefixed by the
+    name of the generated header (out.h -> OUT_DEFAULT) when functions are defined for them
+    :param out_path: path of the generated header
+    :param style: style of the created parsers (see OUTPUT_STYLES)
+    :param output_format: format of the generated file (see OUTPUT_FORMATS)
+    :param from_str: True if NAME_FROM_STR functions are created
+    :return: prefix of the names of the default groups and the anonymous enums, empty string to keep their names
+    :rtype: str
+    """
+    if (style == 'switch' and not from_str) or output_format != 'c':
+        return ''
+    prefix = re.sub(r'\W', '_', os.path.splitext(os.path.basename(out_path))[0]).upper()
+    return '_' + prefix if prefix[:1].isdigit() else prefix
 
 
-def transpose_files(paths: list, macros: dict):
+def escape_make(path: str):
+    """
+    :param path: path to write in a makefile rule
+    :return: path with the characters make treats specially escaped
+    :rtype: str
+    """
+    return path.replace(' ', '\\ ').replace('#', '\\#').replace('$', '$$')
+
+
+def write_depfile(depfile: str, out_path: str, paths: list):
+    """
+    Writes a make compatible dependency file, as gcc -MD -MF depfile does, unless it did not change
+    :param depfile: path of the dependency file
+    :param out_path: path of the generated header, the target of the rule
+    :param paths: list of headers the generated header depends on
+    :return: True if the file was written
+    :rtype: bool
+    """
+    prerequisites = ''.join(f' \\\n {escape_make(path)}' for path in paths)
+    return write_output(depfile, f'{escape_make(str(out_path))}:{prerequisites}\n')
+
+
+def parse_headers(paths: list, macros: dict, cache=None, keys=None, dependencies=None, jobs=1,
+                  frontend='pyclibrary'):
+    """
+    Parses the header files in paths, definitions of headers found in the cache are loaded instead of being parsed
+    :param paths: list of path of headers to parse. should be ordered in topological ordering regarding dependency
+    :param macros: dictionary of macros to define before parsing the header
+    :param cache: DefinitionsCache to load definitions from and store them to, None to always parse
+    :param keys: cache keys of the headers in paths (see DefinitionsCache.header_keys)
+    :param dependencies: dictionary where [path] = set of headers path depends on, needed to parse in parallel
+    :param jobs: number of processes to parse independent headers with
+    :param frontend: front end parsing the headers, pyclibrary or fast (see FRONTENDS)
+    :return: the parser holding all the definitions
+    :rtype: CParser or FastParser
+    """
+    cached = []
+    if cache is not None:
+        for key in keys:
+            file_defs = cache.get(key)
+            if file_defs is None:
+                break
+            cached.append(file_defs)
+        stats.count('headers cached', len(cached))
+    if jobs > 1 and dependencies is not None and len(paths) - len(cached) > 1:
+        from .parallel_parser import parse_headers_parallel
+        parser, headers_defs = parse_headers_parallel(paths, macros, dependencies, jobs, cached, frontend)
+        if cache is not None:
+            for key, file_defs in zip(keys[len(cached):], headers_defs[len(cached):]):
+                cache.put(key, file_defs)
+        return parser
+    # the headers are processed one by one (as CParser's process_all does), so each of them can be cached and timed
+    parser = create_parser(paths[len(cached):], macros, frontend)
+    for file_defs in cached:
+        parser.import_dict(file_defs)
+    for i, path in enumerate(parser.file_order):
+        file_defs = process_header(parser, path)
+        if cache is not None:
+            cache.put(keys[len(cached) + i], file_defs)
+    return parser
+
+
+def iter_transposed(paths: list, macros: dict, evaluator='native', cache=None, include_dirs=(), dependencies=None,
+                    jobs=1, style='switch', output_format='c', frontend='pyclibrary', compiler='gcc', from_str=False,
+                    source=None, group_prefix=''):
+    """
+    Parses the header files in paths and creates the header file of macros piece by piece (see transpose_files)
+    :return: generator of the parts of the transposed header file
+    """
+    resolved = None
+    if frontend == 'compiler':
+        # the compiler also reads headers outside of paths (i.e system headers), which the cache keys don't cover
+        cache = None
+    if cache is not None:
+        keys = cache.header_keys(paths, macros, include_dirs, frontend)
+        resolved_key = cache.derived_key(keys[-1], evaluator)
+        resolved = cache.get(resolved_key)
+    if resolved is not None:
+        enums, parsed_macros = resolved['enums'], resolved['macros']
+    elif frontend == 'compiler':
+        from .compiler_parser import compiler_definitions
+        with stats.stage('parse headers'):
+            parsed_macros, enums = compiler_definitions(paths, macros, include_dirs, compiler)
+    else:
+        with stats.stage('parse headers'):
+            parser = parse_headers(paths, macros, cache, keys if cache is not None else None, dependencies, jobs,
+                                   frontend)
+        enums, parsed_macros = parser.defs['enums'], parser.defs['macros']
+
+    path = paths[-1]  # only the last header is needed to be included, as it will #include all the others
+    yield from iter_formatted(os.path.basename(path), enums, parsed_macros, evaluator, style, output_format, from_str,
+                              source, group_prefix)
+    if cache is not None and resolved is None:
+        cache.put(resolved_key, {'enums': enums, 'macros': parsed_macros})
+
+
+def transpose_files(paths: list, macros: dict, evaluator='native', cache=None, include_dirs=(), dependencies=None,
+                    jobs=1, style='switch', output_format='c', frontend='pyclibrary', compiler='gcc', from_str=False,
+                    source=None, group_prefix=''):
     """
     Parses the header files in paths and returns header file of macros
     :param paths: list of path of headers to create macros for. should be ordered in topological ordering regarding dependency
     :param macros: dictionary of macros to define before parsing the header
+    :param evaluator: arithmetic backend used to evaluate the values of the macros (native or plusminus)
+    :param cache: DefinitionsCache of parsed headers and resolved values, None to disable caching
+    :param include_dirs: list of include directories, part of the cache key
+    :param dependencies: dictionary where [path] = set of headers path depends on, needed to parse in parallel
+    :param jobs: number of processes to parse independent headers with
+    :param style: style of the created parsers, switch, lookup or functions (see OUTPUT_STYLES)
+    :param output_format: format of the generated file, c, python or json (see OUTPUT_FORMATS)
+    :param frontend: front end parsing the headers, pyclibrary, fast or compiler (see FRONTENDS)
+    :param compiler: compiler preprocessing the headers and evaluating the values with the compiler front end
+    :param from_str: if True, also create NAME_FROM_STR functions, finding the value of a name by a perfect hash
+    :param source: SourceFile the functions style defines the functions in, None to define them static inline
+    :param group_prefix: prefix of the names of the default groups and the anonymous enums (see header_group_prefix)
     :return: transposed header file content and dictionary of parsed macros
     :rtype: str
     """
-    parser = CParser(paths, macros=macros)
+    return ''.join(iter_transposed(paths, macros, evaluator, cache, include_dirs, dependencies, jobs, style,
+                                   output_format, frontend, compiler, from_str, source, group_prefix))
 
-    enum_macros = create_enum_macros(parser.defs['enums'])
-    define_macros = create_define_macros(parser.defs['macros'])
 
-    path = paths[-1]  # only the last header is needed to be included, as it will #include all the others
-    return create_output(os.path.basename(path), enum_macros, define_macros)
+def transpose_header(path: str,
+                     out_path: str,
+                     macros: list,
+                     recursive: bool,
+                     parse_std: bool,
+                     compiler: str,
+                     include_dirs: list,
+                     max_headers: int,
+                     force: bool,
+                     evaluator='native',
+                     cache=None,
+                     jobs=1,
+                     style='switch',
+                     depfile=None,
+                     output_format='c',
+                     frontend='pyclibrary',
+                     from_str=False
+                     ):
+    """
+    Parses the header file in path and outputs header file of macros to out_path, might raise ValueError.
+    out_path is only written if its content changed
+    :param path: path of header to create macros for
+    :param out_path: path in which the generated header will be created
+    :param macros: list of macros to pass to the header parser (i.e DEBUG=True)
+    :param recursive: if True, recursively run through included (local) header files (#include "header.h")
+    :param parse_std: if True, when recursing through included header files, also parse #include <header.h>
+    :param compiler: if parse_std, use the provided compiler to get the default include directories (the compiler
+                     front end also preprocesses the headers and evaluates the values with it)
+    :param include_dirs: list of include directories to search in when running recursively.
+    :param max_headers: maximum number of headers to parse in recursion mode
+    :param force: overwrite existing out_path
+    :param evaluator: arithmetic backend used to evaluate the values of the macros (native or plusminus)
+    :param cache: DefinitionsCache of parsed headers, None to disable caching
+    :param jobs: number of processes to parse independent headers with in recursion mode
+    :param style: style of the created parsers, switch, lookup or functions (see OUTPUT_STYLES), functions also writes
+                  the source file defining the functions next to out_path (see default_source)
+    :param depfile: path of a make compatible dependency file listing the parsed headers, None to not create one
+    :param output_format: format of the generated file, c, python or json (see OUTPUT_FORMATS)
+    :param frontend: front end parsing the headers, pyclibrary parses all the declarations, fast only extracts the
+                     macros and the enums, compiler preprocesses the headers and evaluates the values with compiler
+                     (see FRONTENDS)
+    :param from_str: if True, also create NAME_FROM_STR functions, finding the value of a name by a perfect hash
+    """
+    macros_dict = parse_macro_arguments(macros, include_dirs)
+    source = create_source(out_path, style, output_format)
+    group_prefix = header_group_prefix(out_path, style, output_format, from_str)
+    if recursive:
+        from .recursive_utils import RecursiveUtil  # networkx is only needed to order the headers in recursion mode
+        recursive_util = RecursiveUtil(path, parse_std, include_dirs, compiler, max_headers, cache)
+        traversal_list = recursive_util.create_header_traversal_list()
+        dependencies = recursive_util.header_dependencies() if jobs > 1 else None
+        output = iter_transposed(traversal_list, macros_dict, evaluator, cache, include_dirs, dependencies, jobs,
+                                 style, output_format, frontend, compiler, from_str, source, group_prefix)
+    else:
+        traversal_list = [path, ]
+        output = iter_transposed(traversal_list, macros_dict, evaluator, cache, include_dirs, style=style,
+                                 output_format=output_format, frontend=frontend, compiler=compiler, from_str=from_str,
+                                 source=source, group_prefix=group_prefix)
+    if os.path.exists(out_path) and not force:
+        raise ValueError(f'File {out_path} already exists, use -f to overwrite')
+    # the output is written as it is created, the headers are parsed when the first part is needed
+    write_output(out_path, output)
+    if source is not None:
+        write_output(default_source(out_path), source.iter_source())
+    if depfile is not None:
+        write_depfile(depfile, out_path, traversal_list)
 
 
 def main(path: str,
@@ -45,7 +396,15 @@ def main(path: str,
          compiler: str,
          include_dirs: list,
          max_headers: int,
-         force: bool
+         force: bool,
+         evaluator='native',
+         cache_dir=None,
+         jobs=1,
+         style='switch',
+         depfile=None,
+         output_format='c',
+         frontend='pyclibrary',
+         from_str=False
          ):
     """
     Parses the header file in path and outputs header file of macros to out_path
@@ -54,34 +413,74 @@ def main(path: str,
     :param macros: list of macros to pass to the header parser (i.e DEBUG=True)
     :param recursive: if True, recursively run through included (local) header files (#include "header.h")
     :param parse_std: if True, when recursing through included header files, also parse #include <header.h>
-    :param compiler: if parse_std, use the provided compiler to get the default include directories
+    :param compiler: if parse_std, use the provided compiler to get the default include directories (the compiler
+                     front end also preprocesses the headers and evaluates the values with it)
     :param include_dirs: list of include directories to search in when running recursively.
     :param max_headers: maximum number of headers to parse in recursion mode
     :param force: overwrite existing out_path
+    :param evaluator: arithmetic backend used to evaluate the values of the macros (native or plusminus)
+    :param cache_dir: directory of the parsed headers cache, None to disable caching
+    :param jobs: number of processes to parse independent headers with in recursion mode
+    :param style: style of the created parsers, switch, lookup or functions (see OUTPUT_STYLES), functions also writes
+                  the source file defining the functions next to out_path (see default_source)
+    :param depfile: path of a make compatible dependency file listing the parsed headers, None to not create one
+    :param output_format: format of the generated file, c, python or json (see OUTPUT_FORMATS)
+    :param frontend: front end parsing the headers, pyclibrary parses all the declarations, fast only extracts the
+                     macros and the enums, compiler preprocesses the headers and evaluates the values with compiler
+                     (see FRONTENDS)
+    :param from_str: if True, also create NAME_FROM_STR functions, finding the value of a name by a perfect hash
     """
     try:
-        macros_dict = dict()
-        for macro in macros:
-            if macro.count('=') == 1:
-                key, value = macro.split('=')
-                macros_dict[key] = value
-            elif macro.count('=') == 0:
-                macros_dict[macro] = ''
-            else:
-                raise ValueError('macros must comply to the gcc -D argument format')
-        for include_dir in include_dirs:
-            if not os.path.isdir(include_dir):
-                raise ValueError(f'include dir {include_dir} does not exist')
-        if recursive:
-            traversal_list = RecursiveUtil(path, parse_std, include_dirs, compiler, max_headers).create_header_traversal_list()
-            output = transpose_files(traversal_list, macros_dict)
-        else:
-            output = transpose_files([path, ], macros_dict)
-        if os.path.exists(out_path) and not force:
-            raise ValueError(f'File {out_path} already exists, use -f to overwrite')
-        with open(out_path, 'w') as fd:
-            fd.write(output)
+        cache = DefinitionsCache(cache_dir) if cache_dir is not None else None
+        transpose_header(path, out_path, macros, recursive, parse_std, compiler, include_dirs, max_headers, force,
+                         evaluator, cache, jobs, style, depfile, output_format, frontend, from_str)
         return 0
     except ValueError as error:
         print(error, file=os.sys.stderr)
         return -1
+
+
+# cache shared by all the targets transposed by a batch worker
+_batch_cache = None
+
+
+def _init_batch_worker(cache_dir):
+    global _batch_cache
+    _batch_cache = DefinitionsCache(cache_dir)
+
+
+def _batch_worker(target: dict):
+    """
+    Transposes a single target of a batch
+    :param target: dictionary of transpose_header arguments
+    :return: error message, None if the target was transposed
+    """
+    try:
+        transpose_header(cache=_batch_cache, **target)
+    except (OSError, ValueError) as error:
+        return str(error)
+    return None
+
+
+def batch_main(targets: list, jobs=1, cache_dir=None):
+    """
+    Transposes many headers in one process, sharing the compiler probe and the parsed headers between them
+    :param targets: list of dictionaries of transpose_header arguments (without cache)
+    :param jobs: number of processes to fan the targets out to
+    :param cache_dir: directory of the parsed headers cache, None to share parsed headers only in memory
+    :return: 0 if all the targets were transposed, -1 otherwise
+    """
+    if jobs > 1 and len(targets) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(min(jobs, len(targets)), initializer=_init_batch_worker,
+                                 initargs=(cache_dir, )) as executor:
+            errors = list(executor.map(_batch_worker, targets))
+    else:
+        _init_batch_worker(cache_dir)
+        errors = [_batch_worker(target) for target in targets]
+    result = 0
+    for target, error in zip(targets, errors):
+        if error is not None:
+            print(f'{target["path"]}: {error}', file=os.sys.stderr)
+            result = -1
+    return result
@@ -0,0 +1,423 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from .cache import DefinitionsCache
+from .fast_parser import create_parser
+from .macros_resolver import extract_references
+from .parallel_parser import process_header, defined_names, referenced_names
+from .recursive_utils import RecursiveUtil
+from .transpose import iter_formatted, parse_macro_arguments, write_output, write_depfile, create_source, \
+    default_source, header_group_prefix
+
+POLL_INTERVAL = 0.5
+# editors often save a file in a few steps (write a backup, rename, change attributes), so changes are collected
+# until no event arrives for this long
+DEBOUNCE_INTERVAL = 0.1
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class PollingWatcher:
+    """
+    Watches files by comparing their modification time and size every interval seconds
+    """
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self.states = {}
+
+    @staticmethod
+    def state(path: str):
+        """
+        :param path: path of a file
+        :return: modification time, size and inode of the file, None if it does not exist
+        :rtype: tuple
+        """
+        try:
+            stat = os.stat(path)
+            return stat.st_mtime_ns, stat.st_size, stat.st_ino
+        except OSError:
+            return None
+
+    def watch(self, paths: list):
+        """
+        Replaces the watched files. files already watched keep their state, so changes made since they were last seen
+        by wait are still found
+        :param paths: list of paths of the files to watch
+        """
+        real_paths = [os.path.realpath(path) for path in paths]
+        self.states = {path: self.states[path] if path in self.states else self.state(path) for path in real_paths}
+
+    def wait(self, timeout=None):
+        """
+        Waits until some of the watched files change
+        :param timeout: maximum number of seconds to wait, None to wait forever
+        :return: set of real paths of the changed files, empty if the timeout passed
+        :rtype: set
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = set()
+            for path, state in self.states.items():
+                new_state = self.state(path)
+                if new_state != state:
+                    self.states[path] = new_state
+                    changed.add(path)
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return changed
+            time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Watches files with inotify (linux only). the directories of the files are watched, so files replaced by a rename
+    (as most editors save) are still watched
+    """
+    def __init__(self):
+        """
+        Creates an InotifyWatcher object, might raise OSError (or AttributeError when inotify is not available)
+        """
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.directories = {}
+        self.paths = set()
+
+    def watch(self, paths: list):
+        """
+        Replaces the watched files
+        :param paths: list of paths of the files to watch
+        """
+        self.paths = {os.path.realpath(path) for path in paths}
+        directories = {os.path.dirname(path) for path in self.paths}
+        for wd, directory in list(self.directories.items()):
+            if directory not in directories:
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.directories[wd]
+        for directory in directories - set(self.directories.values()):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), INOTIFY_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                raise OSError(error, os.strerror(error), directory)
+            self.directories[wd] = directory
+
+    def _read_events(self):
+        """
+        :return: set of real paths of the watched files named by the pending events
+        :rtype: set
+        """
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if wd in self.directories and name:
+                path = os.path.join(self.directories[wd], os.fsdecode(name))
+                if path in self.paths:
+                    changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        Waits until some of the watched files change
+        :param timeout: maximum number of seconds to wait, None to wait forever
+        :return: set of real paths of the changed files, empty if the timeout passed
+        :rtype: set
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changed = set()
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if changed:
+                remaining = DEBOUNCE_INTERVAL
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                if changed or remaining is not None:
+                    return changed
+                continue
+            changed |= self._read_events()
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_watcher():
+    """
+    :return: an InotifyWatcher if inotify is available, a PollingWatcher otherwise
+    """
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError):
+        return PollingWatcher()
+
+
+class WatchSession:
+    """
+    Class keeping the parsed headers and the values of the macros of a transposed header in memory, so when headers
+    change only they, the headers referring to what they define, and the macros depending on changed macros are parsed
+    again
+    """
+    def __init__(self,
+                 path: str,
+                 out_path: str,
+                 macros: list,
+                 recursive: bool,
+                 parse_std: bool,
+                 compiler: str,
+                 include_dirs: list,
+                 max_headers: int,
+                 evaluator='native',
+                 style='switch',
+                 cache=None,
+                 depfile=None,
+                 output_format='c',
+                 frontend='pyclibrary',
+                 from_str=False
+                 ):
+        """
+        Creates a WatchSession object, might raise ValueError. the arguments are the same as transpose_header's
+        :param cache: DefinitionsCache of parsed headers and of the compiler's search path (can be shared by many
+        sessions), None to always parse and probe
+        :param depfile: path of a make compatible dependency file listing the parsed headers, None to not create one
+        :param output_format: format of the generated file, c, python or json (see OUTPUT_FORMATS)
+        :param frontend: front end parsing the headers, pyclibrary, fast or compiler (see FRONTENDS)
+        :param from_str: if True, also create NAME_FROM_STR functions, finding the value of a name
+        """
+        self.path = path
+        self.out_path = out_path
+        self.macros = parse_macro_arguments(macros, include_dirs)
+        self.recursive = recursive
+        self.parse_std = parse_std
+        self.compiler = compiler
+        self.include_dirs = include_dirs
+        self.max_headers = max_headers
+        self.evaluator = evaluator
+        self.style = style
+        self.cache = cache
+        self.depfile = depfile
+        self.output_format = output_format
+        self.frontend = frontend
+        self.from_str = from_str
+        self.paths = []
+        # [path] = definitions of the header, in the CParser.file_defs format
+        self.headers_defs = {}
+        # [path] = list of the headers included by the header
+        self.includes = {}
+        # [name] = (unparsed value, names referred to by the value)
+        self.references = {}
+        self.parsed_macros = {}
+        # number of headers parsed by the last update
+        self.parsed_headers = 0
+
+    def _traversal_list(self):
+        """
+        :return: list of headers to parse, and dictionary of the headers each of them includes
+        :rtype: tuple(list, dict)
+        """
+        if not self.recursive:
+            return [self.path, ], {}
+        recursive_util = RecursiveUtil(self.path, self.parse_std, self.include_dirs, self.compiler,
+                                       self.max_headers, self.cache)
+        paths = recursive_util.create_header_traversal_list()
+        return paths, {path: list(recursive_util.scan_includes(path)) for path in paths}
+
+    def _includes_changed(self, changed: set):
+        """
+        :param changed: set of real paths of the changed headers
+        :return: True if any of the changed headers includes different headers than before
+        :rtype: bool
+        """
+        if not self.recursive:
+            return False
+        recursive_util = RecursiveUtil(self.path, self.parse_std, self.include_dirs, self.compiler,
+                                       self.max_headers, self.cache)
+        for path in self.paths:
+            if os.path.realpath(path) in changed:
+                if not os.path.isfile(path):
+                    return True
+                if list(recursive_util.scan_includes(path)) != self.includes.get(path):
+                    return True
+        return False
+
+    def _dirty_macros(self, macros: dict):
+        """
+        Finds the macros whose values have to be parsed again: new or changed macros, and all the macros referring to
+        them, directly or not
+        :param macros: dictionary of unparsed macros
+        :return: set of names, and the references of the macros to keep for the next update
+        :rtype: tuple(set, dict)
+        """
+        dirty = {name for name in self.references if name not in macros}
+        references = {}
+        users = {}
+        for name, value in macros.items():
+            reference = self.references.get(name)
+            if reference is None or reference[0] != value:
+                dirty.add(name)
+                reference = (value, extract_references(value) if isinstance(value, str) else [])
+            references[name] = reference
+            for referenced in reference[1]:
+                users.setdefault(referenced, []).append(name)
+        pending = list(dirty)
+        while pending:
+            for user in users.get(pending.pop(), ()):
+                if user not in dirty:
+                    dirty.add(user)
+                    pending.append(user)
+        return dirty, references
+
+    def _parse_headers(self, paths: list, changed):
+        """
+        Parses the changed headers, and the headers referring to what changed, the definitions of the other headers
+        are imported from the previous update
+        :param paths: list of headers, in the order they are parsed
+        :param changed: set of real paths of the changed headers, None to parse everything
+        :return: the definitions of all the headers, and dictionary of the definitions of each header
+        :rtype: tuple(dict, dict)
+        """
+        parser = create_parser([], self.macros, self.frontend)
+        headers_defs = {}
+        changed_names = set()
+        keys = None
+        self.parsed_headers = 0
+        for i, path in enumerate(paths):
+            file_defs = self.headers_defs.get(path) if changed is not None else None
+            if file_defs is None or os.path.realpath(path) in changed or \
+                    not changed_names.isdisjoint(referenced_names(path, parser.defs['macros'],
+                                                                  parser.defs['fnmacros'])):
+                new_defs = None
+                if self.cache is not None:
+                    if keys is None:  # the keys are chained, so they are created for all the headers at once
+                        try:
+                            keys = self.cache.header_keys(paths, self.macros, self.include_dirs, self.frontend)
+                        except OSError as error:
+                            raise ValueError(f'Header {error.filename} not found')
+                    new_defs = self.cache.get(keys[i])
+                if new_defs is not None:
+                    parser.import_dict(new_defs)
+                else:
+                    if not parser.load_file(path):
+                        raise ValueError(f'Header {path} not found')
+                    new_defs = process_header(parser, path)
+                    self.parsed_headers += 1
+                    if self.cache is not None:
+                        self.cache.put(keys[i], new_defs)
+                if new_defs != file_defs:
+                    changed_names |= defined_names(new_defs)
+                    if file_defs is not None:
+                        changed_names |= defined_names(file_defs)
+                file_defs = new_defs
+            else:
+                parser.import_dict(file_defs)
+            headers_defs[path] = file_defs
+        return parser.defs, headers_defs
+
+    def update(self, changed=None):
+        """
+        Parses the changed headers (and the headers affected by them) and writes the output (and the dependency file)
+        if it changed
+        :param changed: set of real paths of the changed headers, None to parse everything
+        :return: True if the output file was written
+        :rtype: bool
+        """
+        if changed is None or self._includes_changed(changed):
+            paths, includes = self._traversal_list()
+        else:
+            paths, includes = self.paths, self.includes
+        if paths != self.paths:
+            changed = None
+
+        if self.frontend == 'compiler':
+            from .compiler_parser import compiler_definitions
+            # the compiler preprocesses all the headers at once and evaluates all the values, nothing is kept
+            macros, enums = compiler_definitions(paths, self.macros, self.include_dirs, self.compiler)
+            self.parsed_headers = len(paths)
+            headers_defs, references = {}, {}
+        else:
+            defs, headers_defs = self._parse_headers(paths, changed)
+            enums, macros = defs['enums'], dict(defs['macros'])
+            dirty, references = self._dirty_macros(macros)
+            for name in macros:
+                if name not in dirty and isinstance(self.parsed_macros.get(name), (int, float)):
+                    macros[name] = self.parsed_macros[name]
+        source = create_source(self.out_path, self.style, self.output_format)
+        written = write_output(self.out_path, iter_formatted(os.path.basename(paths[-1]), enums, macros,
+                                                             self.evaluator, self.style, self.output_format,
+                                                             self.from_str, source,
+                                                             header_group_prefix(self.out_path, self.style,
+                                                                                 self.output_format, self.from_str)))
+        if source is not None:
+            written = write_output(default_source(self.out_path), source.iter_source()) or written
+
+        self.paths, self.includes, self.headers_defs = paths, includes, headers_defs
+        self.references, self.parsed_macros = references, macros
+        if self.depfile is not None:
+            write_depfile(self.depfile, self.out_path, paths)
+        return written
+
+
+def watch_main(path: str,
+               out_path: str,
+               macros: list,
+               recursive: bool,
+               parse_std: bool,
+               compiler: str,
+               include_dirs: list,
+               max_headers: int,
+               force: bool,
+               evaluator='native',
+               style='switch',
+               depfile=None,
+               cache_dir=None,
+               output_format='c',
+               frontend='pyclibrary',
+               from_str=False
+               ):
+    """
+    Transposes the header file in path to out_path, and transposes it again whenever it (or the headers it includes)
+    changes, until interrupted. the arguments are the same as main's
+    """
+    try:
+        cache = DefinitionsCache(cache_dir) if cache_dir is not None else None
+        session = WatchSession(path, out_path, macros, recursive, parse_std, compiler, include_dirs, max_headers,
+                               evaluator, style, cache, depfile, output_format, frontend, from_str)
+        if os.path.exists(out_path) and not force:
+            raise ValueError(f'File {out_path} already exists, use -f to overwrite')
+        session.update()
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return -1
+    print(f'Watching {len(session.paths)} headers, press Ctrl+C to stop')
+    watcher = create_watcher()
+    try:
+        while True:
+            watcher.watch(session.paths)
+            changed = watcher.wait()
+            try:
+                if session.update(changed):
+                    print(f'Updated {out_path} ({session.parsed_headers} headers parsed)')
+            except Exception as error:  # a header saved in the middle of an edit may not parse, wait for the next save
+                print(error, file=sys.stderr)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        watcher.close()